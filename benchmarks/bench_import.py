@@ -0,0 +1,68 @@
+"""
+Movie ingestion throughput: one create_movie-style insert per row against the bulk importer.
+
+    python -m benchmarks.bench_import [rows] [batch_size]
+
+Runs against DATABASE_URL, or a throwaway SQLite file when it is not set.
+"""
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench_import.db")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("LOG_SINK", "memory")
+
+from datetime import datetime, timezone
+
+from capstone.database import Base, SessionLocal, engine
+from capstone.movie import bulk
+from capstone.movie.models import Movie, MovieStats
+from capstone.user.models import User
+
+
+def ndjson(rows : int, prefix : str):
+    return io.StringIO("".join(
+        json.dumps({"title": f"{prefix} {i}", "description": f"{prefix} benchmark movie number {i}"}) + "\n"
+        for i in range(rows)
+    ))
+
+
+def per_row(db, lines, user_id : int):
+    # What create_movie does for every request: add, commit, refresh
+    for line in lines:
+        payload = json.loads(line)
+        now = datetime.now(timezone.utc)
+        movie = Movie(**payload, release_date=now, updated_at=now, user_id=user_id, stats=MovieStats(rating_count=0, rating_sum=0))
+        db.add(movie)
+        db.commit()
+        db.refresh(movie)
+
+
+def main(rows : int = 20000, batch_size : int = bulk.IMPORT_BATCH_SIZE):
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        user = User(username=f"bench-{time.time_ns()}", email=f"bench-{time.time_ns()}@example.com", password="x")
+        db.add(user)
+        db.commit()
+
+        started = time.perf_counter()
+        per_row(db, ndjson(rows, "Row"), user.id)
+        before = time.perf_counter() - started
+
+        started = time.perf_counter()
+        report = bulk.import_movies(db, ndjson(rows, "Bulk"), user.id, batch_size=batch_size)
+        after = time.perf_counter() - started
+
+    print(f"database                  : {engine.url.get_backend_name()} ({engine.dialect.driver})")
+    print(f"one insert per row        : {rows / before:10.0f} rows/s")
+    print(f"bulk import, batch {batch_size:<6} : {report['inserted'] / after:10.0f} rows/s")
+    print(f"speedup                   : {before / after:10.1f}x")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,40 @@
+"""
+Per-request cost of verify_token, with and without the verified-token cache.
+
+    python -m benchmarks.bench_jwt [iterations]
+"""
+import os
+import sys
+import timeit
+
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+
+from fastapi import HTTPException
+
+import capstone.auth.jwt as jwt
+
+
+def main(iterations : int = 20000):
+    token = jwt.create_access_token({"sub": "benchmark", "uid": 1})
+    credentials_exception = HTTPException(status_code=401)
+
+    def uncached():
+        jwt.verified_tokens.clear()
+        jwt.verify_token(token, credentials_exception)
+
+    def cached():
+        jwt.verify_token(token, credentials_exception)
+
+    clear_cost = timeit.timeit(jwt.verified_tokens.clear, number=iterations) / iterations
+    before = timeit.timeit(uncached, number=iterations) / iterations - clear_cost
+    jwt.verify_token(token, credentials_exception)
+    after = timeit.timeit(cached, number=iterations) / iterations
+
+    print(f"verify_token, full decode : {before * 1e6:8.2f} us/request")
+    print(f"verify_token, cache hit   : {after * 1e6:8.2f} us/request")
+    print(f"speedup                   : {before / after:8.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,75 @@
+"""
+Cold start cost of `import capstone.main`, measured with `python -X importtime` in fresh interpreters.
+
+    python -m benchmarks.bench_startup [runs] [budget_ms]
+
+Prints the median import time and the slowest top-level packages, and exits with status 1 when the
+median goes over the budget (STARTUP_BUDGET_MS, 2000 ms by default) or when a module that is meant
+to load lazily (Sentry, passlib) is imported at startup.
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "2000"))
+TARGET = "capstone.main"
+# Only loaded on first use: Sentry when a DSN is set, passlib on the first password hash
+LAZY_MODULES = ("sentry_sdk", "passlib")
+
+
+def child_env():
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench_startup.db")
+    env.setdefault("SECRET_KEY", "benchmark-secret")
+    env.setdefault("ALGORITHM", "HS256")
+    return env
+
+
+def import_times(env):
+    """One `-X importtime` run, returns {module: (self_us, cumulative_us)}."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {TARGET}"],
+        env=env, capture_output=True, text=True, check=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        if own.strip().isdigit():
+            times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def by_package(times):
+    packages = defaultdict(int)
+    for name, (own, _) in times.items():
+        packages[name.split(".")[0]] += own
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)
+
+
+def main(runs : int = 5, budget_ms : float = STARTUP_BUDGET_MS):
+    env = child_env()
+    samples = [import_times(env) for _ in range(runs)]
+    median_ms = statistics.median(sample[TARGET][1] for sample in samples) / 1000
+    eager = [name for name in LAZY_MODULES if any(name in sample for sample in samples)]
+
+    print(f"import {TARGET:<22}: {median_ms:8.1f} ms (median of {runs}, budget {budget_ms:.0f} ms)")
+    print("slowest packages (self time):")
+    for package, own in by_package(samples[-1])[:10]:
+        print(f"  {package:<30}: {own / 1000:8.1f} ms")
+    for name in eager:
+        print(f"{name} is imported at startup, it should load lazily")
+
+    over_budget = median_ms > budget_ms
+    if over_budget:
+        print(f"over budget by {median_ms - budget_ms:.1f} ms")
+    return 1 if over_budget or eager else 0
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:3]
+    sys.exit(main(int(args[0]) if args else 5, float(args[1]) if len(args) > 1 else STARTUP_BUDGET_MS))
@@ -0,0 +1,284 @@
+"""
+Load test for the movie and user APIs: req/s and latency percentiles per scenario.
+
+    python -m benchmarks.seed --scale small          # once, against the same DATABASE_URL
+    python -m benchmarks.loadtest [--serve] [--base-url URL] [--scenarios browse,search,rate,comment,login]
+                                  [--scale small] [--concurrency 20] [--duration 30] [--seed 42]
+                                  [--output results.json] [--baseline previous.json] [--tolerance 0.1]
+
+Each scenario runs on its own for --duration seconds with --concurrency virtual users, each logged
+in as one of the users seeded at --scale. Request choices come from a random generator seeded per
+virtual user, so two runs against the same seeded database issue the same requests. rate and comment
+write, so runs that are compared should each start from a freshly seeded database.
+
+With --serve a local uvicorn is started on DATABASE_URL (--workers processes) and stopped afterwards.
+Results are written as JSON together with the commit they were measured on. With --baseline, p99 or
+throughput that is worse than the baseline's by more than --tolerance is reported, and the exit status is 1.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+import httpx
+
+from benchmarks.seed import PASSWORD, SCALES, USERNAME, WORDS
+
+SCENARIOS = ("browse", "search", "rate", "comment", "login")
+
+
+class VirtualUser:
+    """One simulated client, with its own seeded generator and access token."""
+
+    def __init__(self, client : httpx.AsyncClient, rng : random.Random, username : str, movie_count : int):
+        self.client = client
+        self.rng = rng
+        self.username = username
+        self.movie_count = movie_count
+        self.headers = {}
+        self.cursor = None
+
+    async def login(self):
+        response = await self.client.post("/user/auth/login", data={"username": self.username, "password": PASSWORD})
+        response.raise_for_status()
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    def movie_id(self):
+        # Skewed towards the first movies, which the generator made the popular ones
+        return min(int(self.rng.paretovariate(1.2)), self.movie_count)
+
+    async def browse(self):
+        roll = self.rng.random()
+        if roll < 0.4:
+            params = {"limit": 20}
+            if self.cursor and self.rng.random() < 0.7:
+                params["cursor"] = self.cursor
+            response = await self.client.get("/movie/", params=params)
+            if response.status_code == 200:
+                self.cursor = response.json()["next_cursor"]
+            return "GET /movie/", response
+        movie_id = self.movie_id()
+        if roll < 0.7:
+            return "GET /movie/{id}", await self.client.get(f"/movie/{movie_id}")
+        if roll < 0.85:
+            return "GET /movie/{id}/ratings/summary", await self.client.get(f"/movie/{movie_id}/ratings/summary")
+        return "GET /movie/{id}/comments", await self.client.get(f"/movie/{movie_id}/comments", params={"tree": True})
+
+    async def search(self):
+        q = " ".join(self.rng.sample(WORDS, self.rng.choice((1, 1, 2))))
+        return "GET /movie/search", await self.client.get("/movie/search", params={"q": q, "limit": 20})
+
+    async def rate(self):
+        # A movie this user already rated answers 400, which is part of the workload and not an error
+        movie_id = self.movie_id()
+        payload = {"movie_id": movie_id, "rating": self.rng.randint(1, 10)}
+        return "POST /movie/{id}/rate", await self.client.post(f"/movie/{movie_id}/rate", json=payload, headers=self.headers)
+
+    async def comment(self):
+        movie_id = self.movie_id()
+        payload = {"movie_id": movie_id, "content": " ".join(self.rng.choices(WORDS, k=self.rng.randint(3, 20)))}
+        return "POST /movie/{id}/comment", await self.client.post(f"/movie/{movie_id}/comment", json=payload, headers=self.headers)
+
+    async def login_again(self):
+        response = await self.client.post("/user/auth/login", data={"username": self.username, "password": PASSWORD})
+        return "POST /user/auth/login", response
+
+
+EXPECTED_STATUS = {
+    "browse": {200, 304},
+    "search": {200},
+    "rate": {201, 400},
+    "comment": {201},
+    "login": {200},
+}
+
+
+def percentile(ordered, fraction : float):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def summarize(latencies, statuses, errors : int, elapsed : float):
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "requests_per_second": round(len(ordered) / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            "mean": round(sum(ordered) / len(ordered) * 1000, 2) if ordered else None,
+            **{name: round(percentile(ordered, fraction) * 1000, 2) if ordered else None
+               for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))},
+            "max": round(ordered[-1] * 1000, 2) if ordered else None,
+        },
+        "status": {str(code): count for code, count in sorted(statuses.items())},
+    }
+
+
+async def run_scenario(base_url : str, scenario : str, concurrency : int, duration : float, users : int, movies : int, seed : int):
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+    errors = Counter()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        clients = [
+            VirtualUser(client, random.Random(f"{seed}:{scenario}:{n}"), USERNAME.format(n % users), movies)
+            for n in range(concurrency)
+        ]
+        await asyncio.gather(*(user.login() for user in clients))
+        step = {"login": "login_again"}.get(scenario, scenario)
+        deadline = time.perf_counter() + duration
+
+        async def loop(user : VirtualUser):
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    endpoint, response = await getattr(user, step)()
+                except httpx.HTTPError as exc:
+                    errors[type(exc).__name__] += 1
+                    continue
+                latencies[endpoint].append(time.perf_counter() - started)
+                statuses[endpoint][response.status_code] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(loop(user) for user in clients))
+        elapsed = time.perf_counter() - started
+
+    unexpected = {endpoint: sum(count for code, count in codes.items() if code not in EXPECTED_STATUS[scenario])
+                  for endpoint, codes in statuses.items()}
+    overall = summarize(
+        [latency for values in latencies.values() for latency in values],
+        sum(statuses.values(), Counter()),
+        sum(unexpected.values()) + sum(errors.values()),
+        elapsed,
+    )
+    overall["transport_errors"] = dict(errors)
+    overall["endpoints"] = {
+        endpoint: summarize(values, statuses[endpoint], unexpected[endpoint], elapsed)
+        for endpoint, values in sorted(latencies.items())
+    }
+    return overall
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers : int):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "capstone.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--no-access-log"],
+        # Set to match, so the app can tell it is one of several workers
+        env=dict(os.environ, WEB_CONCURRENCY=str(workers)),
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(300):
+        try:
+            if httpx.get(f"{base_url}/metrics", timeout=1).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            pass
+        if process.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with status {process.returncode}")
+        time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("uvicorn did not start within 30s")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def regressions(results, baseline, tolerance : float):
+    found = []
+    for scenario, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if not previous:
+            continue
+        old_p99, new_p99 = previous["latency_ms"]["p99"], current["latency_ms"]["p99"]
+        if old_p99 and new_p99 and new_p99 > old_p99 * (1 + tolerance):
+            found.append(f"{scenario}: p99 {old_p99} ms -> {new_p99} ms")
+        old_rps, new_rps = previous["requests_per_second"], current["requests_per_second"]
+        if old_rps and new_rps is not None and new_rps < old_rps * (1 - tolerance):
+            found.append(f"{scenario}: {old_rps} req/s -> {new_rps} req/s")
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.loadtest", description="Load test the movie and user APIs.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--serve", action="store_true", help="start a local uvicorn on DATABASE_URL for the run")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--scale", choices=SCALES, default="small", help="the scale the database was seeded at")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    scenarios = [name for name in args.scenarios.split(",") if name]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    # Seeded ids start at 1, so the scale tells which users exist and which movie ids to ask for
+    users, movies = SCALES[args.scale]["users"], SCALES[args.scale]["movies"]
+    process, base_url = start_server(args.workers) if args.serve else (None, args.base_url)
+    try:
+        results = {
+            "commit": git_commit(),
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "config": {
+                "scenarios": scenarios, "concurrency": args.concurrency, "duration": args.duration,
+                "scale": args.scale, "seed": args.seed, "workers": args.workers if args.serve else None,
+            },
+            "scenarios": {},
+        }
+        for scenario in scenarios:
+            summary = asyncio.run(run_scenario(base_url, scenario, args.concurrency, args.duration, users, movies, args.seed))
+            results["scenarios"][scenario] = summary
+            latency = summary["latency_ms"]
+            print(
+                f"{scenario:<8}: {summary['requests_per_second'] or 0:8.1f} req/s   p50 {latency['p50'] or 0:7.1f} ms"
+                f"   p99 {latency['p99'] or 0:7.1f} ms   errors {summary['errors']}"
+            )
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+            output.write("\n")
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            found = regressions(results, json.load(baseline), args.tolerance)
+        for regression in found:
+            print(f"regression: {regression}")
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
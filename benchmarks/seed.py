@@ -0,0 +1,164 @@
+"""
+Seeded data generator for the load tests: users, movies, ratings and comments at a chosen scale.
+
+    python -m benchmarks.seed [--scale small|medium|large] [--users N] [--movies N]
+                              [--ratings-per-user N] [--comments N] [--seed 42]
+
+Writes to DATABASE_URL after `alembic upgrade head`, and refuses to touch a database that already
+has movies. The same seed and scale always produce the same rows. Every user is named
+loadtest_<n> and shares PASSWORD, so benchmarks.loadtest can log in as any of them.
+"""
+import argparse
+import random
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import func, insert, select
+
+from capstone.auth.hash import get_pwd_context
+from capstone.database import DATABASE_URL, SessionLocal
+from capstone.movie.models import Comment, Movie, MovieStats, Rating, bayesian_score, description_fingerprint
+from capstone.user.models import User
+
+PASSWORD = "loadtest-password"
+USERNAME = "loadtest_{}"
+BATCH_SIZE = 5000
+
+SCALES = {
+    "small": {"users": 100, "movies": 1000, "ratings_per_user": 20, "comments": 2000},
+    "medium": {"users": 1000, "movies": 20000, "ratings_per_user": 50, "comments": 50000},
+    "large": {"users": 10000, "movies": 200000, "ratings_per_user": 100, "comments": 500000},
+}
+
+# Titles and descriptions are drawn from a small vocabulary so search terms have realistic hit counts
+WORDS = (
+    "night", "city", "love", "war", "last", "dark", "river", "star", "ghost", "king", "summer", "secret",
+    "road", "storm", "island", "machine", "garden", "winter", "silent", "fire", "ocean", "dream", "shadow",
+    "empire", "stranger", "return", "edge", "heart", "mountain", "signal", "hunter", "glass", "echo", "north",
+)
+# Ratings lean positive like real catalogs do
+RATING_WEIGHTS = (1, 1, 2, 3, 5, 8, 12, 14, 10, 6)
+
+
+def insert_returning_ids(db, model, rows):
+    ids = []
+    for start in range(0, len(rows), BATCH_SIZE):
+        result = db.execute(insert(model).returning(model.id, sort_by_parameter_order=True), rows[start:start + BATCH_SIZE])
+        ids.extend(result.scalars().all())
+    return ids
+
+
+def insert_rows(db, model, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.execute(insert(model), rows[start:start + BATCH_SIZE])
+
+
+def seed(db, rng, users : int, movies : int, ratings_per_user : int, comments : int):
+    now = datetime.now(timezone.utc)
+    # One hash at the configured cost for everyone, hashing each user separately would dominate the run
+    password = get_pwd_context().hash(PASSWORD)
+    user_ids = insert_returning_ids(db, User, [
+        {"username": USERNAME.format(n), "email": f"{USERNAME.format(n)}@example.com", "password": password}
+        for n in range(users)
+    ])
+
+    movie_rows = []
+    for n in range(movies):
+        title = " ".join(rng.sample(WORDS, rng.randint(1, 3))).title() + f" {n}"
+        description = " ".join(rng.choices(WORDS, k=rng.randint(8, 30)))
+        released = now - timedelta(days=rng.uniform(0, 40 * 365))
+        movie_rows.append({
+            "title": title,
+            "description": description,
+            "description_hash": description_fingerprint(description),
+            "release_date": released,
+            "updated_at": released,
+            "user_id": rng.choice(user_ids),
+        })
+    movie_ids = insert_returning_ids(db, Movie, movie_rows)
+
+    # A few popular movies collect most of the ratings and comments
+    popularity = [1 / (rank + 1) ** 0.8 for rank in range(len(movie_ids))]
+    stats = {movie_id: [0] * 10 for movie_id in movie_ids}
+    rating_rows = []
+    for user_id in user_ids:
+        rated = set(rng.choices(movie_ids, weights=popularity, k=min(ratings_per_user, len(movie_ids))))
+        for movie_id in rated:
+            rating = rng.choices(range(1, 11), weights=RATING_WEIGHTS)[0]
+            stats[movie_id][rating - 1] += 1
+            rating_rows.append({"user_id": user_id, "movie_id": movie_id, "rating": rating})
+    insert_rows(db, Rating, rating_rows)
+
+    # About a third of the comments are replies to an earlier comment on the same movie
+    top_level = comments - comments // 3
+    comment_movies = rng.choices(movie_ids, weights=popularity, k=top_level)
+    comment_ids = insert_returning_ids(db, Comment, [
+        {"user_id": rng.choice(user_ids), "movie_id": movie_id, "content": " ".join(rng.choices(WORDS, k=rng.randint(3, 20)))}
+        for movie_id in comment_movies
+    ])
+    threads = list(zip(comment_ids, comment_movies))
+    reply_rows = []
+    for _ in range(comments // 3):
+        parent_id, movie_id = rng.choice(threads)
+        reply_rows.append({
+            "user_id": rng.choice(user_ids), "movie_id": movie_id, "parent_id": parent_id,
+            "content": " ".join(rng.choices(WORDS, k=rng.randint(3, 12))),
+        })
+    insert_rows(db, Comment, reply_rows)
+
+    comment_counts = Counter(comment_movies)
+    comment_counts.update(row["movie_id"] for row in reply_rows)
+    # No trending_score: seeded activity has no timestamps, so nothing trends until the load test writes
+    stats_rows = []
+    for movie_id, histogram in stats.items():
+        count = sum(histogram)
+        total = sum(value * buckets for value, buckets in enumerate(histogram, start=1))
+        stats_rows.append({
+            "movie_id": movie_id,
+            "rating_count": count,
+            "rating_sum": total,
+            **{f"rating_{value}": buckets for value, buckets in enumerate(histogram, start=1)},
+            "comment_count": comment_counts[movie_id],
+            "bayesian_score": bayesian_score(count, total) if count else None,
+        })
+    insert_rows(db, MovieStats, stats_rows)
+    db.commit()
+    return {"users": len(user_ids), "movies": len(movie_ids), "ratings": len(rating_rows), "comments": comments}
+
+
+def migrate():
+    config = Config(str(Path(__file__).resolve().parents[1] / "alembic.ini"))
+    config.set_main_option("sqlalchemy.url", DATABASE_URL)
+    command.upgrade(config, "head")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.seed", description="Seed a database for the load tests.")
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--movies", type=int)
+    parser.add_argument("--ratings-per-user", type=int)
+    parser.add_argument("--comments", type=int)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+    sizes = {name: getattr(args, name) or default for name, default in SCALES[args.scale].items()}
+
+    migrate()
+    with SessionLocal() as db:
+        if db.execute(select(func.count()).select_from(Movie)).scalar():
+            parser.error("the database already has movies, seed an empty one so runs stay comparable")
+        started = time.perf_counter()
+        counts = seed(db, random.Random(args.seed), **sizes)
+
+    print(f"seeded {counts} with seed {args.seed} in {time.perf_counter() - started:.1f}s")
+    print(f"log in as {USERNAME.format(0)} .. {USERNAME.format(counts['users'] - 1)} with password {PASSWORD!r}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,104 @@
-from passlib.context import CryptContext
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 
+from fastapi import HTTPException, status
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated = "auto")
+from capstone.metrics import (
+    PASSWORD_HASH_QUEUE_DEPTH, PASSWORD_HASH_REJECTED, PASSWORD_HASH_SECONDS, PASSWORD_HASH_WAIT_SECONDS
+)
+from capstone.settings import settings
+
+
+BCRYPT_ROUNDS = settings.bcrypt_rounds
+# Worker processes double as the concurrency limit, extra jobs wait in the pool's queue
+HASH_WORKERS = settings.hash_workers
+# Jobs allowed to wait or run at once before login/signup are shed with a 503
+HASH_MAX_QUEUE = settings.hash_max_queue
+
+
+@functools.lru_cache(maxsize=None)
+def get_pwd_context():
+    """Built on first use in each process that hashes, so importing the app does not load passlib."""
+    from passlib.context import CryptContext
+
+    # min/max pinned to the configured cost so needs_update() flags hashes made with any other cost
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated = "auto",
+        bcrypt__default_rounds=BCRYPT_ROUNDS,
+        bcrypt__min_rounds=BCRYPT_ROUNDS,
+        bcrypt__max_rounds=BCRYPT_ROUNDS
+    )
+
+
+_executor = None
+_pending = 0
+_lock = threading.Lock()
+
+
+def _run_timed(operation : str, *args):
+    """Runs in a worker process, returns the result with its wall-clock start and duration."""
+    started_at = time.time()
+    result = getattr(get_pwd_context(), operation)(*args)
+    return result, started_at, time.time() - started_at
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+        return _executor
+
+
+def shutdown_pool():
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def _submit(operation : str, *args):
+    global _pending
+    with _lock:
+        if _pending >= HASH_MAX_QUEUE:
+            PASSWORD_HASH_REJECTED.inc()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many authentication requests, try again shortly",
+                headers={"Retry-After": "1"}
+            )
+        _pending += 1
+    PASSWORD_HASH_QUEUE_DEPTH.inc()
+    submitted_at = time.time()
+    try:
+        result, started_at, duration = await asyncio.wrap_future(_get_executor().submit(_run_timed, operation, *args))
+    finally:
+        with _lock:
+            _pending -= 1
+        PASSWORD_HASH_QUEUE_DEPTH.dec()
+    PASSWORD_HASH_WAIT_SECONDS.observe(max(started_at - submitted_at, 0))
+    PASSWORD_HASH_SECONDS.labels(operation).observe(duration)
+    return result
 
 
 class Hash:
       
       
     def bcrypt(password : str):
-           hashed_password = pwd_context.hash(password)
+           hashed_password = get_pwd_context().hash(password)
            return hashed_password
 
     def verify(plain_password, hashed_password):
-          return pwd_context.verify( plain_password, hashed_password)
\ No newline at end of file
+          return get_pwd_context().verify( plain_password, hashed_password)
+
+    async def bcrypt_async(password : str):
+          return await _submit("hash", password)
+
+    async def verify_and_update_async(plain_password, hashed_password):
+          """Returns (valid, new_hash), new_hash is set when the stored hash uses a different cost."""
+          return await _submit("verify_and_update", plain_password, hashed_password)
@@ -1,31 +1,50 @@
-import os
-from dotenv import load_dotenv
-load_dotenv()
+import time
+from datetime import datetime, timedelta, timezone
 
 from jose import JWTError, jwt
 
 import capstone.user.schema as user_schemas
+from capstone.cache import TTLCache
+from capstone.metrics import CACHE_REQUESTS
+from capstone.settings import settings
 
-DATABASE_URL = os.getenv("DATABASE_URL")
+SECRET_KEY = settings.secret_key
+ALGORITHM = settings.algorithm
+ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire_minutes
 
-SECRET_KEY = os.getenv("SECRET_KEY")
-ALGORITHM = os.getenv("ALGORITHM")
+# token -> TokenData for tokens whose signature has already been checked, never kept past their exp
+verified_tokens = TTLCache(
+    maxsize=settings.token_cache_size,
+    ttl=settings.token_cache_ttl
+)
 
 
-def create_access_token(data: dict):
+def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
+    issued_at = datetime.now(timezone.utc)
+    expire = issued_at + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    to_encode.update({"iat": issued_at, "exp": expire})
     encoded_token = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_token
 
 
 def verify_token(token : str, credentials_exception):
+    token_data = verified_tokens.get(token)
+    if token_data is not None:
+        CACHE_REQUESTS.labels("token", "hit").inc()
+        return token_data
+    CACHE_REQUESTS.labels("token", "miss").inc()
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-        token_data = user_schemas.TokenData(username=username)
-        return token_data
+        token_data = user_schemas.TokenData(username=username, user_id=payload.get("uid"))
 
     except JWTError:
         raise credentials_exception
+
+    expires_in = payload["exp"] - time.time() if "exp" in payload else None
+    if expires_in is None or expires_in > 0:
+        verified_tokens.set(token, token_data, ttl=None if expires_in is None else min(expires_in, verified_tokens.ttl))
+    return token_data
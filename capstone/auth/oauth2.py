@@ -1,15 +1,51 @@
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 import capstone.auth.jwt as jwt
+from capstone.cache import TTLCache
+from capstone.database import db_dependency, run_in_session
+from capstone.metrics import CACHE_REQUESTS
+from capstone.settings import settings
+from capstone.user.models import User
+from capstone.user.schema import CurrentUser
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl = "user/auth/login")
 
-def get_current_user(data : str = Depends(oauth2_scheme)):
+# username -> CurrentUser, so authenticated writes don't look the user up again on every request
+principal_cache = TTLCache(
+    maxsize=settings.principal_cache_size,
+    ttl=settings.principal_cache_ttl
+)
+
+
+def load_principal(db, username : str):
+    user = db.query(User.id, User.username).filter(User.username == username).first()
+    if user is None:
+        return None
+    return CurrentUser(id=user.id, username=user.username)
+
+
+def invalidate_principal(username : str):
+    """Call whenever a user row is created, renamed or removed."""
+    principal_cache.pop(username)
+
+
+async def get_current_user(db : db_dependency, data : str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
 
-    return jwt.verify_token(data, credentials_exception)
\ No newline at end of file
+    token_data = jwt.verify_token(data, credentials_exception)
+    if token_data.user_id is not None:
+        return CurrentUser(id=token_data.user_id, username=token_data.username)
+    # Tokens issued before the uid claim existed still need the id looked up
+    principal = principal_cache.get(token_data.username)
+    CACHE_REQUESTS.labels("principal", "miss" if principal is None else "hit").inc()
+    if principal is None:
+        principal = await run_in_session(db, load_principal, token_data.username)
+        if principal is None:
+            raise credentials_exception
+        principal_cache.set(token_data.username, principal)
+    return principal
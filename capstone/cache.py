@@ -0,0 +1,194 @@
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+
+from capstone.logger import get_logger
+from capstone.metrics import CACHE_REQUESTS
+from capstone.settings import settings
+
+logger = get_logger(__name__)
+
+
+class TTLCache:
+    """
+    Thread-safe, size-bounded LRU where every entry expires after a time to live.
+    Entries can be given their own ttl, e.g. to stop caching a token once it expires.
+    """
+
+    def __init__(self, maxsize : int = 1024, ttl : float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl : float | None = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[0] if item else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class LocalCacheBackend:
+    """In-process LRU, each worker process keeps its own copy."""
+    blocking = False
+
+    def __init__(self, maxsize : int = 10000, ttl : float = 60.0):
+        self._store = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, key : str):
+        return self._store.get(key)
+
+    def set(self, key : str, value, ttl : float, only_if_missing : bool = False):
+        with self._lock:
+            if only_if_missing and self._store.get(key) is not None:
+                return
+            self._store.set(key, value, ttl=ttl)
+
+    def delete(self, key : str):
+        self._store.pop(key)
+
+    def clear(self):
+        self._store.clear()
+
+
+class RedisCacheBackend:
+    """
+    Shared cache over the Redis protocol. `client` is anything with the redis-py
+    get/set(ex=, nx=)/delete API, such as redis.Redis.from_url(...) or a test fake.
+    """
+    blocking = True
+
+    def __init__(self, client, prefix : str = "capstone:"):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key : str):
+        raw = self.client.get(self.prefix + key)
+        return None if raw is None else json.loads(raw)
+
+    def set(self, key : str, value, ttl : float, only_if_missing : bool = False):
+        self.client.set(self.prefix + key, json.dumps(value), ex=max(1, math.ceil(ttl)), nx=only_if_missing)
+
+    def delete(self, key : str):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        pass
+
+
+class ResponseCache:
+    """
+    Read-through cache for serialized responses.
+
+    Entries live under a namespace (all movie pages, or everything about one movie) that carries a
+    generation stamp. Invalidating a namespace replaces its stamp, so every entry cached under it
+    becomes unreachable in O(1) without scanning keys, and simply ages out of the backend.
+    """
+
+    def __init__(self, backend, ttl : float = 60.0):
+        self.backend = backend
+        self.ttl = ttl
+        # A generation has to outlive the entries stamped with it
+        self.generation_ttl = ttl * 10
+
+    def _generation(self, namespace : str):
+        key = f"gen:{namespace}"
+        generation = self.backend.get(key)
+        if generation is None:
+            # A fresh, unique stamp, so entries from before an evicted generation can never match again
+            self.backend.set(key, time.time_ns(), self.generation_ttl, only_if_missing=True)
+            generation = self.backend.get(key)
+        return generation
+
+    def _lookup(self, resource : str, namespace : str, key : str):
+        cache_key = f"{resource}:{namespace}:{self._generation(namespace)}:{key}"
+        return cache_key, self.backend.get(cache_key)
+
+    async def get_or_load(self, resource : str, namespace : str, key : str, loader, model=None):
+        """Return the cached JSON for `key`, or await `loader()`, serialize it through `model` and cache it."""
+        if self.backend.blocking:
+            cache_key, cached = await run_in_threadpool(self._lookup, resource, namespace, key)
+        else:
+            cache_key, cached = self._lookup(resource, namespace, key)
+        if cached is not None:
+            CACHE_REQUESTS.labels(resource, "hit").inc()
+            return cached
+        CACHE_REQUESTS.labels(resource, "miss").inc()
+
+        value = await loader()
+        data = jsonable_encoder(model.model_validate(value, from_attributes=True) if model else value)
+        if self.backend.blocking:
+            await run_in_threadpool(self.backend.set, cache_key, data, self.ttl)
+        else:
+            self.backend.set(cache_key, data, self.ttl)
+        return data
+
+    def invalidate(self, *namespaces : str):
+        for namespace in namespaces:
+            self.backend.set(f"gen:{namespace}", time.time_ns(), self.generation_ttl)
+
+    def clear(self):
+        self.backend.clear()
+
+
+def movie_namespace(movie_id : int):
+    """Everything cached about one movie: the movie itself, its ratings and its comments."""
+    return f"movie:{movie_id}"
+
+
+MOVIE_LIST_NAMESPACE = "movies"
+
+
+def build_backend(name : str):
+    if name == "redis":
+        import redis  # Optional, only needed with CACHE_BACKEND=redis
+
+        return RedisCacheBackend(redis.Redis.from_url(settings.cache_url))
+    return LocalCacheBackend(maxsize=settings.cache_size, ttl=settings.cache_ttl)
+
+
+response_cache = ResponseCache(build_backend(settings.cache_backend), ttl=settings.cache_ttl)
+
+
+def warn_if_cache_is_per_process(cache : ResponseCache = response_cache, workers : int = settings.web_concurrency,
+                                 multiprocess : bool = settings.prometheus_multiproc_dir is not None):
+    """Logs a warning, once at startup, when several workers would each keep their own response cache. Returns whether it did."""
+    if not isinstance(cache.backend, LocalCacheBackend) or (workers <= 1 and not multiprocess):
+        return False
+    logger.warning(
+        "CACHE_BACKEND=memory with more than one worker: invalidations only reach the worker that handled the write, "
+        "the others serve stale responses for up to %ss. Set CACHE_BACKEND=redis.", cache.ttl
+    )
+    return True
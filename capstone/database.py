@@ -1,24 +1,125 @@
-import os
+import math
+import sqlite3
+import time
 
 from typing import Annotated
 
 from fastapi import Depends
+from fastapi.concurrency import run_in_threadpool
 
-from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects.sqlite.aiosqlite import AsyncAdapt_aiosqlite_connection
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
-load_dotenv()
+from capstone.metrics import DB_POOL_CAPACITY, DB_POOL_CHECKOUT_SECONDS, DB_POOL_CHECKOUT_TIMEOUTS, DB_POOL_IN_USE
+from capstone.settings import settings
 
-DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_URL = settings.database_url
 
 if not DATABASE_URL:
     raise ValueError("No DATABASE_URL set for SQLAlchemy engine")
 
-engine = create_engine(DATABASE_URL)
+# Set DB_ASYNC=true to serve requests from an AsyncSession (asyncpg on Postgres, aiosqlite on SQLite)
+DB_ASYNC = settings.db_async
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def to_async_url(url : str):
+    if url.startswith("postgresql://") or url.startswith("postgres://"):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url.split("://", 1)[1]
+    return url
+
+
+# Pool sizing is per process, so with several uvicorn workers the database sees workers * (size + overflow)
+DB_POOL_SIZE = settings.db_pool_size
+DB_MAX_OVERFLOW = settings.db_max_overflow
+DB_POOL_TIMEOUT = settings.db_pool_timeout
+DB_POOL_RECYCLE = settings.db_pool_recycle
+DB_POOL_PRE_PING = settings.db_pool_pre_ping
+
+
+class _TimedPoolMixin:
+    """Records how long each checkout waits for a connection, including pre-ping and reconnects."""
+    metrics_label = "sync"
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            DB_POOL_CHECKOUT_TIMEOUTS.labels(self.metrics_label).inc()
+            raise
+        finally:
+            DB_POOL_CHECKOUT_SECONDS.labels(self.metrics_label).observe(time.perf_counter() - start)
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    metrics_label = "sync"
+
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    metrics_label = "async"
+
+
+def pool_options(url : str, poolclass):
+    options = {
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+    # In-memory SQLite keeps a single connection per thread and cannot be sized
+    if url.startswith("sqlite") and (":memory:" in url or url.rstrip("/").endswith(":")):
+        return options
+    options.update(
+        poolclass=poolclass,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+    return options
+
+
+def instrument_pool(pool_engine, label : str):
+    DB_POOL_CAPACITY.labels(label).set(DB_POOL_SIZE + DB_MAX_OVERFLOW)
+    in_use = DB_POOL_IN_USE.labels(label)
+
+    @event.listens_for(pool_engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        in_use.inc()
+
+    @event.listens_for(pool_engine, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        in_use.dec()
+
+
+@event.listens_for(Engine, "connect")
+def _sqlite_math_functions(dbapi_connection, connection_record):
+    # The trending score is kept with exp() and ln(), which SQLite only has when built with its math functions.
+    # Async engines fire this too, with aiosqlite's adapter, which forwards create_function to the connection
+    if isinstance(dbapi_connection, (sqlite3.Connection, AsyncAdapt_aiosqlite_connection)):
+        dbapi_connection.create_function("exp", 1, math.exp, deterministic=True)
+        dbapi_connection.create_function("ln", 1, math.log, deterministic=True)
+
+
+engine = create_engine(DATABASE_URL, **pool_options(DATABASE_URL, TimedQueuePool))
+instrument_pool(engine, "sync")
+
+# Routes are async and serialize their response on the event loop after the crud call returns,
+# so committed objects keep their loaded attributes instead of lazily reloading there
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+async_engine = None
+AsyncSessionLocal = None
+if DB_ASYNC:
+    ASYNC_DATABASE_URL = settings.async_database_url or to_async_url(DATABASE_URL)
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_options(ASYNC_DATABASE_URL, TimedAsyncQueuePool))
+    instrument_pool(async_engine.sync_engine, "async")
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
@@ -29,4 +130,18 @@ def get_db():
     finally:
         db.close()
 
-db_dependency = Annotated[Session, Depends(get_db)]
\ No newline at end of file
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+db_dependency = Annotated[Session, Depends(get_async_db if DB_ASYNC else get_db)]
+
+
+async def run_in_session(db : Session | AsyncSession, fn, *args):
+    """
+    Await a crud function written against the sync Session API.
+    With an AsyncSession it runs on the event loop through run_sync, otherwise it goes to the threadpool.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args)
+    return await run_in_threadpool(fn, db, *args)
\ No newline at end of file
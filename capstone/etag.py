@@ -0,0 +1,48 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Request, Response, status
+
+
+def make_etag(version : str):
+    return '"%s"' % hashlib.sha1(version.encode()).hexdigest()
+
+
+def _as_utc(value : datetime | str):
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    # SQLite hands back naive datetimes, every timestamp the app writes is UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def conditional_response(request : Request, response : Response, validator : dict | None):
+    """
+    Compare the request's If-None-Match / If-Modified-Since with `validator`, a dict holding a
+    `version` string and an optional `last_modified` timestamp. Returns a 304 response when the
+    client's copy is current, otherwise sets ETag / Last-Modified on `response` and returns None.
+    """
+    if validator is None:
+        return None
+    headers = {"ETag": make_etag(validator["version"])}
+    last_modified = _as_utc(validator["last_modified"]) if validator.get("last_modified") else None
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        current = "*" in tags or headers["ETag"] in tags
+    elif last_modified is not None and request.headers.get("if-modified-since"):
+        try:
+            since = _as_utc(parsedate_to_datetime(request.headers["if-modified-since"]))
+            current = last_modified.replace(microsecond=0) <= since
+        except (TypeError, ValueError):
+            current = False
+    else:
+        current = False
+
+    if current:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return None
@@ -0,0 +1,146 @@
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+
+from capstone.logger import get_logger
+from capstone.metrics import (
+    DB_SLOW_QUERIES, HTTP_REQUEST_SECONDS, HTTP_REQUESTS_IN_FLIGHT, REQUEST_DB_QUERIES, REQUEST_DB_SECONDS
+)
+from capstone.settings import settings
+
+# Statements slower than this are logged with their SQL, 0 logs every statement
+SLOW_QUERY_SECONDS = settings.slow_query_seconds
+SLOW_QUERY_LOG_CHARS = settings.slow_query_log_chars
+
+logger = get_logger(__name__)
+
+
+class QueryStats:
+    """SQL statements issued and time spent in them on behalf of one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def server_timing(self, total_seconds : float):
+        return f'db;dur={self.seconds * 1000:.1f};desc="{self.count} queries", app;dur={total_seconds * 1000:.1f}'
+
+
+# Set by the middleware for the duration of a request. The threadpool and AsyncSession.run_sync both
+# run crud code in a copy of the request's context, so the hooks below see the same QueryStats object
+_request_stats : ContextVar[QueryStats | None] = ContextVar("request_query_stats", default=None)
+
+
+def current_query_stats():
+    return _request_stats.get()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += elapsed
+    if elapsed >= SLOW_QUERY_SECONDS:
+        DB_SLOW_QUERIES.inc()
+        # Parameters are left out, they can hold password hashes and user content
+        logger.warning("Slow query took %.1f ms: %s", elapsed * 1000, " ".join(statement.split())[:SLOW_QUERY_LOG_CHARS])
+
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute, drop its start time
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_started"):
+        connection.info["query_started"].pop()
+
+
+def instrument_queries(target=Engine):
+    """Time every statement executed through `target`, by default every engine, including the async ones' sync side."""
+    if not event.contains(target, "before_cursor_execute", _before_cursor_execute):
+        event.listen(target, "before_cursor_execute", _before_cursor_execute)
+        event.listen(target, "after_cursor_execute", _after_cursor_execute)
+        event.listen(target, "handle_error", _handle_error)
+
+
+def _route_label(scope):
+    # The router stores the matched route in the scope, unmatched paths share one label
+    return getattr(scope.get("route"), "path", "unmatched")
+
+
+class RequestMetricsMiddleware:
+    """
+    Request latency by method, route template and status code, plus the number of requests in flight.
+    A request that raises before sending a response is counted as a 500.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        in_flight = HTTP_REQUESTS_IN_FLIGHT.labels(scope["method"])
+        in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_flight.dec()
+            HTTP_REQUEST_SECONDS.labels(scope["method"], _route_label(scope), str(status_code)).observe(
+                time.perf_counter() - started
+            )
+
+
+class QueryStatsMiddleware:
+    """
+    Counts the SQL issued while serving each request. The totals go out as a Server-Timing header
+    and into the per-route histograms, labelled by route template so ids never become labels.
+
+    Streamed responses (no Content-Length, e.g. /movie/export) send their headers before the body's
+    queries run, so they get no Server-Timing header rather than a misleading zero; the histograms,
+    observed once the body is sent, still carry their real counts.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = _request_stats.set(stats)
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                if "content-length" in headers:
+                    headers.append("Server-Timing", stats.server_timing(time.perf_counter() - started))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_stats.reset(token)
+            route = _route_label(scope)
+            REQUEST_DB_QUERIES.labels(scope["method"], route).observe(stats.count)
+            REQUEST_DB_SECONDS.labels(scope["method"], route).observe(stats.seconds)
@@ -1,22 +1,193 @@
+import atexit
 import logging
-import sentry_sdk
-from sentry_sdk.integrations.logging import LoggingIntegration
-import logging
-from logging.handlers import SysLogHandler
-# Enable sending logs from the standard Python logging module to Sentry
-logging_integration = LoggingIntegration(
-    level=logging.INFO,  # Capture info and above as breadcrumbs
-    event_level=logging.ERROR  # Send errors as events
-)
+import queue
+import random
+import threading
+from collections import deque
+from logging.handlers import QueueHandler, SysLogHandler
+
+from capstone.metrics import LOG_RECORDS_DROPPED, LOG_RECORDS_SAMPLED_OUT
+from capstone.settings import settings
 
 PAPERTRAIL_HOST = "logs2.papertrailapp.com"
-PAPERTRAIL_PORT =  28987 
+PAPERTRAIL_PORT =  28987
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s %(message)s"
+# papertrail ships to syslog, memory keeps records in-process for tests, stderr is for local runs
+LOG_SINK = settings.log_sink
+LOG_QUEUE_SIZE = settings.log_queue_size
+LOG_BATCH_SIZE = settings.log_batch_size
+LOG_FLUSH_INTERVAL = settings.log_flush_interval
+# Fraction of INFO and below records that are kept, WARNING and above are never sampled
+LOG_INFO_SAMPLE_RATE = settings.log_info_sample_rate
+SENTRY_DSN = settings.sentry_dsn
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Hands records to the listener thread, dropping and counting them instead of blocking when the buffer is full."""
+
+    def __init__(self, log_queue, listener=None):
+        super().__init__(log_queue)
+        self.dropped = 0
+        # Started on the first record instead of at import
+        self.listener = listener
+
+    def prepare(self, record):
+        # Only merge the args into the message, the sink formats timestamps and levels on its own thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        if self.listener is not None:
+            self.listener.ensure_started()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.inc()
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps every WARNING and above, and only a `rate` fraction of the chatty INFO and DEBUG lines."""
+
+    def __init__(self, rate : float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno > logging.INFO or self.rate >= 1:
+            return True
+        if random.random() < self.rate:
+            return True
+        LOG_RECORDS_SAMPLED_OUT.inc()
+        return False
+
+
+class MemorySink(logging.Handler):
+    """Stand-in sink that keeps the last `capacity` records, used by tests instead of Papertrail."""
+
+    def __init__(self, capacity : int = 10000):
+        super().__init__()
+        self.records = deque(maxlen=capacity)
+        self.batches = 0
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def emit_batch(self, records):
+        self.batches += 1
+        self.records.extend(records)
+
+
+class BatchingQueueListener:
+    """
+    Drains the log queue on a background thread and passes records to the sinks in batches
+    of up to `batch_size`, waiting at most `flush_interval` seconds for a batch to fill.
+    `handlers` is a list of sinks, or a callable returning one that is called when the listener starts.
+    """
+    _stop = object()
+
+    def __init__(self, log_queue, handlers, batch_size : int = 200, flush_interval : float = 0.5):
+        self.queue = log_queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._thread = None
+        self._stopped = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        if callable(self.handlers):
+            self.handlers = self.handlers()
+        self._thread = threading.Thread(target=self._run, name="log-listener", daemon=True)
+        self._thread.start()
+
+    def ensure_started(self):
+        if self._thread is None and not self._stopped:
+            with self._lock:
+                if self._thread is None and not self._stopped:
+                    self.start()
+
+    def stop(self):
+        self._stopped = True
+        if self._thread is not None:
+            self.queue.put(self._stop)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = []
+            while True:
+                if record is self._stop:
+                    stopping = True
+                    break
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._emit(batch)
+
+    def _emit(self, batch):
+        for handler in self.handlers:
+            try:
+                if hasattr(handler, "emit_batch"):
+                    handler.emit_batch([record for record in batch if record.levelno >= handler.level])
+                else:
+                    for record in batch:
+                        if record.levelno >= handler.level:
+                            handler.handle(record)
+            except Exception:
+                handler.handleError(batch[-1])
+
+
+def build_sink(name : str):
+    if name == "memory":
+        sink = MemorySink()
+    elif name == "stderr":
+        sink = logging.StreamHandler()
+    else:
+        sink = SysLogHandler(address=(PAPERTRAIL_HOST, PAPERTRAIL_PORT))
+    sink.setFormatter(logging.Formatter(LOG_FORMAT))
+    return sink
+
+
+def init_sentry(dsn : str | None = SENTRY_DSN):
+    """Starts Sentry when a DSN is configured, sentry_sdk is only imported then. Returns whether it was started."""
+    if not dsn:
+        return False
+    import sentry_sdk
+    from sentry_sdk.integrations.logging import LoggingIntegration
+
+    # Send logs from the standard Python logging module to Sentry
+    logging_integration = LoggingIntegration(
+        level=logging.INFO,  # Capture info and above as breadcrumbs
+        event_level=logging.ERROR  # Send errors as events
+    )
+    sentry_sdk.init(dsn=dsn, integrations=[logging_integration])
+    return True
+
 
-handler = SysLogHandler(address=(PAPERTRAIL_HOST, PAPERTRAIL_PORT))
+log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+# The sink (for Papertrail a syslog socket and a DNS lookup) and the listener thread wait for the first record
+listener = BatchingQueueListener(log_queue, lambda: [build_sink(LOG_SINK)], LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL)
+handler = DroppingQueueHandler(log_queue, listener)
+handler.addFilter(SamplingFilter(LOG_INFO_SAMPLE_RATE))
+atexit.register(listener.stop)
 
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s %(levelname)s %(name)s %(message)s",
+    format=LOG_FORMAT,
     handlers=[handler]
 )
 
@@ -1,19 +1,37 @@
+import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
 from capstone.user.routers import user_router
 from capstone.movie.routers import movie_router
-import capstone.user.models as user_models
-import capstone.movie.models as movie_models
-from capstone.database import engine
+from capstone.metrics import mark_process_dead, metrics_router
+from capstone.auth.hash import shutdown_pool
+from capstone.cache import warn_if_cache_is_per_process
+from capstone.logger import init_sentry
+from capstone.instrumentation import QueryStatsMiddleware, RequestMetricsMiddleware, instrument_queries
+
+
+@asynccontextmanager
+async def lifespan(app : FastAPI):
+    init_sentry()
+    warn_if_cache_is_per_process()
+    yield
+    shutdown_pool()
+    mark_process_dead(os.getpid())
 
-app = FastAPI()
 
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(QueryStatsMiddleware)
+# Added last so it wraps everything else and its timings include the other middleware
+app.add_middleware(RequestMetricsMiddleware)
 
-user_models.Base.metadata.create_all(bind = engine)
-movie_models.Base.metadata.create_all(bind = engine)
+# The schema is managed by the migrations in capstone/migrations (`alembic upgrade head`), startup runs no DDL
+instrument_queries()
 
 
 app.include_router(user_router)
 app.include_router(movie_router)
+app.include_router(metrics_router)
 
 
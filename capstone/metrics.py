@@ -0,0 +1,155 @@
+from anyio import to_thread
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+from capstone.settings import settings
+
+# With several uvicorn workers every process writes its samples under this directory and /metrics
+# aggregates them. It must be set (and emptied) before the workers start, see prometheus_client's docs
+PROMETHEUS_MULTIPROC_DIR = settings.prometheus_multiproc_dir
+
+
+metrics_router = APIRouter(
+    tags=["Metrics"]
+)
+
+
+# Gauges are summed over the live worker processes in multiprocess mode
+DB_POOL_CAPACITY = Gauge(
+    "db_pool_capacity_connections",
+    "Configured pool_size + max_overflow of the connection pool",
+    ["pool"],
+    multiprocess_mode="livesum"
+)
+DB_POOL_IN_USE = Gauge(
+    "db_pool_connections_in_use",
+    "Connections currently checked out of the pool",
+    ["pool"],
+    multiprocess_mode="livesum"
+)
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_seconds",
+    "Time spent waiting to check a connection out of the pool",
+    ["pool"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+DB_POOL_CHECKOUT_TIMEOUTS = Counter(
+    "db_pool_checkout_timeouts",
+    "Checkouts that gave up after pool_timeout",
+    ["pool"]
+)
+
+PASSWORD_HASH_QUEUE_DEPTH = Gauge(
+    "password_hash_queue_depth",
+    "Password hash/verify jobs submitted to the hashing pool and not yet finished",
+    multiprocess_mode="livesum"
+)
+PASSWORD_HASH_WAIT_SECONDS = Histogram(
+    "password_hash_queue_wait_seconds",
+    "Time a password job waited for a free hashing worker",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+PASSWORD_HASH_SECONDS = Histogram(
+    "password_hash_duration_seconds",
+    "CPU time of a single bcrypt hash or verify in a worker",
+    ["operation"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+PASSWORD_HASH_REJECTED = Counter(
+    "password_hash_rejected",
+    "Password jobs refused because the hashing queue was full"
+)
+
+LOG_RECORDS_DROPPED = Counter(
+    "log_records_dropped",
+    "Log records dropped because the log shipping buffer was full"
+)
+LOG_RECORDS_SAMPLED_OUT = Counter(
+    "log_records_sampled_out",
+    "INFO and below log records skipped by LOG_INFO_SAMPLE_RATE"
+)
+
+CACHE_REQUESTS = Counter(
+    "response_cache_requests",
+    "Cache lookups by cached resource and hit/miss, the hit ratio is hit / (hit + miss)",
+    ["resource", "result"]
+)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Request latency by route template and status code, its _count gives throughput and error rate",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "Requests currently being served",
+    ["method"],
+    multiprocess_mode="livesum"
+)
+THREADPOOL_CAPACITY = Gauge(
+    "threadpool_capacity_threads",
+    "Size of the threadpool that runs sync endpoints and crud calls",
+    multiprocess_mode="livesum"
+)
+THREADPOOL_IN_USE = Gauge(
+    "threadpool_threads_in_use",
+    "Threadpool slots currently taken, saturation is in_use / capacity",
+    multiprocess_mode="livesum"
+)
+THREADPOOL_WAITING = Gauge(
+    "threadpool_tasks_waiting",
+    "Calls queued for a free threadpool slot",
+    multiprocess_mode="livesum"
+)
+
+REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries",
+    "SQL statements issued while serving a request, by route template",
+    ["method", "route"],
+    buckets=(0, 1, 2, 3, 4, 5, 8, 13, 21, 34, 55, 89)
+)
+REQUEST_DB_SECONDS = Histogram(
+    "http_request_db_seconds",
+    "Time spent executing SQL while serving a request, by route template",
+    ["method", "route"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+DB_SLOW_QUERIES = Counter(
+    "db_slow_queries",
+    "SQL statements that took longer than SLOW_QUERY_SECONDS"
+)
+
+
+def metrics_registry():
+    """The registry to expose, merging every worker's samples in multiprocess mode."""
+    if not PROMETHEUS_MULTIPROC_DIR:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=PROMETHEUS_MULTIPROC_DIR)
+    return registry
+
+
+def mark_process_dead(pid : int):
+    """Drop a finished worker's live gauges, called when a worker shuts down."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid, path=PROMETHEUS_MULTIPROC_DIR)
+
+
+def observe_threadpool():
+    # The limiter lives on the event loop, so this has to run there
+    limiter = to_thread.current_default_thread_limiter()
+    statistics = limiter.statistics()
+    THREADPOOL_CAPACITY.set(limiter.total_tokens)
+    THREADPOOL_IN_USE.set(statistics.borrowed_tokens)
+    THREADPOOL_WAITING.set(statistics.tasks_waiting)
+
+
+@metrics_router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    ## Prometheus metrics
+    Exposes the process metrics in the Prometheus text format, or every worker's with PROMETHEUS_MULTIPROC_DIR set
+    """
+    observe_threadpool()
+    return Response(generate_latest(metrics_registry()), media_type=CONTENT_TYPE_LATEST)
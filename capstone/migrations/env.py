@@ -0,0 +1,51 @@
+"""
+Alembic environment. The app itself never creates or alters tables, `alembic upgrade head`
+is a deploy step that runs once, before the workers start.
+"""
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+
+# Importing the models registers their tables on Base.metadata, for autogenerate
+import capstone.movie.models  # noqa: F401
+import capstone.user.models  # noqa: F401
+from capstone.database import Base
+from capstone.settings import settings
+
+config = context.config
+
+# Tests and scripts build their Config in code, with no ini file to configure logging from
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+# An explicit sqlalchemy.url (tests, scripts) wins over the app's DATABASE_URL
+DATABASE_URL = config.get_main_option("sqlalchemy.url") or settings.database_url
+
+target_metadata = Base.metadata
+
+
+def include_name(name, type_, parent_names):
+    # The SQLite FTS5 table and its shadow tables are managed by hand, autogenerate must not drop them
+    return not (type_ == "table" and name.startswith("movies_fts"))
+
+
+def run_migrations_online():
+    connectable = create_engine(DATABASE_URL, poolclass=NullPool)
+    with connectable.connect() as connection:
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            include_name=include_name,
+            # SQLite cannot ALTER constraints in place, batch operations rebuild the table instead
+            render_as_batch=connection.dialect.name == "sqlite",
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    # Revisions inspect the live schema so databases built by the old create_all upgrade too
+    raise RuntimeError("Offline (--sql) migrations are not supported, run them against the database")
+run_migrations_online()
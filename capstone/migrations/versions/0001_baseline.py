@@ -0,0 +1,75 @@
+"""Baseline: the users, movies, ratings and comments tables
+
+The schema the app used to create at import time with Base.metadata.create_all. Databases that
+were created that way already have these tables and are left as they are, so `alembic upgrade head`
+works on them without stamping first.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 09:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if "users" not in existing:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("username", sa.String, nullable=False),
+            sa.Column("email", sa.String, nullable=False),
+            sa.Column("password", sa.Text),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+        op.create_index("ix_users_username", "users", ["username"], unique=True)
+        op.create_index("ix_users_email", "users", ["email"], unique=True)
+
+    if "movies" not in existing:
+        op.create_table(
+            "movies",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("title", sa.String),
+            sa.Column("description", sa.String),
+            sa.Column("release_date", sa.DateTime),
+            sa.Column("updated_at", sa.DateTime),
+            sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id")),
+        )
+        op.create_index("ix_movies_id", "movies", ["id"])
+        op.create_index("ix_movies_title", "movies", ["title"])
+
+    if "ratings" not in existing:
+        op.create_table(
+            "ratings",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id")),
+            sa.Column("movie_id", sa.Integer, sa.ForeignKey("movies.id")),
+            sa.Column("rating", sa.Integer),
+        )
+        op.create_index("ix_ratings_id", "ratings", ["id"])
+
+    if "comments" not in existing:
+        op.create_table(
+            "comments",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id")),
+            sa.Column("movie_id", sa.Integer, sa.ForeignKey("movies.id")),
+            sa.Column("parent_id", sa.Integer, sa.ForeignKey("comments.id"), nullable=True),
+            sa.Column("content", sa.Text),
+        )
+        op.create_index("ix_comments_id", "comments", ["id"])
+
+
+def downgrade():
+    op.drop_table("comments")
+    op.drop_table("ratings")
+    op.drop_table("movies")
+    op.drop_table("users")
@@ -0,0 +1,36 @@
+"""Index the foreign keys the hot queries filter on
+
+Ratings are looked up by movie (summaries, listings) and by user (batch rating, profiles),
+comments by movie and by parent (threads). None of these columns were indexed.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 09:05:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+INDEXES = (
+    ("ix_ratings_movie_id", "ratings", "movie_id"),
+    ("ix_ratings_user_id", "ratings", "user_id"),
+    ("ix_comments_movie_id", "comments", "movie_id"),
+    ("ix_comments_parent_id", "comments", "parent_id"),
+)
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for name, table, column in INDEXES:
+        if name not in {index["name"] for index in inspector.get_indexes(table)}:
+            op.create_index(name, table, [column])
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,58 @@
+"""Per-movie rating aggregates, backfilled from the existing ratings
+
+Creates movie_stats if it is missing, then adds a row for every movie that has none, counted from
+the ratings already in the database in one INSERT ... SELECT ... GROUP BY.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 09:10:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+RATING_VALUES = range(1, 11)
+
+movies = sa.table("movies", sa.column("id"))
+ratings = sa.table("ratings", sa.column("movie_id"), sa.column("rating"))
+movie_stats = sa.table(
+    "movie_stats",
+    sa.column("movie_id"),
+    sa.column("rating_count"),
+    sa.column("rating_sum"),
+    *(sa.column(f"rating_{value}") for value in RATING_VALUES),
+)
+
+
+def upgrade():
+    if not sa.inspect(op.get_bind()).has_table("movie_stats"):
+        op.create_table(
+            "movie_stats",
+            sa.Column("movie_id", sa.Integer, sa.ForeignKey("movies.id", ondelete="CASCADE"), primary_key=True),
+            sa.Column("rating_count", sa.Integer, nullable=False, server_default="0"),
+            sa.Column("rating_sum", sa.Integer, nullable=False, server_default="0"),
+            *(sa.Column(f"rating_{value}", sa.Integer, nullable=False, server_default="0") for value in RATING_VALUES),
+        )
+
+    # Movies without ratings get a zero row from the outer join, so every movie ends up with one
+    aggregates = (
+        sa.select(
+            movies.c.id,
+            sa.func.count(ratings.c.rating),
+            sa.func.coalesce(sa.func.sum(ratings.c.rating), 0),
+            *(sa.func.coalesce(sa.func.sum(sa.case((ratings.c.rating == value, 1), else_=0)), 0) for value in RATING_VALUES),
+        )
+        .select_from(movies.outerjoin(ratings, ratings.c.movie_id == movies.c.id))
+        .where(~sa.exists().where(movie_stats.c.movie_id == movies.c.id))
+        .group_by(movies.c.id)
+    )
+    op.execute(movie_stats.insert().from_select(list(movie_stats.c.keys()), aggregates))
+
+
+def downgrade():
+    op.drop_table("movie_stats")
@@ -0,0 +1,65 @@
+"""Full-text search index over movie titles and descriptions
+
+SQLite: the movies_fts FTS5 table, the triggers that keep it in step with movies, and a rebuild
+so movies that already exist are searchable. Postgres: the GIN expression index, built
+concurrently so writes to movies are not blocked while it builds. The expression must stay
+identical to capstone.movie.models.search_document or the planner will not use it.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 09:15:00
+"""
+from alembic import op
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+SQLITE_UPGRADE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS movies_fts USING fts5(title, description, content='movies', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS movies_fts_insert AFTER INSERT ON movies BEGIN "
+    "INSERT INTO movies_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS movies_fts_delete AFTER DELETE ON movies BEGIN "
+    "INSERT INTO movies_fts(movies_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS movies_fts_update AFTER UPDATE OF title, description ON movies BEGIN "
+    "INSERT INTO movies_fts(movies_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); "
+    "INSERT INTO movies_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+    # An external-content table starts out empty, index the rows that are already there
+    "INSERT INTO movies_fts(movies_fts) VALUES('rebuild')",
+)
+SQLITE_DOWNGRADE = (
+    "DROP TRIGGER IF EXISTS movies_fts_update",
+    "DROP TRIGGER IF EXISTS movies_fts_delete",
+    "DROP TRIGGER IF EXISTS movies_fts_insert",
+    "DROP TABLE IF EXISTS movies_fts",
+)
+
+POSTGRES_UPGRADE = (
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_movies_search ON movies USING gin ("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B'))"
+)
+POSTGRES_DOWNGRADE = "DROP INDEX CONCURRENTLY IF EXISTS ix_movies_search"
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == "sqlite":
+        for statement in SQLITE_UPGRADE:
+            op.execute(statement)
+    elif dialect == "postgresql":
+        # CONCURRENTLY cannot run inside the migration's transaction
+        with op.get_context().autocommit_block():
+            op.execute(POSTGRES_UPGRADE)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == "sqlite":
+        for statement in SQLITE_DOWNGRADE:
+            op.execute(statement)
+    elif dialect == "postgresql":
+        with op.get_context().autocommit_block():
+            op.execute(POSTGRES_DOWNGRADE)
@@ -0,0 +1,69 @@
+"""One rating per user and movie
+
+Duplicate (user_id, movie_id) ratings are collapsed to the most recent one (highest id), the
+aggregates of the movies they belonged to are recounted, and then uq_ratings_user_movie is added.
+All of it runs in one transaction, so the constraint goes on exactly the rows that were deduplicated.
+Also adds movie_stats.ratings_version, which versions a movie's ratings for ETags.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 09:20:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+RATING_VALUES = range(1, 11)
+
+ratings = sa.table("ratings", sa.column("id"), sa.column("user_id"), sa.column("movie_id"), sa.column("rating"))
+movie_stats = sa.table(
+    "movie_stats",
+    sa.column("movie_id"),
+    sa.column("rating_count"),
+    sa.column("rating_sum"),
+    *(sa.column(f"rating_{value}") for value in RATING_VALUES),
+)
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+
+    if "uq_ratings_user_movie" not in {constraint["name"] for constraint in inspector.get_unique_constraints("ratings")}:
+        latest = sa.select(sa.func.max(ratings.c.id)).group_by(ratings.c.user_id, ratings.c.movie_id)
+        duplicated = sa.select(ratings.c.movie_id).where(ratings.c.id.not_in(latest)).distinct()
+        affected = op.get_bind().execute(duplicated).scalars().all()
+
+        if affected:
+            op.execute(ratings.delete().where(ratings.c.id.not_in(latest)))
+            # Recount only the movies that lost ratings
+            op.execute(movie_stats.delete().where(movie_stats.c.movie_id.in_(affected)))
+            recount = (
+                sa.select(
+                    ratings.c.movie_id,
+                    sa.func.count(),
+                    sa.func.sum(ratings.c.rating),
+                    *(sa.func.sum(sa.case((ratings.c.rating == value, 1), else_=0)) for value in RATING_VALUES),
+                )
+                .where(ratings.c.movie_id.in_(affected))
+                .group_by(ratings.c.movie_id)
+            )
+            op.execute(movie_stats.insert().from_select(list(movie_stats.c.keys()), recount))
+
+        with op.batch_alter_table("ratings") as batch:
+            batch.create_unique_constraint("uq_ratings_user_movie", ["user_id", "movie_id"])
+
+    if "ratings_version" not in {column["name"] for column in inspector.get_columns("movie_stats")}:
+        with op.batch_alter_table("movie_stats") as batch:
+            batch.add_column(sa.Column("ratings_version", sa.Integer, nullable=False, server_default="0"))
+
+
+def downgrade():
+    with op.batch_alter_table("movie_stats") as batch:
+        batch.drop_column("ratings_version")
+    with op.batch_alter_table("ratings") as batch:
+        batch.drop_constraint("uq_ratings_user_movie", type_="unique")
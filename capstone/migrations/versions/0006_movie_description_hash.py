@@ -0,0 +1,68 @@
+"""Indexed SHA-256 of each movie's description
+
+The duplicate-description check looks movies up by this hash. Existing rows are backfilled before
+the index is built: in SQL on Postgres, in keyset batches from Python on SQLite, which has no
+sha256(). Both must produce capstone.movie.models.description_fingerprint, the hex SHA-256 of the
+UTF-8 encoded description.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17 09:25:00
+"""
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 1000
+
+movies = sa.table("movies", sa.column("id"), sa.column("description"), sa.column("description_hash"))
+
+
+def backfill_in_batches(connection):
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(movies.c.id, movies.c.description)
+            .where(movies.c.id > last_id, movies.c.description.is_not(None), movies.c.description_hash.is_(None))
+            .order_by(movies.c.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).all()
+        if not rows:
+            return
+        connection.execute(
+            movies.update().where(movies.c.id == sa.bindparam("movie_id")).values(description_hash=sa.bindparam("hash")),
+            [{"movie_id": id, "hash": hashlib.sha256(description.encode()).hexdigest()} for id, description in rows],
+        )
+        last_id = rows[-1].id
+
+
+def upgrade():
+    connection = op.get_bind()
+    inspector = sa.inspect(connection)
+
+    if "description_hash" not in {column["name"] for column in inspector.get_columns("movies")}:
+        op.add_column("movies", sa.Column("description_hash", sa.String(64)))
+
+    if connection.dialect.name == "postgresql":
+        op.execute(
+            "UPDATE movies SET description_hash = encode(sha256(convert_to(description, 'UTF8')), 'hex') "
+            "WHERE description IS NOT NULL AND description_hash IS NULL"
+        )
+    else:
+        backfill_in_batches(connection)
+
+    if "ix_movies_description_hash" not in {index["name"] for index in inspector.get_indexes("movies")}:
+        op.create_index("ix_movies_description_hash", "movies", ["description_hash"])
+
+
+def downgrade():
+    op.drop_index("ix_movies_description_hash", table_name="movies")
+    # Not in batch mode: rebuilding movies on SQLite would drop the search triggers with it
+    op.drop_column("movies", "description_hash")
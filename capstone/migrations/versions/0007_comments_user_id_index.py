@@ -0,0 +1,23 @@
+"""Index comments.user_id for the per-user comment count on profiles
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17 11:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if "ix_comments_user_id" not in {index["name"] for index in sa.inspect(op.get_bind()).get_indexes("comments")}:
+        op.create_index("ix_comments_user_id", "comments", ["user_id"])
+
+
+def downgrade():
+    op.drop_index("ix_comments_user_id", table_name="comments")
@@ -0,0 +1,42 @@
+"""Comment count and last change time on movie_stats
+
+Movie responses carry their rating and comment counts from movie_stats, so listing a page of movies
+needs no per-movie lookups. Existing comments, replies included, are counted into the new column.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17 12:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+comments = sa.table("comments", sa.column("id"), sa.column("movie_id"))
+movie_stats = sa.table("movie_stats", sa.column("movie_id"), sa.column("comment_count"))
+
+
+def upgrade():
+    columns = {column["name"] for column in sa.inspect(op.get_bind()).get_columns("movie_stats")}
+    with op.batch_alter_table("movie_stats") as batch:
+        if "comment_count" not in columns:
+            batch.add_column(sa.Column("comment_count", sa.Integer, nullable=False, server_default="0"))
+        if "updated_at" not in columns:
+            batch.add_column(sa.Column("updated_at", sa.DateTime, nullable=True))
+
+    counted = (
+        sa.select(sa.func.count(comments.c.id))
+        .where(comments.c.movie_id == movie_stats.c.movie_id)
+        .scalar_subquery()
+    )
+    op.execute(movie_stats.update().values(comment_count=counted))
+
+
+def downgrade():
+    with op.batch_alter_table("movie_stats") as batch:
+        batch.drop_column("updated_at")
+        batch.drop_column("comment_count")
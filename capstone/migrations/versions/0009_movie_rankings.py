@@ -0,0 +1,53 @@
+"""Top-rated and trending scores on movie_stats
+
+Both are indexed together with movie_id so /movie/top and /movie/trending read the first K entries
+of an index. Rated movies get their Bayesian score from the TOP_PRIOR_MEAN and TOP_PRIOR_WEIGHT in
+effect when this runs. Ratings and comments carry no timestamps, so trending starts out empty and
+fills as new ones are written.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17 13:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from capstone.settings import settings
+
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+movie_stats = sa.table("movie_stats", sa.column("rating_count"), sa.column("rating_sum"), sa.column("bayesian_score"))
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    columns = {column["name"] for column in inspector.get_columns("movie_stats")}
+    with op.batch_alter_table("movie_stats") as batch:
+        if "bayesian_score" not in columns:
+            batch.add_column(sa.Column("bayesian_score", sa.Float, nullable=True))
+        if "trending_score" not in columns:
+            batch.add_column(sa.Column("trending_score", sa.Float, nullable=True))
+
+    prior = settings.top_prior_weight * settings.top_prior_mean
+    op.execute(
+        movie_stats.update()
+        .where(movie_stats.c.rating_count > 0)
+        .values(bayesian_score=(sa.literal(prior) + movie_stats.c.rating_sum) / (sa.literal(settings.top_prior_weight) + movie_stats.c.rating_count))
+    )
+
+    indexes = {index["name"] for index in inspector.get_indexes("movie_stats")}
+    for name, score in (("ix_movie_stats_bayesian_score", "bayesian_score"), ("ix_movie_stats_trending_score", "trending_score")):
+        if name not in indexes:
+            op.create_index(name, "movie_stats", [score, "movie_id"])
+
+
+def downgrade():
+    op.drop_index("ix_movie_stats_trending_score", table_name="movie_stats")
+    op.drop_index("ix_movie_stats_bayesian_score", table_name="movie_stats")
+    with op.batch_alter_table("movie_stats") as batch:
+        batch.drop_column("trending_score")
+        batch.drop_column("bayesian_score")
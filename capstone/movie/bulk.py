@@ -0,0 +1,204 @@
+"""
+Bulk movie import, shared by `POST /movie/import` and the command line:
+
+    python -m capstone.movie.bulk movies.ndjson --user alice [--format csv] [--batch-size 5000]
+
+Rows are validated one at a time and inserted in batches, with COPY on Postgres (psycopg2)
+and a single executemany elsewhere. A batch the database rejects is replayed row by row
+so the report can say which rows failed and why.
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+from datetime import datetime, timezone
+
+from pydantic import ValidationError
+from sqlalchemy import exists, func, insert, literal, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from capstone.cache import MOVIE_LIST_NAMESPACE, response_cache
+from capstone.database import SessionLocal
+from capstone.logger import get_logger
+from capstone.movie.models import Movie as Movie_model
+from capstone.movie.models import MovieStats, description_fingerprint
+from capstone.movie.schema import CreateMovie
+from capstone.settings import settings
+from capstone.user.models import User
+
+IMPORT_BATCH_SIZE = settings.import_batch_size
+# Every failed row is counted, only the first few are described in the report
+IMPORT_MAX_ERRORS = settings.import_max_errors
+# Request bodies larger than this are buffered in a temporary file rather than in memory
+IMPORT_SPOOL_BYTES = settings.import_spool_bytes
+# Larger request bodies are turned away with a 413
+IMPORT_MAX_BYTES = settings.import_max_bytes
+
+FORMATS = ("ndjson", "csv")
+COLUMNS = ("title", "description", "description_hash", "release_date", "updated_at", "user_id")
+
+logger = get_logger(__name__)
+
+
+def _is_utf8(value):
+    # Streams are decoded with errors="surrogateescape", invalid bytes show up as lone surrogates
+    try:
+        value.encode("utf-8")
+        return True
+    except UnicodeEncodeError:
+        return False
+
+
+def read_records(lines, fmt : str = "ndjson"):
+    """Yield (row number, record or error message) for each row of an NDJSON or CSV text stream."""
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        for record in reader:
+            # Physical line the record ended on, counting the header as line 1
+            if not all(_is_utf8(value) for value in record.values() if isinstance(value, str)):
+                yield reader.line_num, "Invalid UTF-8"
+                continue
+            yield reader.line_num, record
+        return
+    for row, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        if not _is_utf8(line):
+            yield row, "Invalid UTF-8"
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            yield row, f"Invalid JSON: {exc}"
+            continue
+        yield row, record if isinstance(record, dict) else "Expected a JSON object"
+
+
+def _validate(record):
+    if isinstance(record, str):
+        return None, record
+    try:
+        return CreateMovie.model_validate(record), None
+    except ValidationError as exc:
+        return None, "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in exc.errors())
+
+
+def _copy_rows(db : Session, rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {Movie_model.__tablename__} ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+
+
+def _insert_rows(db : Session, rows):
+    db.execute(insert(Movie_model.__table__), [dict(zip(COLUMNS, row)) for row in rows])
+
+
+def _start_stats(db : Session, after_id : int):
+    # COPY cannot hand back the new ids, so the empty rating aggregates are added from the table
+    new_movies = select(Movie_model.id, literal(0), literal(0)).where(
+        Movie_model.id > after_id,
+        ~exists().where(MovieStats.movie_id == Movie_model.id)
+    )
+    db.execute(insert(MovieStats).from_select(["movie_id", "rating_count", "rating_sum"], new_movies))
+
+
+def insert_batch(db : Session, batch, user_id : int):
+    """Insert a batch of (row number, CreateMovie) and commit it. Returns the rows that failed."""
+    now = datetime.now(timezone.utc)
+    rows = [(movie.title, movie.description, description_fingerprint(movie.description), now, now, user_id) for _, movie in batch]
+    after_id = db.execute(select(func.max(Movie_model.id))).scalar() or 0
+    dialect = db.get_bind().dialect
+    database_errors = (SQLAlchemyError, dialect.dbapi.Error)
+    use_copy = dialect.driver == "psycopg2"
+    try:
+        (_copy_rows if use_copy else _insert_rows)(db, rows)
+        _start_stats(db, after_id)
+        db.commit()
+        return []
+    except database_errors as exc:
+        db.rollback()
+        logger.warning("Bulk insert of %s rows failed, retrying row by row: %s", len(rows), exc)
+
+    errors = []
+    for (row, _), values in zip(batch, rows):
+        try:
+            with db.begin_nested():
+                _insert_rows(db, [values])
+        except database_errors as exc:
+            errors.append({"row": row, "error": str(getattr(exc, "orig", exc)).strip()})
+    _start_stats(db, after_id)
+    db.commit()
+    return errors
+
+
+def import_movies(db : Session, lines, user_id : int, fmt : str = "ndjson", batch_size : int = IMPORT_BATCH_SIZE):
+    """Import every row of an NDJSON or CSV text stream for `user_id` and report how it went."""
+    logger.info("Importing %s movies for user ID=%s in batches of %s", fmt, user_id, batch_size)
+    started = time.perf_counter()
+    report = {"inserted": 0, "failed": 0, "errors": []}
+
+    def record_errors(errors):
+        report["failed"] += len(errors)
+        room = IMPORT_MAX_ERRORS - len(report["errors"])
+        report["errors"].extend(errors[:max(room, 0)])
+
+    def flush(batch):
+        errors = insert_batch(db, batch, user_id)
+        report["inserted"] += len(batch) - len(errors)
+        record_errors(errors)
+        response_cache.invalidate(MOVIE_LIST_NAMESPACE)
+
+    batch = []
+    for row, record in read_records(lines, fmt):
+        movie, error = _validate(record)
+        if error:
+            record_errors([{"row": row, "error": error}])
+            continue
+        batch.append((row, movie))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    report["errors"].sort(key=lambda error: error["row"])
+
+    logger.info(
+        "Imported %s movies for user ID=%s in %.2fs, %s rows failed",
+        report["inserted"], user_id, time.perf_counter() - started, report["failed"]
+    )
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m capstone.movie.bulk", description="Bulk import movies from NDJSON or CSV.")
+    parser.add_argument("path", help="file to import, - for stdin")
+    parser.add_argument("--user", required=True, help="username that will own the imported movies")
+    parser.add_argument("--format", choices=FORMATS, help="defaults to the file extension, else ndjson")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+
+    with SessionLocal() as db:
+        user_id = db.execute(select(User.id).where(User.username == args.user)).scalar()
+        if user_id is None:
+            parser.error(f"no user named {args.user!r}")
+        source = sys.stdin if args.path == "-" else open(args.path, newline="", encoding="utf-8", errors="surrogateescape")
+        with source:
+            report = import_movies(db, source, user_id, fmt, args.batch_size)
+
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,178 +1,525 @@
+import math
 from datetime import datetime, timezone
 
 from fastapi import Depends, HTTPException, status
+from sqlalchemy import case, func, insert, literal, literal_column, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased, contains_eager, joinedload
+from sqlalchemy.dialects import postgresql, sqlite
 from capstone.database import db_dependency
 from capstone.movie.schema import CreateMovie
-from capstone.user.schema  import Login
-from capstone.user.models import User
+from capstone.user.schema  import CurrentUser
 from capstone.movie.models import Movie as Movie_model
 from capstone.auth.oauth2 import get_current_user
 from capstone.movie.models import Rating as RatingModel
+from capstone.movie.models import MovieStats
+from capstone.movie.models import bayesian_score, description_fingerprint, search_document, movies_fts
 from capstone.movie.schema import Rating as RatingSchema
+from capstone.movie.schema import RatingBatch
 from capstone.movie.schema import Comment as CommentSchema
 from capstone.movie.models import Comment as CommentModel
 from capstone.movie.schema import ReplyComment
 
+from capstone.cache import MOVIE_LIST_NAMESPACE, movie_namespace, response_cache
 from capstone.logger import get_logger
+from capstone.pagination import paginate
+from capstone.settings import settings
 
 
 
 
 logger = get_logger(__name__)
 
+# Trending activity halves every TRENDING_HALF_LIFE_HOURS. Scores are kept on a log scale that grows
+# with time since TRENDING_EPOCH instead of being decayed, so no write ever has to touch other movies
+TRENDING_HALF_LIFE_HOURS = settings.trending_half_life_hours
+TRENDING_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
 
-def create_movie(db : db_dependency, payload : CreateMovie, current_user : Login = Depends(get_current_user)):
-    logger.info(f"User {current_user.username} is attempting to list a new movie: {payload.title}")
-    user = db.query(User).filter(User.username == current_user.username).first()
+
+def create_movie(db : db_dependency, payload : CreateMovie, current_user : CurrentUser = Depends(get_current_user)):
+    logger.info("User %s is attempting to list a new movie: %s", current_user.username, payload.title)
 
     new_movie = Movie_model(
     title=payload.title,
     description=payload.description,
+    description_hash=description_fingerprint(payload.description),
     release_date=datetime.now(timezone.utc),  # Set the release date to the current time in UTC
     updated_at=datetime.now(timezone.utc),    # Set the updated_at field to the current time in UTC
-    user_id=user.id # Associate the movie with the user who created it
+    user_id=current_user.id, # Associate the movie with the user who created it
+    stats=MovieStats(rating_count=0, rating_sum=0, comment_count=0) # Start the aggregate alongside the movie
     )
     db.add(new_movie)  # Add the new movie instance to the database session
-    db.commit()  # Commit the session to save the movie in the database
-    db.refresh(new_movie)  # Refresh the instance with the latest data from the database
-    logger.info(f"Movie '{new_movie.title}' has been listed by user {current_user.username} with ID {new_movie.id}.")
+    db.commit()  # Commit the session to save the movie in the database, the new id comes back with the INSERT
+    response_cache.invalidate(MOVIE_LIST_NAMESPACE)
+    logger.info("Movie '%s' has been listed by user %s with ID %s.", new_movie.title, current_user.username, new_movie.id)
     return new_movie
 
 
-def fetch_movies(db : db_dependency, offset : int = 0, limit : int =10):
-    logger.info(f"Fetching movies with offset={offset} and limit={limit}")
+def fetch_movies(db : db_dependency, cursor : str | None = None, limit : int =10):
+    logger.info("Fetching movies with cursor=%s and limit=%s", cursor, limit)
+
+    # The counters come from movie_stats in the same query, a LEFT JOIN rather than a lookup per movie
+    page = paginate(db.query(Movie_model).options(joinedload(Movie_model.stats)), Movie_model.id, cursor, limit)
+    logger.info("Fetched %s movies with cursor=%s and limit=%s", len(page['items']), cursor, limit)
+    return page
+
+def search_movies(db : db_dependency, q : str, offset : int = 0, limit : int = 10):
+    logger.info("Searching movies for q=%r with offset=%s and limit=%s", q, offset, limit)
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        query_ts = func.websearch_to_tsquery(literal_column("'english'"), q)
+        document = search_document(Movie_model.title, Movie_model.description)
+        rank = func.ts_rank(document, query_ts)
+        query = db.query(Movie_model).filter(document.op("@@")(query_ts)).order_by(rank.desc(), Movie_model.id)
+    elif dialect == "sqlite":
+        # Quote every term so user input can never be parsed as FTS5 query syntax
+        terms = " ".join('"%s"' % term.replace('"', '""') for term in q.split())
+        if not terms:
+            return {"items": [], "next_offset": None}
+        fts = literal_column("movies_fts")
+        query = (
+            db.query(Movie_model)
+            .join(movies_fts, movies_fts.c.rowid == Movie_model.id)
+            .filter(fts.match(terms))
+            .order_by(func.bm25(fts), Movie_model.id)
+        )
+    else:
+        pattern = f"%{q}%"
+        query = db.query(Movie_model).filter(
+            or_(Movie_model.title.ilike(pattern), Movie_model.description.ilike(pattern))
+        ).order_by(Movie_model.id)
+
+    rows = query.options(joinedload(Movie_model.stats)).offset(offset).limit(limit + 1).all()
+    logger.info("Found %s movies for q=%r", min(len(rows), limit), q)
+    return {
+        "items": rows[:limit],
+        "next_offset": offset + limit if len(rows) > limit else None
+    }
 
-    movies = db.query(Movie_model).offset(offset).limit(limit).all()
-    logger.info(f"Fetched {len(movies)} movies with offset={offset} and limit={limit}")
-    return movies
 
 def fetch_movie_by_id(db : db_dependency, movie_id : int):
-    logger.info(f"Fetching movie with ID={movie_id}")
-    movie = db.query(Movie_model).filter(Movie_model.id == movie_id).first()
+    logger.info("Fetching movie with ID=%s", movie_id)
+    movie = db.query(Movie_model).options(joinedload(Movie_model.stats)).filter(Movie_model.id == movie_id).first()
 
     if movie is None:
-        logger.warning(f"Movie with ID={movie_id} not found")
+        logger.warning("Movie with ID=%s not found", movie_id)
         raise HTTPException(
             status_code = status.HTTP_404_NOT_FOUND,
             detail = "Movie not found"
         )
-    logger.info(f"Movie with ID={movie_id} found: {movie.title}")
+    logger.info("Movie with ID=%s found: %s", movie_id, movie.title)
 
     return movie
 
 
-def update_movie(db : db_dependency, movie_id : int, payload : CreateMovie, current_user : Login = Depends(get_current_user)):
-    logger.info(f"User '{current_user.username}' is attempting to update movie with ID={movie_id}")
-    user = db.query(User).filter(User.username == current_user.username).first()
-            # Query the database for a movie with the given movie ID
-    movie = db.query(Movie_model).filter(Movie_model.id == movie_id).first()
-    if movie is None:
-        logger.info(f"User '{current_user.username}' is attempting to update movie with ID={movie_id}")
-    
-        raise HTTPException(
-            status_code = status.HTTP_404_NOT_FOUND,
-            detail = "Movie not found"
+def fetch_movies_by_ids(db : db_dependency, ids : list[int]):
+    """The movies with the given ids in the order asked for, from one IN query. Ids with no movie are listed under `missing`."""
+    logger.info("Fetching %s movies by id", len(ids))
+    found = {
+        movie.id: movie
+        for movie in db.query(Movie_model).options(joinedload(Movie_model.stats)).filter(Movie_model.id.in_(ids))
+    }
+    missing = [movie_id for movie_id in ids if movie_id not in found]
+    if missing:
+        logger.info("Movies with IDs=%s not found", missing)
+    return {"items": [found[movie_id] for movie_id in ids if movie_id in found], "missing": missing}
+
+
+def _ranked_movies(db : db_dependency, score, limit : int):
+    # Read backwards through the score's index, the movies come with their stats from the same join
+    return (
+        db.query(Movie_model)
+        .join(Movie_model.stats)
+        .options(contains_eager(Movie_model.stats))
+        .filter(score.is_not(None))
+        .order_by(score.desc(), MovieStats.movie_id.desc())
+        .limit(limit)
+        .all()
+    )
+
+
+def _ranked_movie(movie : Movie_model, score : float):
+    return {
+        "id": movie.id,
+        "title": movie.title,
+        "description": movie.description,
+        "release_date": movie.release_date,
+        "updated_at": movie.updated_at,
+        "rating_count": movie.rating_count,
+        "comment_count": movie.comment_count,
+        "avg_rating": movie.avg_rating,
+        "score": round(score, 4)
+    }
+
+
+def fetch_top_movies(db : db_dependency, limit : int = 10):
+    logger.info("Fetching the %s top rated movies", limit)
+    movies = _ranked_movies(db, MovieStats.bayesian_score, limit)
+    return {"items": [_ranked_movie(movie, movie.stats.bayesian_score) for movie in movies]}
+
+
+def fetch_trending_movies(db : db_dependency, limit : int = 10):
+    logger.info("Fetching the %s trending movies", limit)
+    now = _trending_position(datetime.now(timezone.utc))
+    movies = _ranked_movies(db, MovieStats.trending_score, limit)
+    # Reported as the activity as of now: every rating and comment counts 1, halved for each half-life since it happened
+    return {"items": [_ranked_movie(movie, math.exp(movie.stats.trending_score - now)) for movie in movies]}
+
+
+# Validators for conditional GETs. Each reads only the columns that change with the response,
+# so a matching If-None-Match is answered without loading or serializing the resource itself.
+
+def _movie_versions(db : db_dependency):
+    """Columns that version a movie response: the movie's own timestamp and the counters it carries."""
+    return db.query(
+        Movie_model.id, Movie_model.updated_at, MovieStats.ratings_version, MovieStats.comment_count,
+        MovieStats.updated_at.label("counted_at")
+    ).outerjoin(MovieStats, MovieStats.movie_id == Movie_model.id)
+
+
+def _movie_version(row):
+    return f"{row.id}@{row.updated_at}:{row.ratings_version}:{row.comment_count}"
+
+
+def movie_validator(db : db_dependency, movie_id : int):
+    row = _movie_versions(db).filter(Movie_model.id == movie_id).first()
+    if row is None:
+        return None
+    last_modified = max((value for value in (row.updated_at, row.counted_at) if value), default=None)
+    return {"version": f"movie:{_movie_version(row)}", "last_modified": last_modified}
+
+
+def movies_page_validator(db : db_dependency, cursor : str | None = None, limit : int = 10):
+    # ETag only: a deleted movie, or an older one moving into the window, changes the page without
+    # any timestamp on it moving, so If-Modified-Since would answer 304 for a stale page
+    page = paginate(_movie_versions(db), Movie_model.id, cursor, limit)
+    return {"version": f"movies:{cursor}:{limit}:" + ",".join(_movie_version(row) for row in page["items"])}
+
+
+def ratings_validator(db : db_dependency, movie_id : int):
+    # Ratings can be changed in place, so the aggregate's counter versions them rather than the newest id
+    version = db.execute(select(MovieStats.ratings_version).where(MovieStats.movie_id == movie_id)).scalar()
+    return None if not version else {"version": f"ratings:{movie_id}:{version}"}
+
+
+def comments_validator(db : db_dependency, movie_id : int):
+    latest = db.execute(select(func.max(CommentModel.id)).where(CommentModel.movie_id == movie_id)).scalar()
+    return None if latest is None else {"version": f"comments:{movie_id}:{latest}"}
+
+
+def update_movie(db : db_dependency, movie_id : int, payload : CreateMovie, current_user : CurrentUser = Depends(get_current_user)):
+    logger.info("User '%s' is attempting to update movie with ID=%s", current_user.username, movie_id)
+    fingerprint = description_fingerprint(payload.description)
+    duplicates = aliased(Movie_model)
+    # Ownership and the duplicate description check ride along on the UPDATE, which returns the updated row
+    movie = db.scalars(
+        update(Movie_model)
+        .where(
+            Movie_model.id == movie_id,
+            Movie_model.user_id == current_user.id,
+            ~select(duplicates.id).where(duplicates.description_hash == fingerprint).exists()
         )
-    if user.id != movie.user_id:
-        logger.warning(f"User '{user.username}' is not authorized to update movie with ID={movie.id}. Forbidden action.")
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="You are not authorized to update this movie"
+        .values(
+            title=payload.title,  # Update the movie's title
+            description=payload.description,  # Update the movie's description
+            description_hash=fingerprint,
+            updated_at=datetime.now(timezone.utc)  # Update the movie's updated_at field to the current time
         )
-    db_description = db.query(Movie_model).filter(Movie_model.description == payload.description).first()
-    if db_description:  # If a matching movie is found, raise a 406 error
+        .returning(Movie_model)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if movie is None:
+        # Nothing was updated, only now find out why
+        owner_id = db.execute(select(Movie_model.user_id).where(Movie_model.id == movie_id)).first()
+        db.rollback()
+        if owner_id is None:
+            logger.info("User '%s' is attempting to update movie with ID=%s", current_user.username, movie_id)
+            raise HTTPException(
+                status_code = status.HTTP_404_NOT_FOUND,
+                detail = "Movie not found"
+            )
+        if current_user.id != owner_id.user_id:
+            logger.warning("User '%s' is not authorized to update movie with ID=%s. Forbidden action.", current_user.username, movie_id)
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="You are not authorized to update this movie"
+            )
+        # If a matching movie is found, raise a 406 error
         logger.warning("Listing failed for user, A movie with a similar description already exists.")
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
             detail="Similar Movie already exists, Contact Support to make complaints."
         )
-    movie.title = payload.title  # Update the movie's title
-    movie.description = payload.description  # Update the movie's description
-    movie.updated_at = datetime.now(timezone.utc)  # Update the movie's updated_at field to the current time
+    movie.stats  # Loaded while the session is open, the response carries its counters
     db.commit()
-    logger.info(f"Movie with ID={movie_id} successfully updated by user '{current_user.username}'")
+    response_cache.invalidate(MOVIE_LIST_NAMESPACE, movie_namespace(movie_id))
+    logger.info("Movie with ID=%s successfully updated by user '%s'", movie_id, current_user.username)
     return movie
    
 
-def delete_movie(db : db_dependency, movie_id : int, current_user : Login = Depends(get_current_user)):
-    logger.info(f"User '{current_user.username}' is attempting to delete movie with ID={movie_id}")
+def delete_movie(db : db_dependency, movie_id : int, current_user : CurrentUser = Depends(get_current_user)):
+    logger.info("User '%s' is attempting to delete movie with ID=%s", current_user.username, movie_id)
 
-    user = db.query(User).filter(User.username == current_user.username).first()
     movie = db.query(Movie_model).filter(Movie_model.id == movie_id).first()
 
     if movie is None:
-        logger.warning(f"Movie with ID={movie_id} not found. Deletion operation aborted.")
+        logger.warning("Movie with ID=%s not found. Deletion operation aborted.", movie_id)
         raise HTTPException(
             status_code = status.HTTP_404_NOT_FOUND,
             detail = "Movie not found"
         )
-    if user.id != movie.user_id:
-        logger.warning(f"User '{user.username}' is not authorized to modify movie with ID={movie.id}.")
+    if current_user.id != movie.user_id:
+        logger.warning("User '%s' is not authorized to modify movie with ID=%s.", current_user.username, movie.id)
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You are not authorized to delete this movie"
         )
     db.delete(movie)
     db.commit()
-    logger.info(f"Movie with ID={movie_id} successfully deleted by user '{current_user.username}'")
+    response_cache.invalidate(MOVIE_LIST_NAMESPACE, movie_namespace(movie_id))
+    logger.info("Movie with ID=%s successfully deleted by user '%s'", movie_id, current_user.username)
 
 
-def rate_movie(db : db_dependency, payload : RatingSchema, current_user : Login = Depends(get_current_user)):
-    logger.info(f"User '{current_user.username}' is attempting to rate movie with ID={payload.movie_id}")
+def rate_movie(db : db_dependency, payload : RatingSchema, current_user : CurrentUser = Depends(get_current_user)):
+    logger.info("User '%s' is attempting to rate movie with ID=%s", current_user.username, payload.movie_id)
 
-    movie = db.query(Movie_model).filter(Movie_model.id == payload.movie_id).first()
-    user = db.query(User).filter(User.username == current_user.username).first()
-    if movie is None:
-        logger.error(f"Movie with ID {payload.movie_id} not found.")
-        raise HTTPException(
-            status_code = status.HTTP_404_NOT_FOUND,
-            detail = "Movie not found"
-        )
-    # Check if the user has already rated the movie
-    existing_rating = db.query(RatingModel).filter(
-        RatingModel.movie_id == movie.id,
-        RatingModel.user_id == user.id
-    ).first()
-    if existing_rating:  # If a rating already exists, raise a 400 error
-        logger.warning(f"User has already rated movie with ID {movie.id}.")
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="You have already rated this movie"
-        )
     # Check if the rating is outside the acceptable range
-    if payload.rating not in range(1, 10):
-        logger.error(f"Invalid rating value: {payload.rating}. Must be an integer between 1 and 10.")
+    if payload.rating not in range(1, 11):
+        logger.error("Invalid rating value: %s. Must be an integer between 1 and 10.", payload.rating)
     
         raise HTTPException(
                 status_code = status.HTTP_400_BAD_REQUEST,
                 detail = "Rating must be an integer between 0 and 11"
             ) # Return False if the rating is valid
-    else:
-        new_rating = RatingModel(
-        user_id = user.id,
-        movie_id = payload.movie_id,
-        rating = payload.rating
-            )
-        db.add(new_rating)
-        db.commit()
-        db.refresh(new_rating)
-        logger.info(f"User {current_user.username} successfully rated movie with ID {payload.movie_id}.")
-        ratings = db.query(RatingModel).filter(RatingModel.movie_id == payload.movie_id).all()
-        if not ratings:  # If no ratings are found, raise a 404 error
-            logger.warning(f"No ratings found for movie with ID {payload.movie_id}.")
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="No ratings found for this movie"
-            )
-        return ratings
-        # return MovieService.average_rating(db, payload.movie_id)
+    # The unique (user_id, movie_id) constraint decides whether the user has already rated the movie
+    try:
+        inserted = db.execute(
+            _insert(db, RatingModel)
+            .values(user_id=current_user.id, movie_id=payload.movie_id, rating=payload.rating)
+            .on_conflict_do_nothing(index_elements=[RatingModel.user_id, RatingModel.movie_id])
+        ).rowcount
+    except IntegrityError:  # Postgres turns away a rating for a missing movie through the foreign key
+        db.rollback()
+        inserted = None
+    if inserted == 0:  # If a rating already exists, raise a 400 error
+        db.rollback()
+        logger.warning("User has already rated movie with ID %s.", payload.movie_id)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="You have already rated this movie"
+        )
+    stats = _add_to_rating_stats(db, payload.movie_id, payload.rating) if inserted else None
+    if stats is None:
+        db.rollback()
+        logger.error("Movie with ID %s not found.", payload.movie_id)
+        raise HTTPException(
+            status_code = status.HTTP_404_NOT_FOUND,
+            detail = "Movie not found"
+        )
+    db.commit()  # The rating and its aggregate are committed in the same transaction
+    # Listed movies carry their rating counts, so the list pages go too
+    response_cache.invalidate(MOVIE_LIST_NAMESPACE, movie_namespace(payload.movie_id))
+    logger.info("User %s successfully rated movie with ID %s.", current_user.username, payload.movie_id)
+    return _rating_summary(payload.movie_id, stats)
+
+
+def rate_movies(db : db_dependency, payload : RatingBatch, current_user : CurrentUser = Depends(get_current_user)):
+    """
+    Create or replace the user's ratings for many movies, with one INSERT for the new ratings and one
+    INSERT ... ON CONFLICT DO UPDATE for the changed ones. When a movie appears more than once the last
+    rating wins, as it would have had they been sent one by one.
+    """
+    logger.info("User '%s' is submitting %s ratings", current_user.username, len(payload.ratings))
+    results = {}
+    errors = []
+    for item in payload.ratings:
+        if item.rating not in range(1, 11):
+            errors.append({"movie_id": item.movie_id, "error": "Rating must be an integer between 1 and 10"})
+            continue
+        results.pop(item.movie_id, None)
+        results[item.movie_id] = item.rating
+
+    existing = set(db.scalars(select(Movie_model.id).where(Movie_model.id.in_(results)))) if results else set()
+    for movie_id in [movie_id for movie_id in results if movie_id not in existing]:
+        errors.append({"movie_id": movie_id, "error": "Movie not found"})
+        del results[movie_id]
+
+    # The stats deltas are only right if `previous` cannot change underneath us: existing ratings are locked,
+    # and new ones only count as created when this statement's INSERT is the one that wrote them
+    previous = _locked_ratings(db, current_user.id, results)
+    new = [movie_id for movie_id in results if movie_id not in previous]
+    created = set()
+    if new:
+        created = set(db.scalars(
+            _insert(db, RatingModel)
+            .values([{"user_id": current_user.id, "movie_id": movie_id, "rating": results[movie_id]} for movie_id in new])
+            .on_conflict_do_nothing(index_elements=[RatingModel.user_id, RatingModel.movie_id])
+            .returning(RatingModel.movie_id)
+        ))
+        # Rated by a concurrent request since we looked, these become updates of its rating
+        previous.update(_locked_ratings(db, current_user.id, [movie_id for movie_id in new if movie_id not in created]))
+
+    changed = {movie_id: rating for movie_id, rating in results.items() if movie_id in previous and previous[movie_id] != rating}
+    if changed:
+        statement = _insert(db, RatingModel).values([
+            {"user_id": current_user.id, "movie_id": movie_id, "rating": rating} for movie_id, rating in changed.items()
+        ])
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[RatingModel.user_id, RatingModel.movie_id],
+            set_={"rating": statement.excluded.rating}
+        ))
+    for movie_id in created:
+        _add_to_rating_stats(db, movie_id, results[movie_id])
+    for movie_id, rating in changed.items():
+        _add_to_rating_stats(db, movie_id, rating, previous=previous[movie_id])
+    db.commit()
+    if created or changed:
+        response_cache.invalidate(MOVIE_LIST_NAMESPACE, *(movie_namespace(movie_id) for movie_id in created | changed.keys()))
+
+    logger.info("User '%s' wrote %s of %s ratings, %s rejected", current_user.username, len(created) + len(changed), len(results), len(errors))
+    return {
+        "items": [
+            {
+                "movie_id": movie_id,
+                "rating": rating,
+                "status": "created" if movie_id in created else "updated" if movie_id in changed else "unchanged"
+            }
+            for movie_id, rating in results.items()
+        ],
+        "errors": errors
+    }
+
+
+def _locked_ratings(db : db_dependency, user_id : int, movie_ids):
+    """The user's current ratings of `movie_ids`, row-locked until commit. Locked in movie order so batches cannot deadlock."""
+    if not movie_ids:
+        return {}
+    return dict(db.execute(
+        select(RatingModel.movie_id, RatingModel.rating)
+        .where(RatingModel.user_id == user_id, RatingModel.movie_id.in_(movie_ids))
+        .order_by(RatingModel.movie_id)
+        .with_for_update()
+    ).all())
+
+
+def _insert(db : db_dependency, model):
+    """Dialect-specific INSERT, for ON CONFLICT clauses."""
+    return (postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert)(model)
+
+
+def _add_to_rating_stats(db : db_dependency, movie_id : int, rating : int, previous : int | None = None):
+    """
+    Adjust the movie's aggregate in place for a new rating, or for a changed one when `previous` is given,
+    and return it. A movie without an aggregate row gets one built from all of its ratings, this one included.
+    None means no such movie.
+    """
+    bucket = f"rating_{rating}"
+    now = datetime.now(timezone.utc)
+    count = MovieStats.rating_count + (0 if previous else 1)
+    total = MovieStats.rating_sum + rating - (previous or 0)
+    changes = {
+        MovieStats.rating_count: count,
+        MovieStats.rating_sum: total,
+        getattr(MovieStats, bucket): getattr(MovieStats, bucket) + 1,
+        MovieStats.ratings_version: MovieStats.ratings_version + 1,
+        MovieStats.bayesian_score: bayesian_score(count, total),
+        MovieStats.trending_score: _add_to_trending(_trending_position(now)),
+        MovieStats.updated_at: now
+    }
+    if previous:
+        old_bucket = getattr(MovieStats, f"rating_{previous}")
+        changes[old_bucket] = old_bucket - 1
+    stats = db.execute(
+        update(MovieStats)
+        .where(MovieStats.movie_id == movie_id)
+        .values(changes)
+        .returning(*MovieStats.__table__.columns)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if stats is None and db.get(Movie_model, movie_id) is not None:
+        stats = _stats_from_ratings(db, movie_id)
+        db.add(stats)
+        db.flush()
+    return stats
+
+
+def _stats_from_ratings(db : db_dependency, movie_id : int):
+    """Aggregate a movie's ratings and comments from scratch, for movies that have no movie_stats row."""
+    comments = select(func.count(CommentModel.id)).where(CommentModel.movie_id == movie_id).scalar_subquery()
+    row = db.execute(
+        select(
+            func.count(RatingModel.id),
+            func.coalesce(func.sum(RatingModel.rating), 0),
+            comments,
+            *(func.sum(case((RatingModel.rating == value, 1), else_=0)) for value in range(1, 11))
+        ).where(RatingModel.movie_id == movie_id)
+    ).one()
+    count, total, comment_count, *histogram = row
+    now = datetime.now(timezone.utc)
+    return MovieStats(
+        movie_id=movie_id,
+        rating_count=count,
+        rating_sum=total,
+        ratings_version=1,
+        comment_count=comment_count,
+        bayesian_score=bayesian_score(count, total) if count else None,
+        trending_score=_trending_position(now),  # Built for a rating or comment that was just written
+        updated_at=now,
+        **{f"rating_{value}": buckets or 0 for value, buckets in zip(range(1, 11), histogram)}
+    )
+
+
+def _add_to_comment_count(db : db_dependency, movie_id : int):
+    """Count a comment that was just written in the movie's aggregate, building the aggregate if the movie has none."""
+    now = datetime.now(timezone.utc)
+    counted = db.execute(
+        update(MovieStats)
+        .where(MovieStats.movie_id == movie_id)
+        .values(
+            comment_count=MovieStats.comment_count + 1,
+            trending_score=_add_to_trending(_trending_position(now)),
+            updated_at=now
+        )
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not counted:
+        db.add(_stats_from_ratings(db, movie_id))
+        db.flush()
+
+
+def _trending_position(moment : datetime):
+    """Where an event at `moment` sits on the trending log scale: log(2) more for every half-life since TRENDING_EPOCH."""
+    return (moment - TRENDING_EPOCH).total_seconds() / 3600 / TRENDING_HALF_LIFE_HOURS * math.log(2)
+
+
+def _add_to_trending(position : float):
+    """
+    The new MovieStats.trending_score after one more event at `position`, log(exp(score) + exp(position)).
+    Factored around the larger term so exp() only ever sees values <= 0 and cannot overflow.
+    """
+    score = MovieStats.trending_score
+    return case(
+        (score.is_(None), position),
+        (score > position, score + func.ln(1 + func.exp(position - score))),
+        else_=position + func.ln(1 + func.exp(score - position))
+    )
+
+
+def _rating_summary(movie_id : int, stats : MovieStats | None):
+    count = stats.rating_count if stats else 0
+    return {
+        "movie_id": movie_id,
+        "rating_count": count,
+        "average_rating": round(stats.rating_sum / count, 2) if count else None,
+        "histogram": {value: (getattr(stats, f"rating_{value}") or 0) if stats else 0 for value in range(1, 11)}
+    }
 
 
 def get_ratings(db : db_dependency, movie_id : int):
-    logger.info(f"Fetching ratings for movie with ID={movie_id}")
+    logger.info("Fetching ratings for movie with ID=%s", movie_id)
     movie = db.query(Movie_model).filter(Movie_model.id == movie_id).first()
     if movie is None:
-        logger.error(f"Movie with ID {movie_id} not found.")
+        logger.error("Movie with ID %s not found.", movie_id)
         raise HTTPException(
             status_code = status.HTTP_404_NOT_FOUND,
             detail = "Movie not found"
@@ -180,81 +527,144 @@ def get_ratings(db : db_dependency, movie_id : int):
     else:
         ratings = db.query(RatingModel).filter(RatingModel.movie_id == movie_id).all()
         if not ratings:  # If no ratings are found, raise a 404 error
-            logger.warning(f"No ratings found for movie with ID {movie_id}.")
+            logger.warning("No ratings found for movie with ID %s.", movie_id)
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="No ratings found for this movie"
             )
-        # Extract rating values directly from the ORM objects
-        rating_values = [rating.rating for rating in ratings]
-        logger.info(f"Ratings for movie with ID {movie_id} retrieved successfully.")
-        # Calculate the sum of rating values and the number of ratings
-        total_rating = sum(rating_values)
-        len_ratings = len(rating_values)
+        logger.info("Ratings for movie with ID %s retrieved successfully.", movie_id)
         return ratings
-        # return MovieService.average_rating(db, movie_id)
 
 
+def get_rating_summary(db : db_dependency, movie_id : int):
+    logger.info("Fetching rating summary for movie with ID=%s", movie_id)
+    stats = db.get(MovieStats, movie_id)
+    if stats is None and db.get(Movie_model, movie_id) is None:
+        logger.error("Movie with ID %s not found.", movie_id)
+        raise HTTPException(
+            status_code = status.HTTP_404_NOT_FOUND,
+            detail = "Movie not found"
+        )
+    if stats is None:  # No aggregate row yet, count the ratings instead of reporting none
+        stats = _stats_from_ratings(db, movie_id)
+    return _rating_summary(movie_id, stats)
 
-def comment(db : db_dependency, payload : CommentSchema,  current_user : Login = Depends(get_current_user)):
-    logger.info(f"User {current_user.username} is attempting to comment on movie with ID {payload.movie_id}.")
-    user = db.query(User).filter(User.username == current_user.username).first()
-    movie = db.query(Movie_model).filter(Movie_model.id == payload.movie_id).first()
-    if movie is None:
-        logger.error(f"Movie with ID {payload.movie_id} not found.")
+
+
+def comment(db : db_dependency, payload : CommentSchema,  current_user : CurrentUser = Depends(get_current_user)):
+    logger.info("User %s is attempting to comment on movie with ID %s.", current_user.username, payload.movie_id)
+    # INSERT ... SELECT FROM movies writes nothing when the movie does not exist, so no separate lookup is needed
+    new_comment = db.scalars(
+        insert(CommentModel)
+        .from_select(
+            ["user_id", "movie_id", "content"],
+            select(literal(current_user.id), Movie_model.id, literal(payload.content)).where(Movie_model.id == payload.movie_id)
+        )
+        .returning(CommentModel)
+    ).first()
+    if new_comment is None:
+        logger.error("Movie with ID %s not found.", payload.movie_id)
         raise HTTPException(
             status_code = status.HTTP_404_NOT_FOUND,
             detail = "Movie not found"
         )
-    logger.info(f"User {current_user.username} successfully commented on movie with ID {payload.movie_id}.")
-    new_comment = CommentModel(
-        user_id = user.id,
-        movie_id = payload.movie_id,
-        content = payload.content
-    )
-    db.add(new_comment)
-    db.commit()
-    db.refresh(new_comment)
+    _add_to_comment_count(db, payload.movie_id)
+    db.commit()  # The comment and its count are committed in the same transaction
+    response_cache.invalidate(MOVIE_LIST_NAMESPACE, movie_namespace(payload.movie_id))
+    logger.info("User %s successfully commented on movie with ID %s.", current_user.username, payload.movie_id)
     return new_comment
 
 
-def fetch_comments(db : db_dependency, movie_id : int, offset : int = 0, limit : int =10):
+def fetch_comments(db : db_dependency, movie_id : int, cursor : str | None = None, limit : int =10):
         # Query the database for a movie with the given movie ID
     movie = db.query(Movie_model).filter(Movie_model.id == movie_id).first()
     if movie is None:
-        logger.error(f"Movie with ID {movie_id} not found.")
+        logger.error("Movie with ID %s not found.", movie_id)
         raise HTTPException(
             status_code = status.HTTP_404_NOT_FOUND,
             detail = "Movie not found"
         )
 
-    logger.info(f"Fetching comments for movie with ID={movie_id}")
-    comments = db.query(CommentModel).filter(CommentModel.movie_id == movie_id).offset(offset).limit(limit).all()
-    logger.info(f"Found {len(comments)} comments for movie with ID={movie_id}.")
-    return comments
-
-def reply_to_comment(db : db_dependency, payload : ReplyComment,  current_user : Login = Depends(get_current_user)):
-    logger.info(f"User {current_user.username} is attempting to reply to comment with ID={payload.comment_id}.")
-    user = db.query(User).filter(User.username == current_user.username).first()
-    comment = db.query(CommentModel).filter(CommentModel.id == payload.comment_id).first()
-    if comment is None:
-        logger.error(f"Comment with ID {payload.comment_id} not found.")
+    logger.info("Fetching comments for movie with ID=%s", movie_id)
+    query = db.query(CommentModel).filter(CommentModel.movie_id == movie_id)
+    page = paginate(query, CommentModel.id, cursor, limit)
+    logger.info("Found %s comments for movie with ID=%s.", len(page['items']), movie_id)
+    return page
+
+
+def fetch_comment_tree(db : db_dependency, movie_id : int, cursor : str | None = None, limit : int = 10, depth : int = 5):
+    """
+    Pages the top-level comments of a movie and attaches their replies, up to `depth` levels,
+    from a single recursive CTE. The tree is assembled from rows, never from the lazy `replies` backref.
+    """
+    movie = db.query(Movie_model.id).filter(Movie_model.id == movie_id).first()
+    if movie is None:
+        logger.error("Movie with ID %s not found.", movie_id)
+        raise HTTPException(
+            status_code = status.HTTP_404_NOT_FOUND,
+            detail = "Movie not found"
+        )
+
+    logger.info("Fetching comment threads for movie with ID=%s", movie_id)
+    roots = db.query(CommentModel).filter(CommentModel.movie_id == movie_id, CommentModel.parent_id.is_(None))
+    page = paginate(roots, CommentModel.id, cursor, limit)
+    threads = {comment.id: _comment_node(comment) for comment in page["items"]}
+
+    if threads:
+        thread = (
+            select(CommentModel.id, literal(1).label("depth"))
+            .where(CommentModel.parent_id.in_(list(threads)))
+            .cte("thread", recursive=True)
+        )
+        thread = thread.union_all(
+            select(CommentModel.id, (thread.c.depth + 1).label("depth"))
+            .where(CommentModel.parent_id == thread.c.id, thread.c.depth < depth)
+        )
+        replies = db.query(CommentModel).join(thread, CommentModel.id == thread.c.id).order_by(CommentModel.id).all()
+        nodes = dict(threads)
+        # Ids only grow, so a parent is always seen before its replies
+        for reply in replies:
+            node = _comment_node(reply)
+            nodes[reply.id] = node
+            nodes[reply.parent_id]["replies"].append(node)
+
+    page["items"] = list(threads.values())
+    logger.info("Found %s comment threads for movie with ID=%s.", len(page['items']), movie_id)
+    return page
+
+
+def _comment_node(comment : CommentModel):
+    return {
+        "id": comment.id,
+        "user_id": comment.user_id,
+        "movie_id": comment.movie_id,
+        "parent_id": comment.parent_id,
+        "content": comment.content,
+        "replies": []
+    }
+
+def reply_to_comment(db : db_dependency, payload : ReplyComment,  current_user : CurrentUser = Depends(get_current_user)):
+    logger.info("User %s is attempting to reply to comment with ID=%s.", current_user.username, payload.comment_id)
+    parent = aliased(CommentModel)
+    new_reply = db.scalars(
+        insert(CommentModel)
+        .from_select(
+            ["user_id", "movie_id", "content", "parent_id"],
+            # Replies belong to the same movie as the comment they answer
+            select(literal(current_user.id), parent.movie_id, literal(payload.content), parent.id).where(parent.id == payload.comment_id)
+        )
+        .returning(CommentModel)
+    ).first()
+    if new_reply is None:
+        logger.error("Comment with ID %s not found.", payload.comment_id)
         raise HTTPException(
             status_code = status.HTTP_404_NOT_FOUND,
             detail = "Comment not found"
         )
-    movie = db.query(Movie_model).filter(Movie_model.id == payload.comment_id).first()
-    logger.info(f"Movie with ID={movie.id} found. Creating reply.")
-    new_reply = CommentModel(
-                    user_id = user.id,
-                    movie_id = movie.id, 
-                    content = payload.content,
-                    parent_id = payload.comment_id
-                )
-    db.add(new_reply)
+    _add_to_comment_count(db, new_reply.movie_id)
     db.commit()
-    db.refresh(new_reply)
-    logger.info(f"Reply created successfully with ID={new_reply.id} by user ID={user.id} for comment ID={payload.comment_id}.")
+    response_cache.invalidate(MOVIE_LIST_NAMESPACE, movie_namespace(new_reply.movie_id))
+    logger.info("Reply created successfully with ID=%s by user ID=%s for comment ID=%s.", new_reply.id, current_user.id, payload.comment_id)
     return new_reply           
 
   
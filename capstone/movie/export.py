@@ -0,0 +1,96 @@
+"""
+Streaming export of the movie catalog as NDJSON or CSV.
+
+Rows are read through a server-side cursor a partition at a time and written straight to the
+response, so memory stays flat however large the catalog is. The stream runs after the request's
+session has been closed, so it opens its own connection from the session's engine.
+"""
+import csv
+import io
+import json
+
+from sqlalchemy import Float, Numeric, cast, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from capstone.logger import get_logger
+from capstone.movie.models import Movie as Movie_model
+from capstone.movie.models import MovieStats
+from capstone.settings import settings
+
+EXPORT_PARTITION_SIZE = settings.export_partition_size
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+logger = get_logger(__name__)
+
+
+def export_query(include_ratings : bool = False):
+    columns = [Movie_model.id, Movie_model.title, Movie_model.description, Movie_model.release_date, Movie_model.updated_at]
+    if not include_ratings:
+        return select(*columns).order_by(Movie_model.id)
+    rating_count = func.coalesce(MovieStats.rating_count, 0)
+    # Postgres only rounds numeric to a number of places, and asyncpg binds the 1.0 as double precision.
+    # The quotient is cast rather than the sum, which SQLite would keep as an integer and divide as one
+    average = MovieStats.rating_sum * 1.0 / func.nullif(MovieStats.rating_count, 0)
+    average_rating = cast(func.round(cast(average, Numeric), 2), Float)
+    return (
+        select(*columns, rating_count.label("rating_count"), average_rating.label("average_rating"))
+        .outerjoin(MovieStats, MovieStats.movie_id == Movie_model.id)
+        .order_by(Movie_model.id)
+    )
+
+
+def _value(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def _writer(fmt : str, columns):
+    """Returns the header chunk and a function turning a partition of rows into one chunk."""
+    if fmt == "csv":
+        def write(rows):
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows([[_value(value) for value in row] for row in rows])
+            return buffer.getvalue()
+        return write([columns]), write
+
+    def write(rows):
+        return "".join(json.dumps(dict(zip(columns, map(_value, row)))) + "\n" for row in rows)
+    return "", write
+
+
+def stream_movies(bind, fmt : str = "ndjson", include_ratings : bool = False):
+    """Sync generator over an Engine, Starlette iterates it in the threadpool."""
+    query = export_query(include_ratings)
+    header, write = _writer(fmt, list(query.selected_columns.keys()))
+    if header:
+        yield header
+    exported = 0
+    with bind.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=EXPORT_PARTITION_SIZE).execute(query)
+        for rows in result.partitions():
+            exported += len(rows)
+            yield write(rows)
+    logger.info("Exported %s movies as %s", exported, fmt)
+
+
+async def stream_movies_async(bind, fmt : str = "ndjson", include_ratings : bool = False):
+    """Async generator over an AsyncEngine, for DB_ASYNC deployments."""
+    query = export_query(include_ratings)
+    header, write = _writer(fmt, list(query.selected_columns.keys()))
+    if header:
+        yield header
+    exported = 0
+    async with bind.connect() as connection:
+        result = await connection.stream(query, execution_options={"yield_per": EXPORT_PARTITION_SIZE})
+        async for rows in result.partitions():
+            exported += len(rows)
+            yield write(rows)
+    logger.info("Exported %s movies as %s", exported, fmt)
+
+
+def stream_export(db : Session | AsyncSession, fmt : str = "ndjson", include_ratings : bool = False):
+    """Only the session's engine is used, the session itself is closed before the response streams."""
+    if isinstance(db, AsyncSession):
+        return stream_movies_async(db.bind, fmt, include_ratings)
+    return stream_movies(db.get_bind(), fmt, include_ratings)
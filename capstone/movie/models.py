@@ -1,7 +1,35 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text
+import hashlib
+
+from sqlalchemy import Column, Integer, Float, String, ForeignKey, DateTime, Text, DDL, Index, UniqueConstraint, column, event, func, literal_column, table
 from datetime import datetime, timezone
 from sqlalchemy.orm import relationship
 from capstone.database import Base
+from capstone.settings import settings
+
+# A movie's top-rated score is its average with TOP_PRIOR_WEIGHT ratings of TOP_PRIOR_MEAN mixed in,
+# so a single 10 does not outrank a hundred 9s
+TOP_PRIOR_MEAN = settings.top_prior_mean
+TOP_PRIOR_WEIGHT = settings.top_prior_weight
+
+
+def search_document(title, description):
+    """Weighted tsvector over title (A) and description (B), the GIN index and the search query must use the same expression."""
+    english = literal_column("'english'")
+    return func.setweight(
+        func.to_tsvector(english, func.coalesce(title, literal_column("''"))), literal_column("'A'")
+    ).op("||")(
+        func.setweight(func.to_tsvector(english, func.coalesce(description, literal_column("''"))), literal_column("'B'"))
+    )
+
+
+def description_fingerprint(description : str):
+    """SHA-256 of the description, indexed so the duplicate check is a lookup rather than a scan of every description."""
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+def bayesian_score(count, total):
+    """The top-rated score for `count` ratings adding up to `total`. Works on column expressions too, so writes compute it in their UPDATE."""
+    return (TOP_PRIOR_WEIGHT * TOP_PRIOR_MEAN + total) / (TOP_PRIOR_WEIGHT + count)
 
 
 class Movie(Base):
@@ -11,20 +39,63 @@ class Movie(Base):
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
     description = Column(String)
+    description_hash = Column(String(64), index=True)
     release_date = Column(DateTime, default=lambda: datetime.now(timezone.utc))
-    updated_at = Column(DateTime, default=datetime.now(timezone.utc ))
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     user_id = Column(Integer, ForeignKey("users.id"))
    
     owner = relationship("User", back_populates="movies")
     ratings = relationship("Rating", back_populates="movies")
     comments = relationship("Comment", back_populates="movies", cascade="all, delete-orphan")
+    stats = relationship("MovieStats", back_populates="movie", uselist=False, cascade="all, delete-orphan")
+
+    # Counters served with the movie, read from the aggregate; load `stats` eagerly wherever movies are listed
+    @property
+    def rating_count(self):
+        return self.stats.rating_count if self.stats else 0
+
+    @property
+    def comment_count(self):
+        return self.stats.comment_count if self.stats else 0
+
+    @property
+    def avg_rating(self):
+        count = self.rating_count
+        return round(self.stats.rating_sum / count, 2) if count else None
+
+    __table_args__ = (
+        # Postgres serves search from a GIN expression index
+        Index("ix_movies_search", search_document(title, description), postgresql_using="gin").ddl_if(dialect="postgresql"),
+    )
+
+
+# SQLite serves search from an FTS5 table kept in sync with movies by triggers
+for statement in (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS movies_fts USING fts5(title, description, content='movies', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS movies_fts_insert AFTER INSERT ON movies BEGIN "
+    "INSERT INTO movies_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS movies_fts_delete AFTER DELETE ON movies BEGIN "
+    "INSERT INTO movies_fts(movies_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS movies_fts_update AFTER UPDATE OF title, description ON movies BEGIN "
+    "INSERT INTO movies_fts(movies_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); "
+    "INSERT INTO movies_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+):
+    event.listen(Movie.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+event.listen(Movie.__table__, "before_drop", DDL("DROP TABLE IF EXISTS movies_fts").execute_if(dialect="sqlite"))
+
+# Query-side handle on the FTS5 table, which stays out of Base.metadata
+movies_fts = table("movies_fts", column("rowid"))
+
 
 class Rating(Base):
     __tablename__ = "ratings"
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
-    movie_id = Column(Integer, ForeignKey("movies.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    movie_id = Column(Integer, ForeignKey("movies.id"), index=True)
     rating = Column(Integer)
+
+    # One rating per user and movie, enforced by the database so concurrent submissions cannot both insert
+    __table_args__ = (UniqueConstraint("user_id", "movie_id", name="uq_ratings_user_movie"),)
   
     owner = relationship("User", back_populates="ratings")
     movies = relationship("Movie", back_populates="ratings")
@@ -32,9 +103,9 @@ class Rating(Base):
 class Comment(Base):
     __tablename__ = "comments"
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
-    movie_id = Column(Integer, ForeignKey("movies.id"))
-    parent_id = Column(Integer, ForeignKey("comments.id"), nullable=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    movie_id = Column(Integer, ForeignKey("movies.id"), index=True)
+    parent_id = Column(Integer, ForeignKey("comments.id"), nullable=True, index=True)
     content = Column(Text)
  
 
@@ -43,3 +114,37 @@ class Comment(Base):
     parent = relationship("Comment", remote_side= [id], backref = "replies")
 
 
+class MovieStats(Base):
+    """Per-movie rating and comment aggregate, kept in step with the ratings and comments tables on every write."""
+    __tablename__ = "movie_stats"
+    movie_id = Column(Integer, ForeignKey("movies.id", ondelete="CASCADE"), primary_key=True)
+    rating_count = Column(Integer, nullable=False, default=0)
+    rating_sum = Column(Integer, nullable=False, default=0)
+    rating_1 = Column(Integer, nullable=False, default=0)
+    rating_2 = Column(Integer, nullable=False, default=0)
+    rating_3 = Column(Integer, nullable=False, default=0)
+    rating_4 = Column(Integer, nullable=False, default=0)
+    rating_5 = Column(Integer, nullable=False, default=0)
+    rating_6 = Column(Integer, nullable=False, default=0)
+    rating_7 = Column(Integer, nullable=False, default=0)
+    rating_8 = Column(Integer, nullable=False, default=0)
+    rating_9 = Column(Integer, nullable=False, default=0)
+    rating_10 = Column(Integer, nullable=False, default=0)
+    # Bumped on every rating write, changed ratings keep their id so this is what versions the ratings
+    ratings_version = Column(Integer, nullable=False, default=0)
+    # Comments and replies alike
+    comment_count = Column(Integer, nullable=False, default=0)
+    # When a rating or comment last changed the aggregate, the Last-Modified of responses carrying the counters
+    updated_at = Column(DateTime, nullable=True)
+    # The average rating pulled towards a prior until enough ratings come in, NULL while unrated
+    bayesian_score = Column(Float, nullable=True)
+    # Log of the rating and comment activity, decayed by a half-life; NULL until there is any
+    trending_score = Column(Float, nullable=True)
+
+    movie = relationship("Movie", back_populates="stats")
+
+    # Top-K reads walk these backwards from the highest score, so a ranking costs the same at any catalog size
+    __table_args__ = (
+        Index("ix_movie_stats_bayesian_score", "bayesian_score", "movie_id"),
+        Index("ix_movie_stats_trending_score", "trending_score", "movie_id"),
+    )
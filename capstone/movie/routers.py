@@ -1,15 +1,26 @@
-from fastapi import APIRouter, Depends, status
+import io
+import tempfile
+from typing import Literal
 
-from capstone.movie.schema import Movie, CreateMovie
-from capstone.user.schema import Login
-from capstone.database import db_dependency
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+
+from capstone.movie.schema import Movie, CreateMovie, MoviePage, MovieSearchPage, MovieBatch, MovieRanking, CommentPage
+from capstone.user.schema import CurrentUser
+from capstone.database import db_dependency, run_in_session
 from capstone.auth.oauth2 import get_current_user
+from capstone.cache import MOVIE_LIST_NAMESPACE, movie_namespace, response_cache
+from capstone.etag import conditional_response
 import capstone.movie.crud as crud
-from capstone.database import db_dependency
+import capstone.movie.bulk as bulk
+import capstone.movie.export as export
 from capstone.movie.schema import Rating as RatingSchema
+from capstone.movie.schema import RatingSummary, RatingBatch, RatingBatchResult
 from capstone.movie.schema import Comment as CommentSchema
-from capstone.movie.schema import CommentResponse
+from capstone.movie.schema import CommentResponse, CommentThreadPage
 from capstone.movie.schema import ReplyComment 
+from capstone.movie.schema import ImportReport
 
 
 
@@ -18,97 +29,247 @@ movie_router = APIRouter(
     tags= ["Movie"]
 )
 
+MOVIE_BATCH_SIZE = 100
+
+
+async def _validator(db : db_dependency, namespace : str, key : str, fn, *args):
+    # Cached next to the response it describes, so it is invalidated by the same writes
+    return await response_cache.get_or_load("validator", namespace, key, lambda: run_in_session(db, fn, *args))
+
+
 @movie_router.post("/", response_model = Movie, status_code=status.HTTP_201_CREATED)
-def create_movie(db : db_dependency, payload : CreateMovie, current_user : Login = Depends(get_current_user)):
+async def create_movie(db : db_dependency, payload : CreateMovie, current_user : CurrentUser = Depends(get_current_user)):
     """
     ## Create a movie
     This creates a movie and can only be executed by the owner
     """
-    return crud.create_movie(db, payload, current_user)
+    return await run_in_session(db, crud.create_movie, payload, current_user)
+
+@movie_router.post("/import", response_model= ImportReport)
+async def import_movies(request : Request, db : db_dependency, format : Literal["ndjson", "csv"] | None = None, batch_size : int = Query(bulk.IMPORT_BATCH_SIZE, ge=1, le=50000), current_user : CurrentUser = Depends(get_current_user)):
+    """
+    ## Bulk import movies
+    This imports movies from an NDJSON (one `{"title", "description"}` object per line) or CSV
+    (`title,description` header) request body and can only be executed by registered users.
+    The format follows `format`, else the Content-Type. Rows that fail are listed with their row number
+    """
+    fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+    too_large = HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"Imports are limited to {bulk.IMPORT_MAX_BYTES} bytes")
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > bulk.IMPORT_MAX_BYTES:
+        raise too_large
+    # Spooled to disk past IMPORT_SPOOL_BYTES, so a large catalog is never held in memory
+    spool = tempfile.SpooledTemporaryFile(max_size=bulk.IMPORT_SPOOL_BYTES)
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        # Chunked bodies declare no length, so the limit is also held while reading
+        if received > bulk.IMPORT_MAX_BYTES:
+            spool.close()
+            raise too_large
+        # Past IMPORT_SPOOL_BYTES the spool is on disk, so writes go through the threadpool instead of blocking the loop
+        if received > bulk.IMPORT_SPOOL_BYTES:
+            await run_in_threadpool(spool.write, chunk)
+        else:
+            spool.write(chunk)
+    spool.seek(0)
+    # Undecodable bytes survive as surrogates, so the rows holding them are reported rather than stored mangled
+    with io.TextIOWrapper(spool, encoding="utf-8", errors="surrogateescape", newline="") as lines:
+        return await run_in_session(db, bulk.import_movies, lines, current_user.id, fmt, batch_size)
 
-@movie_router.get("/", response_model= list[Movie])
-def fetch_movies(db : db_dependency):
+@movie_router.get("/", response_model= MoviePage)
+async def fetch_movies(request : Request, response : Response, db : db_dependency, cursor : str | None = None, limit : int = Query(10, ge=1, le=100)):
     """
     ## Fetch all movies
-    This lists all movies in database and can be accessed by the public
+    This lists movies a page at a time and can be accessed by the public.
+    Pass the returned `next_cursor` or `prev_cursor` back as `cursor` to move between pages
     """
+    validator = await _validator(db, MOVIE_LIST_NAMESPACE, f"{cursor}:{limit}", crud.movies_page_validator, cursor, limit)
+    not_modified = conditional_response(request, response, validator)
+    if not_modified:
+        return not_modified
 
-    return crud.fetch_movies(db)
+    return await response_cache.get_or_load(
+        "movies", MOVIE_LIST_NAMESPACE, f"{cursor}:{limit}",
+        lambda: run_in_session(db, crud.fetch_movies, cursor, limit), MoviePage
+    )
+
+@movie_router.get("/export", response_class= StreamingResponse, responses= {200: {"content": {"application/x-ndjson": {}, "text/csv": {}}}})
+async def export_movies(db : db_dependency, format : Literal["ndjson", "csv"] = "ndjson", ratings : bool = False):
+    """
+    ## Export the movie catalog
+    This streams every movie as NDJSON or CSV and can be accessed by the public.
+    With `ratings=true` each row also carries the movie's `rating_count` and `average_rating`
+    """
+    return StreamingResponse(
+        export.stream_export(db, format, ratings),
+        media_type= export.MEDIA_TYPES[format],
+        headers= {"Content-Disposition": f'attachment; filename="movies.{format}"'}
+    )
+
+@movie_router.get("/search", response_model= MovieSearchPage)
+async def search_movies(db : db_dependency, q : str = Query(..., min_length=1, max_length=200), offset : int = Query(0, ge=0, le=1000), limit : int = Query(10, ge=1, le=100)):
+    """
+    ## Search for movies
+    This runs a ranked full-text search over movie titles and descriptions and can be accessed by the public.
+    Pass the returned `next_offset` back as `offset` for the next page
+    """
+    return await run_in_session(db, crud.search_movies, q, offset, limit)
+
+@movie_router.get("/batch", response_model= MovieBatch)
+async def fetch_movie_batch(db : db_dependency, ids : list[str] = Query(..., description= "Movie ids, comma separated or repeated")):
+    """
+    ## Fetch many movies by id
+    This fetches up to 100 movies in one request and can be accessed by the public.
+    Movies come back in the order their ids were given, ids with no movie are listed in `missing`
+    """
+    try:
+        requested = [int(value) for part in ids for value in part.split(",") if value.strip()]
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Movie ids must be integers")
+    requested = list(dict.fromkeys(requested))  # Each movie once, in the order first asked for
+    if not requested or len(requested) > MOVIE_BATCH_SIZE:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Between 1 and {MOVIE_BATCH_SIZE} movie ids are allowed")
+    return await run_in_session(db, crud.fetch_movies_by_ids, requested)
+
+@movie_router.get("/top", response_model= MovieRanking)
+async def fetch_top_movies(db : db_dependency, limit : int = Query(10, ge=1, le=100)):
+    """
+    ## Top rated movies
+    This lists the best rated movies and can be accessed by the public.
+    `score` is the average rating pulled towards a prior, so movies with only a few ratings do not top the list
+    """
+    return await run_in_session(db, crud.fetch_top_movies, limit)
+
+@movie_router.get("/trending", response_model= MovieRanking)
+async def fetch_trending_movies(db : db_dependency, limit : int = Query(10, ge=1, le=100)):
+    """
+    ## Trending movies
+    This lists the movies with the most recent ratings and comments and can be accessed by the public.
+    `score` counts each rating and comment as 1, halved for every half-life (72 hours by default) since it was made
+    """
+    return await run_in_session(db, crud.fetch_trending_movies, limit)
 
 @movie_router.get("/{id}", response_model = Movie)
-def fetch_movie(db : db_dependency, id : int):
+async def fetch_movie(request : Request, response : Response, db : db_dependency, id : int):
     """
     ## Fetch a movie by id
-    This fetches a movie by its id and can be accessed by the public
+    This fetches a movie by its id and can be accessed by the public.
+    Send the returned `ETag` back as `If-None-Match` to get a 304 while the movie is unchanged
     """
-    return crud.fetch_movie_by_id(db, id)
+    validator = await _validator(db, movie_namespace(id), "movie", crud.movie_validator, id)
+    not_modified = conditional_response(request, response, validator)
+    if not_modified:
+        return not_modified
+    return await response_cache.get_or_load(
+        "movie", movie_namespace(id), "movie",
+        lambda: run_in_session(db, crud.fetch_movie_by_id, id), Movie
+    )
 
 
 @movie_router.put("/{id}", response_model = Movie)
-def update_movie(db : db_dependency, id : int, payload : CreateMovie, current_user : Login = Depends(get_current_user)):
+async def update_movie(db : db_dependency, id : int, payload : CreateMovie, current_user : CurrentUser = Depends(get_current_user)):
     """
     ## Update a movie by id
     This updates a movie by its id and can only be executed by the owner
     """
-    return crud.update_movie(db, id, payload, current_user)
+    return await run_in_session(db, crud.update_movie, id, payload, current_user)
 
 @movie_router.delete("/{id}", status_code= status.HTTP_204_NO_CONTENT)
-def delete_movie(db : db_dependency, id : int, current_user : Login = Depends(get_current_user)):
+async def delete_movie(db : db_dependency, id : int, current_user : CurrentUser = Depends(get_current_user)):
     """
     ## Delete a movie by id
     This deletes a movie by its id and can only be executed by the owner
     """
-    return crud.delete_movie(db, id, current_user)
-
-# @movie_router.get("/search/{title}", response_model= list[Movie])
-# def search_movie(db : db_dependency, title : str):
-#     """
-#     ## Search for a movie by title
-#     This searches for movies by their title and can be accessed by the public
-#     """
-#     return crud.fetch_movies(db, title)
+    return await run_in_session(db, crud.delete_movie, id, current_user)
 
-@movie_router.post("/{movie_id}/rate", status_code= status.HTTP_201_CREATED)
-def rate_movie(db : db_dependency, payload : RatingSchema, current_user : Login = Depends(get_current_user)):
+@movie_router.post("/{movie_id}/rate", response_model= RatingSummary, status_code= status.HTTP_201_CREATED)
+async def rate_movie(db : db_dependency, payload : RatingSchema, current_user : CurrentUser = Depends(get_current_user)):
     """
     ## Rate a movie by id
-    This rates a movie by its id and can only be executed a registered users once
+    This rates a movie by its id and can only be executed a registered users once.
+    Returns the movie's updated rating summary
     """
-    return crud.rate_movie(db, payload, current_user)
+    return await run_in_session(db, crud.rate_movie, payload, current_user)
+
+@movie_router.post("/ratings", response_model= RatingBatchResult)
+async def rate_movies(db : db_dependency, payload : RatingBatch, current_user : CurrentUser = Depends(get_current_user)):
+    """
+    ## Rate many movies at once
+    This creates or replaces the user's ratings for up to 500 movies in one request and can only be executed by registered users.
+    Unlike rating one movie, an existing rating is updated. Movies that do not exist or values outside 1-10 are listed in `errors`
+    """
+    return await run_in_session(db, crud.rate_movies, payload, current_user)
 
 
 @movie_router.get("/{movie_id}/ratings")
-def fetch_ratings(db : db_dependency, movie_id : int):
+async def fetch_ratings(request : Request, response : Response, db : db_dependency, movie_id : int):
     """
     ## Get ratings for a movie by id
     This fetches ratings for a movie by its id and can be accessed by the public
     """
-    return crud.get_ratings(db, movie_id)
+    validator = await _validator(db, movie_namespace(movie_id), "ratings", crud.ratings_validator, movie_id)
+    not_modified = conditional_response(request, response, validator)
+    if not_modified:
+        return not_modified
+    return await response_cache.get_or_load(
+        "ratings", movie_namespace(movie_id), "ratings",
+        lambda: run_in_session(db, crud.get_ratings, movie_id)
+    )
+
+@movie_router.get("/{movie_id}/ratings/summary", response_model= RatingSummary)
+async def fetch_rating_summary(request : Request, response : Response, db : db_dependency, movie_id : int):
+    """
+    ## Get the rating summary for a movie by id
+    This returns the rating count, average and 1-10 histogram for a movie and can be accessed by the public
+    """
+    validator = await _validator(db, movie_namespace(movie_id), "ratings", crud.ratings_validator, movie_id)
+    not_modified = conditional_response(request, response, validator)
+    if not_modified:
+        return not_modified
+    return await response_cache.get_or_load(
+        "rating_summary", movie_namespace(movie_id), "summary",
+        lambda: run_in_session(db, crud.get_rating_summary, movie_id)
+    )
 
 @movie_router.post("/{id}/comment", response_model= CommentResponse, status_code=status.HTTP_201_CREATED)
-def comment(db : db_dependency, payload : CommentSchema,  current_user : Login = Depends(get_current_user)):
+async def comment(db : db_dependency, payload : CommentSchema,  current_user : CurrentUser = Depends(get_current_user)):
     """
     ## Comment on a movie by id
     This comments on a movie by its id and can only be executed registered users
     """
-    return crud.comment(db, payload, current_user)
+    return await run_in_session(db, crud.comment, payload, current_user)
 
-@movie_router.get("/{movie_id}/comments")
-def fetch_comments(db : db_dependency, movie_id : int):
+@movie_router.get("/{movie_id}/comments", response_model= None, responses= {200: {"model": CommentPage | CommentThreadPage}})
+async def fetch_comments(request : Request, response : Response, db : db_dependency, movie_id : int, cursor : str | None = None, limit : int = Query(10, ge=1, le=100), tree : bool = False, depth : int = Query(5, ge=1, le=20)):
     """
     ## Get comments for a movie by id
-    This fetches comments for a movie by its id and can be accessed by the public
+    This fetches comments for a movie a page at a time and can be accessed by the public.
+    Pass the returned `next_cursor` or `prev_cursor` back as `cursor` to move between pages.
+    With `tree=true` the page holds top-level comments with their replies nested up to `depth` levels
     """
+    validator = await _validator(db, movie_namespace(movie_id), "comments", crud.comments_validator, movie_id)
+    not_modified = conditional_response(request, response, validator)
+    if not_modified:
+        return not_modified
+
+    # Validated here rather than through a union response_model, which would read the lazy `replies` backref
+    async def load():
+        if tree:
+            return CommentThreadPage.model_validate(await run_in_session(db, crud.fetch_comment_tree, movie_id, cursor, limit, depth))
+        return CommentPage.model_validate(await run_in_session(db, crud.fetch_comments, movie_id, cursor, limit), from_attributes=True)
 
-    return crud.fetch_comments(db, movie_id)
+    return await response_cache.get_or_load(
+        "comments", movie_namespace(movie_id), f"comments:{cursor}:{limit}:{tree}:{depth}", load
+    )
 
 @movie_router.post("/{comment_id}/reply")
-def reply_to_comment(db : db_dependency, payload : ReplyComment,  current_user : Login = Depends(get_current_user)):
+async def reply_to_comment(db : db_dependency, payload : ReplyComment,  current_user : CurrentUser = Depends(get_current_user)):
     """
     ## Reply to a comment by id
     This replies to a comment by its id and can only be executed registered users
     """
-    return crud.reply_to_comment(db, payload, current_user)
+    return await run_in_session(db, crud.reply_to_comment, payload, current_user)
 
     
 
@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from typing import Literal
+
+from pydantic import BaseModel, Field
 from datetime import datetime
 
 
@@ -8,7 +10,16 @@ class Movie(BaseModel):
     description: str
     release_date: datetime
     updated_at: datetime
+    rating_count: int = 0
+    comment_count: int = 0
+    avg_rating: float | None = None
     
+class MovieListItem(BaseModel):
+    """What a list of someone's movies needs, without the descriptions."""
+    id: int
+    title: str
+    release_date: datetime
+
 class CreateMovie(BaseModel):
     title: str
     description: str
@@ -18,6 +29,28 @@ class Rating(BaseModel):
     rating: int
     movie_id : int
 
+class RatingBatch(BaseModel):
+    ratings: list[Rating] = Field(..., min_length=1, max_length=500)
+
+class RatingBatchItem(BaseModel):
+    movie_id: int
+    rating: int
+    status: Literal["created", "updated", "unchanged"]
+
+class RatingBatchError(BaseModel):
+    movie_id: int
+    error: str
+
+class RatingBatchResult(BaseModel):
+    items: list[RatingBatchItem]
+    errors: list[RatingBatchError]
+
+class RatingSummary(BaseModel):
+    movie_id: int
+    rating_count: int
+    average_rating: float | None
+    histogram: dict[int, int]
+
 class Comment(BaseModel):
     content: str
     movie_id: int 
@@ -31,4 +64,50 @@ class ReplyComment(BaseModel):
     content: str
     comment_id: int
 
+class CommentDetail(CommentResponse):
+    id: int
+    user_id: int
+
+
+class CommentThread(CommentDetail):
+    replies: list["CommentThread"]
+
+
+class MoviePage(BaseModel):
+    items: list[Movie]
+    next_cursor: str | None
+    prev_cursor: str | None
+
+class MovieSearchPage(BaseModel):
+    items: list[Movie]
+    next_offset: int | None
+
+class MovieBatch(BaseModel):
+    items: list[Movie]
+    missing: list[int]
+
+class RankedMovie(Movie):
+    score: float
+
+class MovieRanking(BaseModel):
+    items: list[RankedMovie]
+
+class CommentPage(BaseModel):
+    items: list[CommentDetail]
+    next_cursor: str | None
+    prev_cursor: str | None
+
+class CommentThreadPage(BaseModel):
+    items: list[CommentThread]
+    next_cursor: str | None
+    prev_cursor: str | None
+
+
+class ImportRowError(BaseModel):
+    row: int
+    error: str
 
+class ImportReport(BaseModel):
+    inserted: int
+    failed: int
+    errors: list[ImportRowError]
@@ -0,0 +1,61 @@
+import base64
+import json
+
+from fastapi import HTTPException, status
+
+
+def encode_cursor(last_id : int, direction : str):
+    raw = json.dumps({"id": last_id, "dir": direction}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor : str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        last_id, direction = int(data["id"]), data["dir"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    if direction not in ("next", "prev"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    return last_id, direction
+
+
+def paginate(query, id_column, cursor : str | None = None, limit : int = 10):
+    """
+    Keyset pagination over a unique, indexed id column.
+    Every page is a single index range scan, so page N costs the same as page 1.
+    Returns a dict with the page items and the opaque next/prev cursors.
+    """
+    if cursor is None:
+        rows = query.order_by(id_column.asc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        items = rows[:limit]
+        next_cursor = encode_cursor(items[-1].id, "next") if has_more else None
+        prev_cursor = None
+    else:
+        last_id, direction = decode_cursor(cursor)
+        if direction == "next":
+            rows = query.filter(id_column > last_id).order_by(id_column.asc()).limit(limit + 1).all()
+            has_more = len(rows) > limit
+            items = rows[:limit]
+            next_cursor = encode_cursor(items[-1].id, "next") if has_more else None
+            prev_cursor = encode_cursor(items[0].id, "prev") if items else None
+        else:
+            rows = query.filter(id_column < last_id).order_by(id_column.desc()).limit(limit + 1).all()
+            has_more = len(rows) > limit
+            items = list(reversed(rows[:limit]))
+            prev_cursor = encode_cursor(items[0].id, "prev") if has_more else None
+            next_cursor = encode_cursor(items[-1].id, "next") if items else None
+
+    return {
+        "items": items,
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor
+    }
@@ -0,0 +1,120 @@
+"""
+Application settings, read from the environment once when this module is first imported.
+
+A .env file in the working directory is loaded here and nowhere else; variables already set in the
+environment win over it. Modules copy the values they need into their own constants, so tests can
+still monkeypatch a single module's setting.
+"""
+import os
+from dataclasses import dataclass
+
+from dotenv import load_dotenv
+
+
+def _flag(name : str, default : str):
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+
+@dataclass(frozen=True)
+class Settings:
+    database_url : str | None
+    async_database_url : str | None
+    db_async : bool
+    db_pool_size : int
+    db_max_overflow : int
+    db_pool_timeout : float
+    db_pool_recycle : int
+    db_pool_pre_ping : bool
+
+    secret_key : str | None
+    algorithm : str | None
+    access_token_expire_minutes : int
+    token_cache_size : int
+    token_cache_ttl : float
+    principal_cache_size : int
+    principal_cache_ttl : float
+
+    bcrypt_rounds : int
+    hash_workers : int
+    hash_max_queue : int
+
+    # "memory" keeps the response cache inside each worker process, and an invalidation only reaches the
+    # worker that handled the write: the others serve stale bodies and 304s for up to CACHE_TTL. Anything
+    # running more than one worker (WEB_CONCURRENCY > 1, or a PROMETHEUS_MULTIPROC_DIR) should use "redis"
+    cache_backend : str
+    cache_url : str
+    cache_size : int
+    cache_ttl : float
+
+    log_sink : str
+    log_queue_size : int
+    log_batch_size : int
+    log_flush_interval : float
+    log_info_sample_rate : float
+    # Sentry is only imported and started when a DSN is configured
+    sentry_dsn : str | None
+
+    slow_query_seconds : float
+    slow_query_log_chars : int
+    prometheus_multiproc_dir : str | None
+    # The worker count uvicorn and gunicorn default to
+    web_concurrency : int
+
+    import_batch_size : int
+    import_max_errors : int
+    import_spool_bytes : int
+    import_max_bytes : int
+    export_partition_size : int
+
+    top_prior_mean : float
+    top_prior_weight : float
+    trending_half_life_hours : float
+
+    @classmethod
+    def from_env(cls):
+        load_dotenv()
+        return cls(
+            database_url=os.getenv("DATABASE_URL"),
+            async_database_url=os.getenv("ASYNC_DATABASE_URL"),
+            db_async=_flag("DB_ASYNC", "false"),
+            db_pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+            db_max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+            db_pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+            db_pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+            db_pool_pre_ping=_flag("DB_POOL_PRE_PING", "true"),
+            secret_key=os.getenv("SECRET_KEY"),
+            algorithm=os.getenv("ALGORITHM"),
+            access_token_expire_minutes=int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30")),
+            token_cache_size=int(os.getenv("TOKEN_CACHE_SIZE", "10000")),
+            token_cache_ttl=float(os.getenv("TOKEN_CACHE_TTL", "300")),
+            principal_cache_size=int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000")),
+            principal_cache_ttl=float(os.getenv("PRINCIPAL_CACHE_TTL", "300")),
+            bcrypt_rounds=int(os.getenv("BCRYPT_ROUNDS", "12")),
+            hash_workers=int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1)))),
+            hash_max_queue=int(os.getenv("HASH_MAX_QUEUE", "64")),
+            cache_backend=os.getenv("CACHE_BACKEND", "memory"),
+            cache_url=os.getenv("CACHE_URL", "redis://localhost:6379/0"),
+            cache_size=int(os.getenv("CACHE_SIZE", "10000")),
+            cache_ttl=float(os.getenv("CACHE_TTL", "60")),
+            log_sink=os.getenv("LOG_SINK", "papertrail"),
+            log_queue_size=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+            log_batch_size=int(os.getenv("LOG_BATCH_SIZE", "200")),
+            log_flush_interval=float(os.getenv("LOG_FLUSH_INTERVAL", "0.5")),
+            log_info_sample_rate=float(os.getenv("LOG_INFO_SAMPLE_RATE", "1.0")),
+            sentry_dsn=os.getenv("SENTRY_DSN") or None,
+            slow_query_seconds=float(os.getenv("SLOW_QUERY_SECONDS", "0.5")),
+            slow_query_log_chars=int(os.getenv("SLOW_QUERY_LOG_CHARS", "1000")),
+            prometheus_multiproc_dir=os.getenv("PROMETHEUS_MULTIPROC_DIR") or None,
+            web_concurrency=int(os.getenv("WEB_CONCURRENCY", "1")),
+            import_batch_size=int(os.getenv("IMPORT_BATCH_SIZE", "1000")),
+            import_max_errors=int(os.getenv("IMPORT_MAX_ERRORS", "1000")),
+            import_spool_bytes=int(os.getenv("IMPORT_SPOOL_BYTES", str(8 * 1024 * 1024))),
+            import_max_bytes=int(os.getenv("IMPORT_MAX_BYTES", str(256 * 1024 * 1024))),
+            export_partition_size=int(os.getenv("EXPORT_PARTITION_SIZE", "1000")),
+            top_prior_mean=float(os.getenv("TOP_PRIOR_MEAN", "5.5")),
+            top_prior_weight=float(os.getenv("TOP_PRIOR_WEIGHT", "10")),
+            trending_half_life_hours=float(os.getenv("TRENDING_HALF_LIFE_HOURS", "72")),
+        )
+
+
+settings = Settings.from_env()
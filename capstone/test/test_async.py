@@ -0,0 +1,128 @@
+import json
+import os
+
+import pytest
+
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from fastapi.testclient import TestClient
+from fastapi  import status
+
+from capstone.cache import response_cache
+from capstone.database import Base, get_db, to_async_url
+from capstone.main import app
+
+# .env has already been loaded by capstone.settings
+SQLALCHEMY_DATABASE_URL = os.getenv("SQLALCHEMY_DATABASE_URL")
+
+
+# DDL goes through a sync engine, requests go through aiosqlite
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+async_engine = create_async_engine(to_async_url(SQLALCHEMY_DATABASE_URL), poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+
+@pytest.fixture(scope="module")
+def client():
+    previous = app.dependency_overrides.get(get_db)
+    app.dependency_overrides[get_db] = override_get_async_db
+    with TestClient(app) as c:
+        yield c
+    app.dependency_overrides[get_db] = previous
+
+
+@pytest.fixture(scope="module")
+def setup_database():
+    Base.metadata.create_all(bind=engine)
+    response_cache.clear()  # Cached responses belong to the previous module's database
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.mark.parametrize("username, email, password", [("asyncuser", "async@example.com", "testpassword")])
+def test_async_movie_flow(client, setup_database, username, email, password):
+    response = client.post(
+        "/user/signup",
+        json={"username": username, "email": email, "password": password}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()["movies"] == []
+
+    response = client.post("/user/auth/login", data={"username": username, "password": password})
+    assert response.status_code == status.HTTP_200_OK
+    token = response.json()["access_token"]
+
+    movie_data = {"title": "Async Movie", "description": "Async Description"}
+    response = client.post("/movie", json=movie_data, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == status.HTTP_201_CREATED
+    id_movie = response.json()["id"]
+
+    response = client.put(
+        f"/movie/{id_movie}",
+        json={"title": "Async Movie 2", "description": "Async Description 2"},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["title"] == "Async Movie 2"
+
+    response = client.post(
+        f"/movie/{id_movie}/rate",
+        json={"movie_id": id_movie, "rating": 8},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()["average_rating"] == 8.0
+
+    response = client.post(
+        f"/movie/{id_movie}/comment",
+        json={"movie_id": id_movie, "content": "Async comment"},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+
+    response = client.get(f"/movie/{id_movie}/comments")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["items"][0]["content"] == "Async comment"
+
+
+def test_async_movie_not_found(client, setup_database):
+    response = client.get("/movie/999")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert response.json().get("detail") == "Movie not found"
+
+
+def test_async_export_movies(client, setup_database):
+    response = client.get("/movie/export", params={"ratings": True})
+    assert response.status_code == status.HTTP_200_OK
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["title"] for row in rows] == ["Async Movie 2"]
+    assert rows[0]["rating_count"] == 1
+    assert rows[0]["average_rating"] == 8.0
+
+
+def test_async_connections_get_sqlite_math_functions(monkeypatch):
+    import math
+    from types import SimpleNamespace
+
+    import anyio
+    from sqlalchemy import text
+
+    import capstone.database
+
+    # A stand-in exp() tells the registered function apart from SQLite's own
+    monkeypatch.setattr(capstone.database, "math", SimpleNamespace(exp=lambda value: 42.0, log=math.log))
+
+    async def probe():
+        async with async_engine.connect() as connection:  # NullPool, so this is a fresh aiosqlite connection
+            return (await connection.execute(text("SELECT exp(0), ln(1)"))).one()
+
+    assert tuple(anyio.run(probe)) == (42.0, 0.0)
@@ -0,0 +1,110 @@
+import asyncio
+import time
+
+from capstone.cache import LocalCacheBackend, RedisCacheBackend, ResponseCache, TTLCache, warn_if_cache_is_per_process
+from capstone.auth.oauth2 import invalidate_principal, principal_cache
+from capstone.user.schema import CurrentUser
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "a" is now the most recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("short", "value", ttl=0.01)
+    cache.set("long", "value")
+    time.sleep(0.02)
+    assert cache.get("short") is None
+    assert cache.get("long") == "value"
+
+
+def test_invalidate_principal():
+    principal_cache.set("someone", CurrentUser(id=7, username="someone"))
+    invalidate_principal("someone")
+    assert principal_cache.get("someone") is None
+
+
+class FakeRedis:
+    """Stand-in for redis.Redis covering the commands RedisCacheBackend uses."""
+
+    def __init__(self):
+        self.data = {}
+        self.expiry = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value.encode()
+        self.expiry[key] = ex
+        return True
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+def load_counter():
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        return {"value": len(calls)}
+
+    return calls, loader
+
+
+def check_read_through_and_invalidation(cache):
+    calls, loader = load_counter()
+    first = asyncio.run(cache.get_or_load("movie", "movie:1", "movie", loader))
+    second = asyncio.run(cache.get_or_load("movie", "movie:1", "movie", loader))
+    assert first == second == {"value": 1}
+    assert len(calls) == 1
+
+    # Other namespaces are untouched by the invalidation
+    asyncio.run(cache.get_or_load("movie", "movie:2", "movie", loader))
+    cache.invalidate("movie:1")
+    assert asyncio.run(cache.get_or_load("movie", "movie:1", "movie", loader)) == {"value": 3}
+    assert asyncio.run(cache.get_or_load("movie", "movie:2", "movie", loader)) == {"value": 2}
+    assert len(calls) == 3
+
+
+def test_response_cache_local_backend():
+    check_read_through_and_invalidation(ResponseCache(LocalCacheBackend(), ttl=60))
+
+
+def test_response_cache_redis_backend():
+    fake = FakeRedis()
+    check_read_through_and_invalidation(ResponseCache(RedisCacheBackend(fake), ttl=60))
+    assert all(key.startswith("capstone:") for key in fake.data)
+    assert fake.expiry["capstone:gen:movie:1"] == 600
+
+
+def test_evicted_generation_never_revives_stale_entries():
+    backend = LocalCacheBackend()
+    cache = ResponseCache(backend, ttl=60)
+    calls, loader = load_counter()
+    asyncio.run(cache.get_or_load("movie", "movie:1", "movie", loader))
+    backend.delete("gen:movie:1")  # As if the LRU had evicted the generation
+    assert asyncio.run(cache.get_or_load("movie", "movie:1", "movie", loader)) == {"value": 2}
+
+
+def test_per_process_cache_warns_with_several_workers(caplog):
+    local = ResponseCache(LocalCacheBackend(), ttl=60)
+    assert not warn_if_cache_is_per_process(local, workers=1, multiprocess=False)
+    with caplog.at_level("WARNING", logger="capstone.cache"):
+        assert warn_if_cache_is_per_process(local, workers=4, multiprocess=False)
+    assert "CACHE_BACKEND=redis" in caplog.text
+    assert warn_if_cache_is_per_process(local, workers=1, multiprocess=True)
+    # A shared backend sees every invalidation
+    assert not warn_if_cache_is_per_process(ResponseCache(RedisCacheBackend(FakeRedis()), ttl=60), workers=4, multiprocess=True)
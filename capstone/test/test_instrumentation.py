@@ -0,0 +1,137 @@
+import logging
+
+import pytest
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+import capstone.instrumentation as instrumentation
+from capstone.instrumentation import QueryStatsMiddleware, RequestMetricsMiddleware, instrument_queries
+
+
+engine = create_engine("sqlite://")
+# NullPool, so no aiosqlite worker thread outlives a request and keeps the test run from exiting
+async_engine = create_async_engine("sqlite+aiosqlite://", poolclass=NullPool)
+instrument_queries()
+
+app = FastAPI()
+app.add_middleware(QueryStatsMiddleware)
+app.add_middleware(RequestMetricsMiddleware)
+
+
+@app.get("/sync/{item_id}")
+def sync_endpoint(item_id : int):
+    # Runs in the threadpool, the statements must still land on this request
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+        connection.execute(text("SELECT 2"))
+    return {"id": item_id}
+
+
+@app.get("/async")
+async def async_endpoint():
+    async with async_engine.connect() as connection:
+        await connection.execute(text("SELECT 1"))
+    return {}
+
+
+@app.get("/stream")
+def stream_endpoint():
+    def rows():
+        with engine.connect() as connection:
+            yield str(connection.execute(text("SELECT 1")).scalar())
+    return StreamingResponse(rows())
+
+
+@app.get("/in-flight")
+def in_flight_endpoint():
+    return {"in_flight": REGISTRY.get_sample_value("http_requests_in_flight", {"method": "GET"})}
+
+
+@app.get("/boom")
+def failing_endpoint():
+    raise RuntimeError("boom")
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as c:
+        yield c
+
+
+def sample(name, route):
+    return REGISTRY.get_sample_value(name, {"method": "GET", "route": route}) or 0
+
+
+def test_server_timing_counts_queries_per_request(client):
+    before = sample("http_request_db_queries_sum", "/sync/{item_id}")
+    response = client.get("/sync/1")
+    assert 'db;dur=' in response.headers["server-timing"]
+    assert 'desc="2 queries"' in response.headers["server-timing"]
+    assert sample("http_request_db_queries_sum", "/sync/{item_id}") - before == 2
+    assert sample("http_request_db_seconds_count", "/sync/{item_id}") >= 1
+
+    # Statements outside a request are not counted against the next one
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 3"))
+    assert 'desc="2 queries"' in client.get("/sync/2").headers["server-timing"]
+
+
+def test_server_timing_counts_async_queries(client):
+    response = client.get("/async")
+    assert 'desc="1 queries"' in response.headers["server-timing"]
+
+
+def test_unmatched_routes_share_a_label(client):
+    client.get("/no/such/path")
+    assert sample("http_request_db_queries_count", "unmatched") >= 1
+
+
+def test_slow_query_log(client, monkeypatch, caplog):
+    monkeypatch.setattr(instrumentation, "SLOW_QUERY_SECONDS", 0)
+    before = REGISTRY.get_sample_value("db_slow_queries_total")
+    with caplog.at_level(logging.WARNING, logger="capstone.instrumentation"):
+        client.get("/sync/1")
+    assert [record.getMessage() for record in caplog.records if "Slow query" in record.getMessage()][-1].endswith("SELECT 2")
+    assert REGISTRY.get_sample_value("db_slow_queries_total") - before == 2
+
+
+def test_streamed_responses_skip_server_timing(client):
+    before = sample("http_request_db_queries_sum", "/stream")
+    response = client.get("/stream")
+    assert response.text == "1"
+    assert "server-timing" not in response.headers
+    assert sample("http_request_db_queries_sum", "/stream") - before == 1
+
+
+def request_count(route, status):
+    return REGISTRY.get_sample_value(
+        "http_request_duration_seconds_count", {"method": "GET", "route": route, "status": status}
+    ) or 0
+
+
+def test_request_histogram_by_route_and_status(client):
+    ok, missing = request_count("/sync/{item_id}", "200"), request_count("unmatched", "404")
+    client.get("/sync/3")
+    client.get("/sync/4")
+    client.get("/no/such/path")
+    assert request_count("/sync/{item_id}", "200") - ok == 2
+    assert request_count("unmatched", "404") - missing == 1
+
+
+def test_unhandled_errors_count_as_500(client):
+    before = request_count("/boom", "500")
+    with pytest.raises(RuntimeError):
+        client.get("/boom")
+    assert request_count("/boom", "500") - before == 1
+
+
+def test_in_flight_gauge(client):
+    idle = REGISTRY.get_sample_value("http_requests_in_flight", {"method": "GET"})
+    assert client.get("/in-flight").json()["in_flight"] == idle + 1
+    assert REGISTRY.get_sample_value("http_requests_in_flight", {"method": "GET"}) == idle
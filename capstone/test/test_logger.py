@@ -0,0 +1,75 @@
+import logging
+import queue
+
+from capstone.logger import BatchingQueueListener, DroppingQueueHandler, MemorySink, SamplingFilter
+
+
+def make_logger(name, handler):
+    test_logger = logging.getLogger(name)
+    test_logger.propagate = False
+    test_logger.handlers = [handler]
+    test_logger.setLevel(logging.INFO)
+    return test_logger
+
+
+def test_records_are_shipped_in_batches():
+    log_queue = queue.Queue(maxsize=100)
+    sink = MemorySink()
+    test_logger = make_logger("capstone.test.batching", DroppingQueueHandler(log_queue))
+    for number in range(10):
+        test_logger.info("record %s", number)
+
+    # Starting after the records are queued lets the listener pick them all up in one go
+    listener = BatchingQueueListener(log_queue, [sink], batch_size=4, flush_interval=0.01)
+    listener.start()
+    listener.stop()
+
+    assert [record.getMessage() for record in sink.records] == [f"record {number}" for number in range(10)]
+    assert sink.batches == 3
+
+
+def test_full_buffer_drops_instead_of_blocking():
+    log_queue = queue.Queue(maxsize=2)
+    handler = DroppingQueueHandler(log_queue)
+    test_logger = make_logger("capstone.test.dropping", handler)
+    for number in range(5):
+        test_logger.warning("record %s", number)
+
+    assert log_queue.qsize() == 2
+    assert handler.dropped == 3
+
+
+def test_sampling_keeps_warnings():
+    log_queue = queue.Queue(maxsize=100)
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(0.0))
+    test_logger = make_logger("capstone.test.sampling", handler)
+    test_logger.info("chatty")
+    test_logger.warning("important")
+
+    assert log_queue.qsize() == 1
+    assert log_queue.get_nowait().getMessage() == "important"
+
+
+def test_sinks_are_built_on_the_first_record():
+    log_queue = queue.Queue(maxsize=100)
+    sink = MemorySink()
+    built = []
+
+    def build_sinks():
+        built.append(True)
+        return [sink]
+
+    listener = BatchingQueueListener(log_queue, build_sinks, batch_size=10, flush_interval=0.01)
+    test_logger = make_logger("capstone.test.lazy", DroppingQueueHandler(log_queue, listener))
+    assert built == []
+
+    test_logger.warning("first")
+    test_logger.warning("second")
+    listener.stop()
+
+    assert built == [True]
+    assert [record.getMessage() for record in sink.records] == ["first", "second"]
+    # A stopped listener is not started again by late records
+    test_logger.warning("after shutdown")
+    assert listener._thread is None
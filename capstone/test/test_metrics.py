@@ -0,0 +1,48 @@
+from fastapi.testclient import TestClient
+from fastapi  import status
+
+from prometheus_client import Counter, values
+
+import capstone.metrics as metrics
+from capstone.database import engine
+from capstone.main import app
+
+
+client = TestClient(app)
+
+
+def test_metrics_exposes_pool_gauges():
+    # Check a connection out of the application pool so the gauges move
+    with engine.connect():
+        response = client.get("/metrics")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'db_pool_connections_in_use{pool="sync"} 1.0' in body
+    assert 'db_pool_capacity_connections{pool="sync"} 15.0' in body
+    assert 'db_pool_checkout_seconds_count{pool="sync"}' in body
+
+
+def test_metrics_exposes_request_and_threadpool_metrics():
+    client.get("/metrics")
+    body = client.get("/metrics").text
+    assert 'http_request_duration_seconds_count{method="GET",route="/metrics",status="200"}' in body
+    assert 'http_requests_in_flight{method="GET"} 1.0' in body
+    assert "threadpool_capacity_threads 40.0" in body
+    assert "threadpool_threads_in_use" in body
+    assert "threadpool_tasks_waiting" in body
+    assert "response_cache_requests_total" in body
+
+
+def test_metrics_merges_worker_processes(tmp_path, monkeypatch):
+    # Two "workers" writing to the same directory show up as one summed series
+    monkeypatch.setattr(metrics, "PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    monkeypatch.setattr(values, "ValueClass", values.MultiProcessValue(process_identifier=lambda: 101))
+    jobs = Counter("multiprocess_test_jobs", "Jobs", registry=None)
+    jobs.inc(2)
+    monkeypatch.setattr(values, "ValueClass", values.MultiProcessValue(process_identifier=lambda: 102))
+    Counter("multiprocess_test_jobs", "Jobs", registry=None).inc(3)
+
+    body = client.get("/metrics").text
+    assert "multiprocess_test_jobs_total 5.0" in body
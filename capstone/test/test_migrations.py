@@ -0,0 +1,115 @@
+from pathlib import Path
+
+import pytest
+
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import NullPool
+
+import capstone
+from capstone.database import Base
+from capstone.movie.models import description_fingerprint
+
+
+MIGRATIONS = Path(capstone.__file__).parent / "migrations"
+FOREIGN_KEY_INDEXES = {
+    "ratings": {"ix_ratings_movie_id", "ix_ratings_user_id"},
+    "comments": {"ix_comments_movie_id", "ix_comments_parent_id"},
+}
+
+
+def alembic_config(url):
+    config = Config()
+    config.set_main_option("script_location", str(MIGRATIONS))
+    config.set_main_option("sqlalchemy.url", url)
+    return config
+
+
+@pytest.fixture
+def database(tmp_path):
+    url = f"sqlite:///{tmp_path / 'migrations.db'}"
+    engine = create_engine(url, poolclass=NullPool)
+    yield url, engine
+    engine.dispose()
+
+
+def index_names(engine, table):
+    return {index["name"] for index in inspect(engine).get_indexes(table)}
+
+
+def test_upgrade_and_downgrade_a_new_database(database):
+    url, engine = database
+    command.upgrade(alembic_config(url), "head")
+    for table, indexes in FOREIGN_KEY_INDEXES.items():
+        assert indexes <= index_names(engine, table)
+
+    command.downgrade(alembic_config(url), "base")
+    assert set(inspect(engine).get_table_names()) == {"alembic_version"}
+
+
+def test_upgrade_a_database_created_at_startup(database):
+    # Tables and rows left by the old create_all at import time, with no alembic_version table
+    url, engine = database
+    command.upgrade(alembic_config(url), "0001")
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE alembic_version"))
+        connection.execute(text(
+            "INSERT INTO users (id, username, email, password) VALUES "
+            "(1, 'legacy', 'legacy@example.com', 'x'), (2, 'other', 'other@example.com', 'x')"
+        ))
+        connection.execute(text(
+            "INSERT INTO movies (id, title, description, user_id) VALUES "
+            "(1, 'Legacy', 'An old movie', 1), (2, 'Unrated', 'Nobody rated it', 1)"
+        ))
+        # User 2 rated movie 1 twice before ratings were unique, the later 6 is the one that counts
+        connection.execute(text("INSERT INTO ratings (user_id, movie_id, rating) VALUES (1, 1, 8), (2, 1, 3), (2, 1, 6)"))
+        connection.execute(text(
+            "INSERT INTO comments (id, user_id, movie_id, parent_id, content) VALUES "
+            "(1, 1, 1, NULL, 'Loved it'), (2, 2, 1, 1, 'Me too'), (3, 2, 2, NULL, 'Nobody?')"
+        ))
+
+    command.upgrade(alembic_config(url), "head")
+    assert FOREIGN_KEY_INDEXES["ratings"] <= index_names(engine, "ratings")
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT title FROM movies ORDER BY id")).scalars().all() == ["Legacy", "Unrated"]
+        stats = connection.execute(text(
+            "SELECT movie_id, rating_count, rating_sum, rating_6, rating_8, rating_10 FROM movie_stats ORDER BY movie_id"
+        )).all()
+        assert stats == [(1, 2, 14, 1, 1, 0), (2, 0, 0, 0, 0, 0)]
+        assert connection.execute(text("SELECT user_id, rating FROM ratings ORDER BY user_id")).all() == [(1, 8), (2, 6)]
+        assert connection.execute(text("SELECT ratings_version FROM movie_stats")).scalars().all() == [0, 0]
+        assert connection.execute(text("SELECT comment_count FROM movie_stats ORDER BY movie_id")).scalars().all() == [2, 1]
+        # Rated movies are ranked with the default prior of 10 ratings of 5.5, unrated ones are not
+        assert connection.execute(text("SELECT bayesian_score FROM movie_stats ORDER BY movie_id")).scalars().all() == [(55 + 14) / 12, None]
+        hashes = connection.execute(text("SELECT description, description_hash FROM movies ORDER BY id")).all()
+        assert [hash for _, hash in hashes] == [description_fingerprint(description) for description, _ in hashes]
+        # Movies that existed before the search index are found through it
+        matches = connection.execute(text("SELECT rowid FROM movies_fts WHERE movies_fts MATCH 'nobody'")).scalars().all()
+        assert matches == [2]
+
+        with pytest.raises(IntegrityError):
+            connection.execute(text("INSERT INTO ratings (user_id, movie_id, rating) VALUES (1, 1, 2)"))
+
+    # And the triggers keep it current from here on
+    with engine.begin() as connection:
+        connection.execute(text("UPDATE movies SET description = 'Rated at last' WHERE id = 2"))
+        assert connection.execute(text("SELECT rowid FROM movies_fts WHERE movies_fts MATCH 'nobody'")).all() == []
+        assert connection.execute(text("SELECT rowid FROM movies_fts WHERE movies_fts MATCH 'last'")).scalars().all() == [2]
+
+
+# The Postgres-only GIN expression index cannot be compared on SQLite
+@pytest.mark.filterwarnings("ignore:autogenerate skipping metadata-specified expression-based index")
+def test_migrations_match_the_models(database):
+    url, engine = database
+    command.upgrade(alembic_config(url), "head")
+    with engine.connect() as connection:
+        context = MigrationContext.configure(connection)
+        differences = compare_metadata(context, Base.metadata)
+    # Only the FTS5 tables, which the models deliberately leave out of the metadata
+    assert [difference for difference in differences if not (
+        difference[0] == "remove_table" and difference[1].name.startswith("movies_fts")
+    )] == []
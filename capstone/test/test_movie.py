@@ -1,27 +1,32 @@
+import csv
+import io
+import json
 import os
-
-from dotenv import load_dotenv
+import re
+from contextlib import contextmanager
+from datetime import timedelta
 
 import pytest
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
 
 from fastapi.testclient import TestClient
 from fastapi  import status
 
+from capstone.cache import response_cache
 from capstone.database import Base, get_db
 from capstone.main import app
 
-load_dotenv()
-
+# .env has already been loaded by capstone.settings
 SQLALCHEMY_DATABASE_URL = os.getenv("SQLALCHEMY_DATABASE_URL")
 
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 Base.metadata.create_all(bind=engine)
 
@@ -45,8 +50,24 @@ def client():
 @pytest.fixture(scope="module")
 def setup_database():
     Base.metadata.create_all(bind=engine)
+    response_cache.clear()  # Cached responses belong to the previous module's database
     yield
     Base.metadata.drop_all(bind=engine)
+
+
+@contextmanager
+def count_queries():
+    """Collects every statement sent to the database while the block runs, whichever test engine serves the app."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(Engine, "before_cursor_execute", record)
   
 
 @pytest.mark.parametrize("username, email, password", [("username", "test@example.com", "testpassword")])
@@ -78,11 +99,13 @@ def test_list_movies(client, setup_database, username, email, password):
 def test_fetch_movies(client, setup_database, username, password):
     response = client.get("/movie")
     assert response.status_code == status.HTTP_200_OK
-    assert type(response.json()) == list
-    assert response.json()[0]["title"] == "Test Movie"
-    assert response.json()[0]["description"] == "Test Description"
-    assert response.json()[0]["release_date"] == f"{response.json()[0].get('release_date')}"
-    assert response.json()[0]["updated_at"] == f"{response.json()[0].get('updated_at')}"
+    assert type(response.json()["items"]) == list
+    assert response.json()["items"][0]["title"] == "Test Movie"
+    assert response.json()["items"][0]["description"] == "Test Description"
+    assert response.json()["items"][0]["release_date"] == f"{response.json()['items'][0].get('release_date')}"
+    assert response.json()["items"][0]["updated_at"] == f"{response.json()['items'][0].get('updated_at')}"
+    assert response.json()["next_cursor"] is None
+    assert response.json()["prev_cursor"] is None
 
 @pytest.mark.parametrize("username, password,", [("username", "testpassword")])
 def test_fetch_movies_by_id(client, setup_database, username, password):
@@ -95,7 +118,10 @@ def test_fetch_movies_by_id(client, setup_database, username, password):
         "title": "Test Movie",
         "description": "Test Description",
         "release_date": f"{response.json().get('release_date')}",
-        "updated_at": f"{response.json().get('updated_at')}"
+        "updated_at": f"{response.json().get('updated_at')}",
+        "rating_count": 0,
+        "comment_count": 0,
+        "avg_rating": None
     }
 
 @pytest.mark.parametrize("username, password", [("username", "testpassword")])
@@ -121,7 +147,10 @@ def test_update_movie(client, setup_database, username, password):
         "title": "Updated Test Movie",
         "description": "Updated Test Description",
         "release_date": f"{response.json()['release_date']}",
-        "updated_at": f"{response.json()['updated_at']}"
+        "updated_at": f"{response.json()['updated_at']}",
+        "rating_count": 0,
+        "comment_count": 0,
+        "avg_rating": None
     }
 
 
@@ -277,8 +306,8 @@ def test_movieToBe_commented_not_found(client, setup_database, username, passwor
 def test_get_comments_onMovie(client, setup_database, username, password):
     response = client.get(f"/movie/3/comments")
     assert response.status_code == status.HTTP_200_OK
-    assert len(response.json()) == 1
-    assert response.json() == [
+    assert len(response.json()["items"]) == 1
+    assert response.json()["items"] == [
             {
                 "movie_id": 3,
                 "parent_id": None,
@@ -287,6 +316,7 @@ def test_get_comments_onMovie(client, setup_database, username, password):
                 "user_id": 1
             }
     ]
+    assert response.json()["next_cursor"] is None
     
 @pytest.mark.parametrize("username, password", [("username", "testpassword")])
 def test_comment_to_reply_notFound(client, setup_database, username, password):
@@ -311,18 +341,455 @@ def test_comment_to_reply_notFound(client, setup_database, username, password):
     assert response.json().get("detail") == "Comment not found"
 
 
+def test_fetch_movies_cursor_pagination(client, setup_database):
+    # Movies 1 to 3 exist at this point, walk them one page at a time
+    first = client.get("/movie", params={"limit": 2})
+    assert first.status_code == status.HTTP_200_OK
+    assert [movie["id"] for movie in first.json()["items"]] == [1, 2]
+    assert first.json()["prev_cursor"] is None
 
+    second = client.get("/movie", params={"limit": 2, "cursor": first.json()["next_cursor"]})
+    assert second.status_code == status.HTTP_200_OK
+    assert [movie["id"] for movie in second.json()["items"]] == [3]
+    assert second.json()["next_cursor"] is None
 
-    
+    back = client.get("/movie", params={"limit": 2, "cursor": second.json()["prev_cursor"]})
+    assert [movie["id"] for movie in back.json()["items"]] == [1, 2]
+    assert back.json()["prev_cursor"] is None
 
 
+def test_fetch_movies_invalid_cursor(client, setup_database):
+    response = client.get("/movie", params={"cursor": "not-a-cursor"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json().get("detail") == "Invalid cursor"
 
 
+def test_rating_summary(client, setup_database):
+    # Movie 2 was rated 6 by the test user in test_rate_movie
+    response = client.get("/movie/2/ratings/summary")
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data["movie_id"] == 2
+    assert data["rating_count"] == 1
+    assert data["average_rating"] == 6.0
+    assert data["histogram"]["6"] == 1
+    assert sum(data["histogram"].values()) == 1
 
 
-                
+def test_rating_summary_not_found(client, setup_database):
+    response = client.get("/movie/999/ratings/summary")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert response.json().get("detail") == "Movie not found"
+
+
+def test_search_movies(client, setup_database):
+    response = client.get("/movie/search", params={"q": "rate"})
+    assert response.status_code == status.HTTP_200_OK
+    assert [movie["id"] for movie in response.json()["items"]] == [2]
+    assert response.json()["next_offset"] is None
+
+    response = client.get("/movie/search", params={"q": "updated description"})
+    assert [movie["id"] for movie in response.json()["items"]] == [1]
+
+    response = client.get("/movie/search", params={"q": "description", "limit": 2})
+    assert len(response.json()["items"]) == 2
+    assert response.json()["next_offset"] == 2
+
+
+def test_search_movies_no_match(client, setup_database):
+    response = client.get("/movie/search", params={"q": 'nothing "like" this*'})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {"items": [], "next_offset": None}
+
+
+@pytest.mark.parametrize("username, password", [("username", "testpassword")])
+def test_get_comment_tree(client, setup_database, username, password):
+    response = client.post("/user/auth/login", data={"username": username, "password": password})
+    token = response.json()["access_token"]
+    # Comment 1 on movie 3 gets a reply, which gets a reply of its own
+    response = client.post(
+        "/movie/1/reply",
+        json={"comment_id": 1, "content": "Agreed"},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["movie_id"] == 3
+    reply_id = response.json()["id"]
+    response = client.post(
+        f"/movie/{reply_id}/reply",
+        json={"comment_id": reply_id, "content": "Me too"},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+    response = client.get("/movie/3/comments", params={"tree": True})
+    assert response.status_code == status.HTTP_200_OK
+    threads = response.json()["items"]
+    assert [thread["id"] for thread in threads] == [1]
+    assert threads[0]["replies"][0]["content"] == "Agreed"
+    assert threads[0]["replies"][0]["replies"][0]["content"] == "Me too"
+    assert threads[0]["replies"][0]["replies"][0]["replies"] == []
+
+    response = client.get("/movie/3/comments", params={"tree": True, "depth": 1})
+    assert response.json()["items"][0]["replies"][0]["replies"] == []
 
+    # The flat listing is unchanged and keeps replies inline
+    response = client.get("/movie/3/comments")
+    assert [comment["id"] for comment in response.json()["items"]] == [1, 2, 3]
+    assert "replies" not in response.json()["items"][0]
+
+
+def test_cached_movie_invalidated_by_update(client, setup_database):
+    # /movie/1 was cached by test_fetch_movies_by_id before test_update_movie changed it
+    response = client.get("/movie/1")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["title"] == "Updated Test Movie"
+    assert client.get("/movie/1").json() == response.json()
+
+
+def test_conditional_get_movie(client, setup_database):
+    response = client.get("/movie/1")
+    etag = response.headers["ETag"]
+    assert response.headers["Last-Modified"].endswith("GMT")
 
+    response = client.get("/movie/1", headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
 
+    response = client.get("/movie/1", headers={"If-Modified-Since": response.headers["Last-Modified"]})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    response = client.get("/movie/1", headers={"If-None-Match": '"stale"'})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["id"] == 1
+
+    response = client.get("/movie/", headers={"If-None-Match": client.get("/movie/").headers["ETag"]})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+
+@pytest.mark.parametrize("username, password", [("username", "testpassword")])
+def test_conditional_get_comments_changes_with_new_comment(client, setup_database, username, password):
+    etag = client.get("/movie/3/comments").headers["ETag"]
+    assert client.get("/movie/3/comments", headers={"If-None-Match": etag}).status_code == status.HTTP_304_NOT_MODIFIED
+
+    token = client.post("/user/auth/login", data={"username": username, "password": password}).json()["access_token"]
+    client.post("/movie/3/comment", json={"movie_id": 3, "content": "Another one"}, headers={"Authorization": f"Bearer {token}"})
+
+    response = client.get("/movie/3/comments", headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["ETag"] != etag
+
+
+@pytest.mark.parametrize("username, password", [("username", "testpassword")])
+def test_bulk_import_movies(client, setup_database, username, password):
+    token = client.post("/user/auth/login", data={"username": username, "password": password}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    body = (
+        '{"title": "Imported One", "description": "First imported movie"}\n'
+        '{"title": "Imported Two"}\n'
+        'not json\n'
+        '{"title": "Imported Three", "description": "Third imported movie"}\n'
+    )
+    response = client.post("/movie/import", content=body, headers={**headers, "Content-Type": "application/x-ndjson"})
+    assert response.status_code == status.HTTP_200_OK
+    report = response.json()
+    assert report["inserted"] == 2
+    assert report["failed"] == 2
+    assert [error["row"] for error in report["errors"]] == [2, 3]
+
+    body = 'title,description\nImported Four,"Fourth, with a comma"\n'.encode() + b'Broken,"Not \xff UTF-8"\n'
+    response = client.post("/movie/import", content=body, headers={**headers, "Content-Type": "text/csv"})
+    assert response.json() == {"inserted": 1, "failed": 1, "errors": [{"row": 3, "error": "Invalid UTF-8"}]}
+
+    # Imported rows are searchable and start with an empty rating aggregate
+    items = client.get("/movie/search", params={"q": "imported"}).json()["items"]
+    assert sorted(item["title"] for item in items) == ["Imported Four", "Imported One", "Imported Three"]
+    summary = client.get(f"/movie/{items[0]['id']}/ratings/summary").json()
+    assert summary["rating_count"] == 0
+
+
+def test_bulk_import_requires_auth(client, setup_database):
+    response = client.post("/movie/import", content='{"title": "x", "description": "y"}\n')
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_export_movies(client, setup_database):
+    with client.stream("GET", "/movie/export") as response:
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["content-type"] == "application/x-ndjson"
+        rows = [json.loads(line) for line in response.iter_lines() if line]
+    ids = [row["id"] for row in rows]
+    assert ids == sorted(ids) and len(ids) == len(set(ids))
+    assert set(rows[0]) == {"id", "title", "description", "release_date", "updated_at"}
+
+    response = client.get("/movie/export", params={"format": "csv", "ratings": True})
+    assert response.headers["content-type"].startswith("text/csv")
+    records = list(csv.DictReader(io.StringIO(response.text)))
+    assert [int(record["id"]) for record in records] == ids
+    rated = next(record for record in records if record["rating_count"] != "0")
+    summary = client.get(f"/movie/{rated['id']}/ratings/summary").json()
+    assert int(rated["rating_count"]) == summary["rating_count"]
+    assert float(rated["average_rating"]) == summary["average_rating"]
 
 
+@pytest.mark.parametrize("username, password", [("username", "testpassword")])
+def test_batch_rate_movies(client, setup_database, username, password):
+    token = client.post("/user/auth/login", data={"username": username, "password": password}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    etag = client.get("/movie/2/ratings").headers["ETag"]
+
+    # Movie 2 is already rated 6 by this user, movie 1 is not rated yet and is sent twice
+    response = client.post("/movie/ratings", json={"ratings": [
+        {"movie_id": 2, "rating": 9},
+        {"movie_id": 1, "rating": 3},
+        {"movie_id": 999, "rating": 5},
+        {"movie_id": 1, "rating": 4},
+        {"movie_id": 3, "rating": 11}
+    ]}, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data["items"] == [
+        {"movie_id": 2, "rating": 9, "status": "updated"},
+        {"movie_id": 1, "rating": 4, "status": "created"}
+    ]
+    assert sorted(error["movie_id"] for error in data["errors"]) == [3, 999]
+
+    summary = client.get("/movie/2/ratings/summary").json()
+    assert summary["rating_count"] == 1
+    assert summary["average_rating"] == 9.0
+    assert summary["histogram"]["6"] == 0 and summary["histogram"]["9"] == 1
+    assert client.get("/movie/1/ratings/summary").json()["rating_count"] == 1
+
+    # The rating changed in place, the ETag must still change
+    assert client.get("/movie/2/ratings", headers={"If-None-Match": etag}).status_code == status.HTTP_200_OK
+
+    response = client.post("/movie/ratings", json={"ratings": [{"movie_id": 2, "rating": 9}]}, headers=headers)
+    assert response.json()["items"] == [{"movie_id": 2, "rating": 9, "status": "unchanged"}]
+    assert client.get("/movie/2/ratings/summary").json()["rating_count"] == 1
+
+
+@pytest.mark.parametrize("username, password", [("username", "testpassword")])
+def test_write_paths_query_count(client, setup_database, username, password):
+    token = client.post("/user/auth/login", data={"username": username, "password": password}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    with count_queries() as statements:
+        response = client.post("/movie", json={"title": "Counted", "description": "Counted queries"}, headers=headers)
+    assert response.status_code == status.HTTP_201_CREATED
+    assert len(statements) == 2, statements  # The movie and its rating aggregate
+    movie_id = response.json()["id"]
+
+    with count_queries() as statements:
+        response = client.put(f"/movie/{movie_id}", json={"title": "Counted 2", "description": "Counted queries 2"}, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["title"] == "Counted 2"
+    assert len(statements) == 2, statements  # UPDATE ... RETURNING with the owner and duplicate checks inline, and the counters
+
+    with count_queries() as statements:
+        response = client.post(f"/movie/{movie_id}/rate", json={"movie_id": movie_id, "rating": 7}, headers=headers)
+    assert response.json()["rating_count"] == 1
+    assert len(statements) == 2, statements  # The rating, and the aggregate UPDATE ... RETURNING
+
+    with count_queries() as statements:
+        response = client.post(f"/movie/{movie_id}/comment", json={"movie_id": movie_id, "content": "Counted"}, headers=headers)
+    assert response.status_code == status.HTTP_201_CREATED
+    assert len(statements) == 2, statements  # The comment, and its count
+
+    comment_id = client.get(f"/movie/{movie_id}/comments").json()["items"][0]["id"]
+    with count_queries() as statements:
+        response = client.post(f"/movie/{comment_id}/reply", json={"comment_id": comment_id, "content": "Counted reply"}, headers=headers)
+    assert response.json()["movie_id"] == movie_id
+    assert len(statements) == 2, statements
+
+    # The failure paths still tell the cases apart
+    response = client.put(f"/movie/{movie_id}", json={"title": "Counted 3", "description": "Counted queries 2"}, headers=headers)
+    assert response.status_code == status.HTTP_406_NOT_ACCEPTABLE
+    response = client.put("/movie/999", json={"title": "Counted 3", "description": "Counted queries 3"}, headers=headers)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    response = client.post("/movie/999/comment", json={"movie_id": 999, "content": "Nowhere"}, headers=headers)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    response = client.post("/movie/999999/reply", json={"comment_id": 999999, "content": "Nowhere"}, headers=headers)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.parametrize("username, password", [("username", "testpassword")])
+def test_batch_rate_counts_concurrent_rating_as_update(client, setup_database, username, password, monkeypatch):
+    import capstone.movie.crud as crud
+
+    token = client.post("/user/auth/login", data={"username": username, "password": password}).json()["access_token"]
+    locked_ratings = crud._locked_ratings
+    calls = []
+
+    def first_read_misses(db, user_id, movie_ids):
+        # As if another request inserted the rating after this batch first looked
+        calls.append(list(movie_ids))
+        return {} if len(calls) == 1 else locked_ratings(db, user_id, movie_ids)
+
+    monkeypatch.setattr(crud, "_locked_ratings", first_read_misses)
+    before = client.get("/movie/2/ratings/summary").json()["rating_count"]
+    response = client.post("/movie/ratings", json={"ratings": [{"movie_id": 2, "rating": 5}]}, headers={"Authorization": f"Bearer {token}"})
+    assert response.json()["items"] == [{"movie_id": 2, "rating": 5, "status": "updated"}]
+    summary = client.get("/movie/2/ratings/summary").json()
+    assert summary["rating_count"] == before
+    assert summary["average_rating"] == 5.0
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize("username, password", [("username", "testpassword")])
+def test_rating_without_stats_row_counts_existing_ratings(client, setup_database, username, password):
+    from capstone.movie.models import MovieStats, Rating
+
+    token = client.post("/user/auth/login", data={"username": username, "password": password}).json()["access_token"]
+    movie_id = client.post("/movie", json={"title": "Legacy", "description": "Rated before movie_stats"}, headers={"Authorization": f"Bearer {token}"}).json()["id"]
+    # A movie from before the aggregate existed: two ratings from other users and no movie_stats row
+    with TestingSessionLocal() as db:
+        db.query(MovieStats).filter(MovieStats.movie_id == movie_id).delete()
+        db.add_all([Rating(user_id=1000, movie_id=movie_id, rating=2), Rating(user_id=1001, movie_id=movie_id, rating=4)])
+        db.commit()
+
+    summary = client.get(f"/movie/{movie_id}/ratings/summary").json()
+    assert summary["rating_count"] == 2
+    assert summary["average_rating"] == 3.0
+
+    response = client.post(f"/movie/{movie_id}/rate", json={"movie_id": movie_id, "rating": 9}, headers={"Authorization": f"Bearer {token}"})
+    assert response.json()["rating_count"] == 3
+    assert response.json()["average_rating"] == 5.0
+    assert response.json()["histogram"]["9"] == 1
+
+
+@pytest.mark.parametrize("username, password", [("username", "testpassword")])
+def test_movies_carry_rating_and_comment_counts(client, setup_database, username, password):
+    headers = {"Authorization": f"Bearer {client.post('/user/auth/login', data={'username': username, 'password': password}).json()['access_token']}"}
+    movie_id = client.post("/movie", json={"title": "Counters", "description": "Counted on every write"}, headers=headers).json()["id"]
+    page = client.get("/movie/", params={"limit": 100})
+    etag = page.headers["ETag"]
+    assert [movie for movie in page.json()["items"] if movie["id"] == movie_id][0]["comment_count"] == 0
+
+    client.post(f"/movie/{movie_id}/rate", json={"movie_id": movie_id, "rating": 8}, headers=headers)
+    client.post(f"/movie/{movie_id}/comment", json={"movie_id": movie_id, "content": "First"}, headers=headers)
+    comment_id = client.get(f"/movie/{movie_id}/comments").json()["items"][0]["id"]
+    client.post(f"/movie/{comment_id}/reply", json={"comment_id": comment_id, "content": "Replies count too"}, headers=headers)
+
+    movie = client.get(f"/movie/{movie_id}").json()
+    assert (movie["rating_count"], movie["comment_count"], movie["avg_rating"]) == (1, 2, 8.0)
+
+    # The cached list and its validator were invalidated by the writes
+    assert client.get("/movie/", params={"limit": 100}, headers={"If-None-Match": etag}).status_code == status.HTTP_200_OK
+    response_cache.clear()
+    with count_queries() as statements:
+        page = client.get("/movie/", params={"limit": 100}).json()
+    listed = [movie for movie in page["items"] if movie["id"] == movie_id][0]
+    assert (listed["rating_count"], listed["comment_count"], listed["avg_rating"]) == (1, 2, 8.0)
+    # The page validator and the page itself, one query each whatever the page size
+    assert len(statements) == 2, statements
+
+
+def test_fetch_movie_batch(client, setup_database):
+    with count_queries() as statements:
+        response = client.get("/movie/batch", params={"ids": "3,999,1,3"})
+    assert response.status_code == status.HTTP_200_OK
+    assert [movie["id"] for movie in response.json()["items"]] == [3, 1]
+    assert response.json()["missing"] == [999]
+    assert response.json()["items"][1] == client.get("/movie/1").json()
+    assert len(statements) == 1, statements
+
+    # Repeated parameters work as well as a comma separated list
+    response = client.get("/movie/batch", params=[("ids", "2"), ("ids", "1")])
+    assert [movie["id"] for movie in response.json()["items"]] == [2, 1]
+
+    assert client.get("/movie/batch", params={"ids": "1,x"}).status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert client.get("/movie/batch", params={"ids": ","}).status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    too_many = ",".join(str(movie_id) for movie_id in range(1, 102))
+    assert client.get("/movie/batch", params={"ids": too_many}).status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.parametrize("username, password", [("username", "testpassword")])
+def test_top_and_trending_movies(client, setup_database, username, password, monkeypatch):
+    import capstone.movie.crud as crud
+    from capstone.movie.models import bayesian_score
+
+    token = client.post("/user/auth/login", data={"username": username, "password": password}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    loved, panned, unseen = (
+        client.post("/movie", json={"title": f"Ranked {name}", "description": f"Ranked as {name}"}, headers=headers).json()["id"]
+        for name in ("loved", "panned", "unseen")
+    )
+    client.post(f"/movie/{loved}/rate", json={"movie_id": loved, "rating": 10}, headers=headers)
+    client.post(f"/movie/{panned}/rate", json={"movie_id": panned, "rating": 1}, headers=headers)
+    for content in ("Why so low?", "Agreed"):
+        client.post(f"/movie/{panned}/comment", json={"movie_id": panned, "content": content}, headers=headers)
+
+    with count_queries() as statements:
+        response = client.get("/movie/top", params={"limit": 100})
+    assert len(statements) == 1, statements
+    top = response.json()["items"]
+    assert [movie["score"] for movie in top] == sorted((movie["score"] for movie in top), reverse=True)
+    ranked = [movie["id"] for movie in top]
+    assert ranked.index(loved) < ranked.index(panned)
+    assert unseen not in ranked  # Unrated movies are not ranked at all
+    loved_entry = top[ranked.index(loved)]
+    assert loved_entry["score"] == round(bayesian_score(1, 10), 4)
+    assert (loved_entry["rating_count"], loved_entry["avg_rating"]) == (1, 10.0)
+
+    trending = {movie["id"]: movie["score"] for movie in client.get("/movie/trending", params={"limit": 100}).json()["items"]}
+    assert trending[panned] == pytest.approx(3, rel=1e-3)  # One rating and two comments, all just now
+    assert trending[loved] == pytest.approx(1, rel=1e-3)
+    assert unseen not in trending
+
+    # A half-life from now the same activity counts half
+    monkeypatch.setattr(crud, "TRENDING_EPOCH", crud.TRENDING_EPOCH - timedelta(hours=crud.TRENDING_HALF_LIFE_HOURS))
+    trending = {movie["id"]: movie["score"] for movie in client.get("/movie/trending", params={"limit": 100}).json()["items"]}
+    assert trending[panned] == pytest.approx(1.5, rel=1e-3)
+
+
+def test_export_average_rounds_numeric_on_asyncpg():
+    from sqlalchemy.dialects.postgresql.asyncpg import dialect
+
+    from capstone.movie.export import export_query
+
+    sql = str(export_query(include_ratings=True).compile(dialect=dialect()))
+    # round(double precision, integer) does not exist in Postgres
+    assert re.search(r"round\(CAST\(.*movie_stats\.rating_sum.* AS NUMERIC\), \$\d+::INTEGER\)", sql), sql
+
+
+@pytest.mark.parametrize("username, password", [("username", "testpassword")])
+def test_conditional_get_movies_page_after_delete(client, setup_database, username, password):
+    headers = {"Authorization": f"Bearer {client.post('/user/auth/login', data={'username': username, 'password': password}).json()['access_token']}"}
+    movie_id = client.post("/movie", json={"title": "Short lived", "description": "Listed, then deleted"}, headers=headers).json()["id"]
+    response = client.get("/movie/", params={"limit": 100})
+    assert movie_id in [movie["id"] for movie in response.json()["items"]]
+    # List pages are validated by ETag alone, the newest timestamp left on a page says nothing about deletions
+    assert "Last-Modified" not in response.headers
+    etag = response.headers["ETag"]
+
+    assert client.delete(f"/movie/{movie_id}", headers=headers).status_code == status.HTTP_204_NO_CONTENT
+    response = client.get("/movie/", params={"limit": 100}, headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert movie_id not in [movie["id"] for movie in response.json()["items"]]
+    response = client.get("/movie/", params={"limit": 100}, headers={"If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT"})
+    assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.parametrize("username, password", [("username", "testpassword")])
+def test_bulk_import_size_limit(client, setup_database, username, password, monkeypatch):
+    import capstone.movie.bulk as bulk
+
+    token = client.post("/user/auth/login", data={"username": username, "password": password}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/x-ndjson"}
+    line = '{"title": "Oversized", "description": "Over the import limit"}\n'
+    monkeypatch.setattr(bulk, "IMPORT_MAX_BYTES", len(line) * 2)
+    monkeypatch.setattr(bulk, "IMPORT_SPOOL_BYTES", len(line))
+
+    # Turned away on the declared Content-Length
+    response = client.post("/movie/import", content=line * 3, headers=headers)
+    assert response.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    # And on the bytes actually read when the body is chunked
+    response = client.post("/movie/import", content=iter([line.encode()] * 3), headers=headers)
+    assert response.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    assert client.get("/movie/search", params={"q": "oversized"}).json()["items"] == []
+
+    # At the limit, with the second half written past the spool threshold
+    response = client.post("/movie/import", content=iter([line.encode()] * 2), headers=headers)
+    assert response.json() == {"inserted": 2, "failed": 0, "errors": []}
@@ -0,0 +1,23 @@
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.bench_startup import LAZY_MODULES
+
+
+def test_importing_the_app_stays_lazy(tmp_path):
+    # A fresh interpreter and an empty database, so nothing earlier tests imported or created counts
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path / 'startup.db'}", LOG_SINK="papertrail")
+    script = (
+        "import json, sys, threading, capstone.main\n"
+        "print(json.dumps({'modules': sorted(sys.modules), 'threads': [t.name for t in threading.enumerate()]}))"
+    )
+    result = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, check=True)
+    state = json.loads(result.stdout.splitlines()[-1])
+
+    assert [name for name in LAZY_MODULES if name in state["modules"]] == []
+    # No log listener thread and no syslog socket until something is logged
+    assert "log-listener" not in state["threads"]
+    # And no DDL, the schema belongs to the migrations
+    assert not (tmp_path / "startup.db").exists() or (tmp_path / "startup.db").stat().st_size == 0
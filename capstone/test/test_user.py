@@ -1,27 +1,33 @@
 import os
 
-from dotenv import load_dotenv
-
 import pytest
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 
+from datetime import timedelta
+
+from jose import jwt as jose_jwt
+from passlib.hash import bcrypt
+
 from fastapi.testclient import TestClient
 from fastapi  import status
 
+from capstone.auth.hash import BCRYPT_ROUNDS, get_pwd_context
+from capstone.auth.jwt import create_access_token
+from capstone.cache import response_cache
 from capstone.database import Base, get_db
 from capstone.main import app
+from capstone.user.models import User
 
-load_dotenv()
-
+# .env has already been loaded by capstone.settings
 SQLALCHEMY_DATABASE_URL = os.getenv("SQLALCHEMY_DATABASE_URL")
 
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 Base.metadata.create_all(bind=engine)
 
@@ -45,6 +51,7 @@ def client():
 @pytest.fixture(scope="module")
 def setup_database():
     Base.metadata.create_all(bind=engine)
+    response_cache.clear()  # Cached responses belong to the previous module's database
     yield
     Base.metadata.drop_all(bind=engine)
 
@@ -140,4 +147,86 @@ def test_password_incorrect(client, setup_database, username, email, password):
     assert response.json() == {"detail": "Incorrect password"}
 
 
+@pytest.mark.parametrize("username, password", [("newuser2", "123")])
+def test_login_token_claims(client, setup_database, username, password):
+    response = client.post(
+        "/user/auth/login",
+        data = {"username": username, "password": password}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    claims = jose_jwt.get_unverified_claims(response.json()["access_token"])
+    assert claims["sub"] == username
+    assert type(claims["uid"]) == int
+    assert claims["exp"] > claims["iat"]
+
+
+def test_expired_token_rejected(client, setup_database):
+    token = create_access_token({"sub": "newuser2", "uid": 1}, expires_delta=timedelta(seconds=-1))
+    response = client.post(
+        "/movie",
+        json={"title": "Expired", "description": "Expired token movie"},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    assert response.json() == {"detail": "Could not validate credentials"}
+
 
+@pytest.mark.parametrize("username, password", [("newuser2", "123")])
+def test_login_rehashes_outdated_cost(client, setup_database, username, password):
+    # Store a hash made with a cheaper cost than the configured BCRYPT_ROUNDS
+    db = TestingSessionLocal()
+    user = db.query(User).filter(User.username == username).first()
+    user.password = bcrypt.using(rounds=4).hash(password)
+    db.commit()
+    assert get_pwd_context().needs_update(user.password)
+
+    response = client.post(
+        "/user/auth/login",
+        data = {"username": username, "password": password}
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+    db.expire_all()
+    user = db.query(User).filter(User.username == username).first()
+    assert f"${BCRYPT_ROUNDS:02d}$" in user.password
+    assert not get_pwd_context().needs_update(user.password)
+    assert get_pwd_context().verify(password, user.password)
+    db.close()
+
+
+def test_profile_pages_movies_and_counts_in_sql(client, setup_database):
+    client.post("/user/signup", json={"username": "profiler", "email": "profiler@example.com", "password": "123"})
+    token = client.post("/user/auth/login", data={"username": "profiler", "password": "123"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    movie_ids = [
+        client.post("/movie/", json={"title": f"Profile {n}", "description": f"Profile movie {n}"}, headers=headers).json()["id"]
+        for n in range(3)
+    ]
+    client.post(f"/movie/{movie_ids[0]}/rate", json={"movie_id": movie_ids[0], "rating": 7}, headers=headers)
+    client.post(f"/movie/{movie_ids[0]}/comment", json={"movie_id": movie_ids[0], "content": "Mine"}, headers=headers)
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        response = client.get("/user/profiler", params={"limit": 2})
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert response.status_code == status.HTTP_200_OK
+    # The user with its counts, then one page of movies
+    assert len(statements) == 2
+
+    profile = response.json()
+    assert (profile["username"], profile["movie_count"], profile["rating_count"], profile["comment_count"]) == ("profiler", 3, 1, 1)
+    assert [movie["id"] for movie in profile["movies"]["items"]] == movie_ids[:2]
+    assert set(profile["movies"]["items"][0]) == {"id", "title", "release_date"}
+
+    rest = client.get("/user/profiler", params={"limit": 2, "cursor": profile["movies"]["next_cursor"]}).json()
+    assert [movie["id"] for movie in rest["movies"]["items"]] == movie_ids[2:]
+    assert rest["movies"]["next_cursor"] is None
+
+
+def test_profile_of_unknown_user(client, setup_database):
+    response = client.get("/user/nobody-by-this-name")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert response.json() == {"detail": "User not found"}
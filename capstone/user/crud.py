@@ -1,73 +1,133 @@
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import func, or_, select
 
-from capstone.database import db_dependency
+from capstone.database import db_dependency, run_in_session
 from capstone.user.schema import SignUpModel
 from capstone.auth.hash import Hash
 from capstone.user.models import User 
+from capstone.movie.models import Comment, Movie, Rating
 from capstone.auth.jwt import create_access_token
+from capstone.auth.oauth2 import invalidate_principal
 
 from capstone.logger import get_logger
+from capstone.pagination import paginate
 
 # Enable sending logs from the standard Python logging module to Sentry
 
 logger = get_logger(__name__)
 
 
-def sign_up(db : db_dependency, payload : SignUpModel):
+async def sign_up(db : db_dependency, payload : SignUpModel):
     logger.info("Creating a new user: %s", payload.username)
-    db_email = db.query(User).filter(User.email == payload.email).first()
-    if db_email:
+    await run_in_session(db, check_new_user, payload)
+    # bcrypt runs on the hashing pool so it never holds the event loop or a threadpool slot
+    hashed_password = await Hash.bcrypt_async(payload.password)
+    new_user = await run_in_session(db, create_user, payload, hashed_password)
+    logger.info("User %s has been created", payload.username)
+    return new_user
+
+
+def check_new_user(db : db_dependency, payload : SignUpModel):
+    # Both unique columns in one query, the email clash is reported first as before
+    taken = db.execute(
+        select(User.email, User.username).where(or_(User.email == payload.email, User.username == payload.username))
+    ).all()
+    if any(row.email == payload.email for row in taken):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Email already exists"
             )
-    db_username = db.query(User).filter(User.username == payload.username).first()
-    if db_username:
+    if taken:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Username already exists"
             )
-    
-    hashed_password = Hash.bcrypt(payload.password)
+
+
+def create_user(db : db_dependency, payload : SignUpModel, hashed_password : str):
     new_user = User(
         email = payload.email,
         username = payload.username,
-        password = hashed_password
+        password = hashed_password,
+        movies = [] # A new user owns no movies, so the response never has to lazy-load them
     )
     db.add(new_user)
     db.commit()
-    db.refresh(new_user)
-    logger.info(f"User {payload.username} has been created")
+    invalidate_principal(new_user.username)  # Never serve a principal cached for an earlier account with this name
     return new_user
 
 
-def login(db : db_dependency, payload : OAuth2PasswordRequestForm = Depends()):
-    logger.info(f"Login attempt for user: {payload.username}")
+async def login(db : db_dependency, payload : OAuth2PasswordRequestForm = Depends()):
+    logger.info("Login attempt for user: %s", payload.username)
 
         # Fetch the user, and handle "user not found" error
-    user = db.query(User).filter(User.username == payload.username).first()
+    user = await run_in_session(db, get_user_by_username, payload.username)
     if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Invalid credentials"
             )
 
-    logger.info(f"User found: {payload.username}")
+    logger.info("User found: %s", payload.username)
         # Verify the password, and handle "incorrect password" error
-    if not Hash.verify(payload.password, user.password):
+    valid, new_hash = await Hash.verify_and_update_async(payload.password, user.password)
+    if not valid:
         raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Incorrect password"
             )
-    logger.info(f"Password verified for user: {payload.username}")
+    logger.info("Password verified for user: %s", payload.username)
+    if new_hash:
+        # The stored hash was made with a different BCRYPT_ROUNDS, upgrade it while we have the password
+        await run_in_session(db, update_password, user.id, new_hash)
+        logger.info("Password hash for user %s rehashed with the current cost", payload.username)
 
     access_token =  create_access_token(data = {
-        "sub" : user.username
+        "sub" : user.username,
+        "uid" : user.id
     })
-    logger.info(f"User {payload.username} logged in successfully")
+    logger.info("User %s logged in successfully", payload.username)
     
     return {
         "access_token" : access_token,
         "token_type" : "bearer"
-    }
\ No newline at end of file
+    }
+
+
+def fetch_profile(db : db_dependency, username : str, cursor : str | None = None, limit : int = 10):
+    logger.info("Fetching the profile of user %s with cursor=%s and limit=%s", username, cursor, limit)
+    # The counts are computed by the database in the same round trip as the user lookup
+    user = db.execute(
+        select(
+            User.id,
+            User.username,
+            select(func.count()).where(Movie.user_id == User.id).scalar_subquery().label("movie_count"),
+            select(func.count()).where(Rating.user_id == User.id).scalar_subquery().label("rating_count"),
+            select(func.count()).where(Comment.user_id == User.id).scalar_subquery().label("comment_count"),
+        ).where(User.username == username)
+    ).first()
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+
+    # Only the listed columns of one page, never the whole catalog and never the descriptions
+    movies = db.query(Movie.id, Movie.title, Movie.release_date).filter(Movie.user_id == user.id)
+    return {
+        "username": user.username,
+        "movie_count": user.movie_count,
+        "rating_count": user.rating_count,
+        "comment_count": user.comment_count,
+        "movies": paginate(movies, Movie.id, cursor, limit),
+    }
+
+
+def get_user_by_username(db : db_dependency, username : str):
+    return db.query(User).filter(User.username == username).first()
+
+
+def update_password(db : db_dependency, user_id : int, hashed_password : str):
+    db.query(User).filter(User.id == user_id).update({User.password: hashed_password}, synchronize_session=False)
+    db.commit()
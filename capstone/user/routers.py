@@ -1,8 +1,8 @@
-from fastapi import APIRouter, Depends, status
+from fastapi import APIRouter, Depends, Query, status
 from fastapi.security import OAuth2PasswordRequestForm
 
-from capstone.database import db_dependency
-from capstone.user.schema import SignUpModel, UserResponse
+from capstone.database import db_dependency, run_in_session
+from capstone.user.schema import SignUpModel, UserProfile, UserResponse
 import capstone.user.crud as crud 
 
 
@@ -13,7 +13,7 @@ user_router = APIRouter(
 
 
 @user_router.post("/signup", response_model= UserResponse, status_code= status.HTTP_201_CREATED)
-def sign_up(db : db_dependency, payload : SignUpModel):
+async def sign_up(db : db_dependency, payload : SignUpModel):
 
     """
     ## Creates a user
@@ -25,10 +25,10 @@ def sign_up(db : db_dependency, payload : SignUpModel):
     ```
     """
         
-    return crud.sign_up(db, payload)
+    return await crud.sign_up(db, payload)
 
 @user_router.post("/auth/login", status_code= status.HTTP_200_OK)
-def login(db : db_dependency, payload : OAuth2PasswordRequestForm = Depends()):
+async def login(db : db_dependency, payload : OAuth2PasswordRequestForm = Depends()):
 
     """
     ## Login a user
@@ -40,4 +40,16 @@ def login(db : db_dependency, payload : OAuth2PasswordRequestForm = Depends()):
     and returns a token pair 'access' 
     """
 
-    return crud.login(db, payload)
+    return await crud.login(db, payload)
+
+
+@user_router.get("/{username}", response_model= UserProfile)
+async def fetch_profile(db : db_dependency, username : str, cursor : str | None = None, limit : int = Query(10, ge=1, le=100)):
+
+    """
+    ## Fetches a user's profile
+    Returns how many movies, ratings and comments the user has,
+    and a page of their movies, use `next_cursor` for the next one
+    """
+
+    return await run_in_session(db, crud.fetch_profile, username, cursor, limit)
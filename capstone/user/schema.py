@@ -2,7 +2,7 @@ from typing import Optional
 
 from pydantic import BaseModel, ConfigDict
 
-from capstone.movie.schema import Movie
+from capstone.movie.schema import Movie, MovieListItem
 
 
 class SignUpModel(BaseModel):
@@ -40,6 +40,19 @@ class UserResponse(BaseModel):
         }
     )
         
+class UserMoviePage(BaseModel):
+    items: list[MovieListItem]
+    next_cursor: str | None
+    prev_cursor: str | None
+
+class UserProfile(BaseModel):
+    username : str
+    movie_count : int
+    rating_count : int
+    comment_count : int
+    # One capped page of the user's movies, follow next_cursor for the rest
+    movies : UserMoviePage
+
 class Login(BaseModel):
     username: str
     password: str
@@ -53,6 +66,12 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     username: Optional[str] = None
+    user_id: Optional[int] = None
+
+
+class CurrentUser(BaseModel):
+    id: int
+    username: str
 
 
 